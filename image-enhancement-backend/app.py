@@ -1,38 +1,60 @@
 import logging
-from flask import Flask, session
+import os
+from flask import Flask
 from flask_cors import CORS
-from flask_login import LoginManager
 from config import Config
 from routes.upload import upload_bp
 from routes.health import health_bp
 from routes.auth import auth_bp
 from routes.enhance_proxy import enhance_proxy
 from routes.gallery import gallery_bp
+from routes.metrics import metrics_bp
+from services import metrics
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app, supports_credentials=True)
-app.config.from_object(Config)
-
-# Configure Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("backend.log"),  # Logs to a file
-        logging.StreamHandler()  # Logs to terminal
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Register Blueprints
-app.register_blueprint(upload_bp)
-app.register_blueprint(health_bp)
-app.register_blueprint(auth_bp)
-app.register_blueprint(enhance_proxy)
-app.register_blueprint(gallery_bp)
 
-logger.info("Backend initialized and running!")
+def create_app(config=Config):
+    """
+    Builds the Flask app. Only cheap work happens here: the S3 client, Gradio
+    connections and the index database are created on first use, and Pillow,
+    numpy and gradio_client are imported when first needed, so workers boot
+    (and fork) quickly and start even while a backend is unreachable.
+    Raises ValueError if required settings are missing.
+    """
+    config.validate()
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+
+    # Initialize Flask app
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True)
+    app.config.from_object(config)
+
+    # Request timing and trace IDs (installs the trace_id log attribute when enabled)
+    metrics.init_app(app)
+
+    # Configure Logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - [%(trace_id)s] %(message)s" if config.TRACE_IDS
+        else "%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler("backend.log"),  # Logs to a file
+            logging.StreamHandler()  # Logs to terminal
+        ]
+    )
+
+    # Register Blueprints
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(enhance_proxy)
+    app.register_blueprint(gallery_bp)
+    app.register_blueprint(metrics_bp)
+
+    logger.info("Backend initialized and running!")
+    return app
+
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,408 @@
+"""
+Load-test harness for the backend's hot paths.
+
+Runs the real Flask app on a local HTTP server against an in-process S3
+(moto) and a stub Gradio client with configurable latency, then measures
+throughput and p50/p95/p99 latency of /upload, /enhance and /gallery at the
+requested concurrency levels, image sizes and gallery sizes.
+
+    python benchmark.py --concurrency 1,8 --sizes 512,2048 --output bench.json
+    python benchmark.py --baseline bench.json       # compare with an earlier run
+
+Requires the packages in requirements-bench.txt.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Placeholder settings so the app can be imported without real AWS or Firebase credentials
+os.environ.update(
+    AWS_ACCESS_KEY_ID="benchmark",
+    AWS_SECRET_ACCESS_KEY="benchmark",
+    AWS_BUCKET_NAME="sharpify-benchmark",
+    AWS_REGION="us-east-1",
+    FIREBASE_API_KEY="benchmark",
+    FIREBASE_PROJECT_ID="sharpify-benchmark",
+    GRADIO_URLS="http://gradio-stub",
+)
+os.environ.setdefault("GRADIO_PROBE_INTERVAL", "0")
+# Measure raw capacity; set ADMISSION_ENABLED=true to benchmark with the rate limits in place
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+os.environ.setdefault("INDEX_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="sharpify-bench-"), "run_index.db"))
+
+PROJECT_ID = os.environ["FIREBASE_PROJECT_ID"]
+
+
+class StubJob:
+    """Stands in for a gradio_client Job: result() waits out the configured latency."""
+
+    def __init__(self, path: str, latency: float):
+        self._path = path
+        self._ready_at = time.monotonic() + latency
+
+    def result(self, timeout=None):
+        time.sleep(max(0.0, self._ready_at - time.monotonic()))
+        return self._path
+
+
+class StubGradioClient:
+    """
+    Replaces the Gradio client. Reads the input's dimensions from its S3 header like the
+    real backend would fetch it, and returns a local file `scale` times larger, as
+    gradio_client does after downloading a result. Outputs are rendered once per size.
+    """
+
+    latency = 0.5
+    jitter = 0.1
+    scale = 2
+    _outputs: dict[tuple[int, int], str] = {}
+    _lock = threading.Lock()
+    _workdir = tempfile.mkdtemp(prefix="sharpify-gradio-")
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def submit(self, file_url, *flags, api_name="/predict"):
+        from config import Config
+        from services.s3_service import public_url, read_object_range
+        from utils.helpers import probe_image
+
+        key = file_url[len(public_url("")):]
+        _, width, height, _ = probe_image(read_object_range(key, Config.UPLOAD_HEADER_BYTES))
+        latency = max(0.0, random.gauss(self.latency, self.jitter * self.latency))
+        return StubJob(self._output(width * self.scale, height * self.scale), latency)
+
+    @classmethod
+    def _output(cls, width: int, height: int) -> str:
+        with cls._lock:
+            path = cls._outputs.get((width, height))
+            if path is None:
+                path = os.path.join(cls._workdir, f"{width}x{height}.png")
+                sample_image(width, height).save(path, "PNG")
+                cls._outputs[(width, height)] = path
+            return path
+
+
+def sample_image(width: int, height: int, seed: int = 0):
+    """Builds a smooth test image; `seed` changes a few pixels so each upload has distinct bytes."""
+    from PIL import Image
+
+    gradient = Image.radial_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT), gradient.rotate(90)))
+    image.putpixel((0, 0), (seed % 256, seed // 256 % 256, seed // 65536 % 256))
+    return image
+
+
+# Seeds are never reused, so no request is answered from the result cache of an earlier case
+_seeds = count(1)
+
+
+def sample_png(size: int) -> bytes:
+    buffer = io.BytesIO()
+    sample_image(size, size, next(_seeds)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class Harness:
+    """Starts the app against local stand-ins and issues authenticated requests to it."""
+
+    def __init__(self, args):
+        from moto import mock_aws
+
+        self._mock = mock_aws()
+        self._mock.start()
+
+        import boto3
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        boto3.client("s3", region_name=os.environ["AWS_REGION"]).create_bucket(Bucket=os.environ["AWS_BUCKET_NAME"])
+
+        # Sign tokens locally and trust the matching key, so auth runs its real verification path
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._key.public_key()))
+        jwk["kid"] = "benchmark"
+
+        from app import create_app
+        import routes.auth as auth
+        import services.enhancement as enhancement
+        from services.firebase_auth import FirebaseTokenVerifier, PublicKeyCache
+        from services.gradio_pool import GradioPool
+
+        auth.local_verifier = FirebaseTokenVerifier(PROJECT_ID, PublicKeyCache(lambda: ({"benchmark": jwk}, 3600)))
+        StubGradioClient.latency = args.gradio_latency
+        StubGradioClient.jitter = args.gradio_jitter
+        StubGradioClient.scale = args.scale
+        enhancement.gradio_pool = GradioPool(
+            ["http://gradio-stub"], client_factory=StubGradioClient,
+            max_clients=args.gradio_clients, probe_interval=0
+        )
+
+        from werkzeug.serving import make_server
+
+        self._server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self._local = threading.local()
+        self._tokens: dict[str, str] = {}
+
+    def close(self):
+        from services import s3_service
+
+        self._server.shutdown()
+        # Let background derivative uploads finish before the S3 stand-in goes away
+        s3_service._derivative_pool.shutdown(wait=True)
+        self._mock.stop()
+
+    def token(self, email: str) -> str:
+        import jwt
+
+        now = int(time.time())
+        claims = {
+            "sub": email, "email": email, "aud": PROJECT_ID,
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+            "iat": now, "exp": now + 3600, "auth_time": now,
+        }
+        return jwt.encode(claims, self._key, algorithm="RS256", headers={"kid": "benchmark"})
+
+    def session(self):
+        """One pooled HTTP session per load-generating thread."""
+        import requests
+
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def request(self, method: str, path: str, email: str, **kwargs):
+        headers = {"Authorization": f"Bearer {self.token_for(email)}"}
+        r = self.session().request(method, self.base_url + path, headers=headers, timeout=600, **kwargs)
+        if r.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {r.status_code}: {r.text[:200]}")
+        return r
+
+    def token_for(self, email: str) -> str:
+        if email not in self._tokens:
+            self._tokens[email] = self.token(email)
+        return self._tokens[email]
+
+    def upload(self, email: str, data: bytes) -> dict:
+        files = {"file": ("bench.png", data, "image/png")}
+        return self.request("POST", "/upload", email, files=files).json()
+
+    def enhance(self, email: str, upload: dict, poll: float = 0.02) -> dict:
+        body = {"file_url": upload["file_url"], "run_id": upload["run_id"], "face": True}
+        job = self.request("POST", "/enhance", email, json=body).json()
+        while True:
+            status = self.request("GET", f"/enhance/{job['job_id']}", email).json()
+            if status["status"] == "done":
+                return status
+            if status["status"] == "failed":
+                raise RuntimeError(f"Enhancement failed: {status.get('error')}")
+            time.sleep(poll)
+
+
+def run_load(fn, count: int, concurrency: int) -> dict:
+    """Calls fn(i) for i in range(count) on `concurrency` threads and summarises the latencies."""
+    import numpy as np
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(count)))
+    wall = time.perf_counter() - started
+
+    summary = {"requests": count, "errors": len(errors), "wall_s": round(wall, 3),
+               "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0}
+    if latencies:
+        ms = np.array(latencies) * 1000
+        summary.update({
+            "mean_ms": round(float(ms.mean()), 2),
+            "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2),
+            "p99_ms": round(float(np.percentile(ms, 99)), 2),
+            "max_ms": round(float(ms.max()), 2),
+        })
+    if errors:
+        summary["first_error"] = errors[0]
+    return summary
+
+
+def bench_upload(h: Harness, args, concurrency: int, size: int) -> dict:
+    email = f"upload-{size}-{concurrency}@bench.local"
+    payloads = [sample_png(size) for _ in range(args.requests)]
+    return run_load(lambda i: h.upload(email, payloads[i]), args.requests, concurrency)
+
+
+def bench_enhance(h: Harness, args, concurrency: int, size: int) -> dict:
+    # Spread jobs over a few users so the fair queue interleaves them as in production
+    emails = [f"enhance-{size}-{concurrency}-{u}@bench.local" for u in range(args.users)]
+    uploads = [h.upload(emails[i % args.users], sample_png(size)) for i in range(args.requests)]
+    return run_load(lambda i: h.enhance(emails[i % args.users], uploads[i]), args.requests, concurrency)
+
+
+def bench_gallery(h: Harness, args, concurrency: int, gallery_size: int) -> dict:
+    from routes.gallery import encode_cursor
+    from services import run_index
+    from utils.helpers import user_folder_for
+
+    # Seed the index directly; /gallery only reads it
+    email = f"gallery-{gallery_size}@bench.local"
+    folder = user_folder_for(email)
+    now = time.time()
+    runs = [
+        {"run_id": f"{i:032x}", "key": f"{folder}/enhanced_{i:032x}.png",
+         "enhancements": ["face"], "created_at": now - i}
+        for i in range(gallery_size)
+    ]
+    run_index.replace_user(folder, runs, [])
+
+    # Request pages at random depths, as users scrolling through long histories do
+    rng = random.Random(gallery_size)
+    positions = [rng.randrange(gallery_size) for _ in range(args.requests)]
+    cursors = [None if p < args.page_size else encode_cursor(runs[p]) for p in positions]
+
+    def fetch(i):
+        params = {"limit": args.page_size}
+        if cursors[i]:
+            params["cursor"] = cursors[i]
+        h.request("GET", "/gallery", email, params=params).json()
+
+    return run_load(fetch, args.requests, concurrency)
+
+
+SCENARIOS = {
+    "upload": (bench_upload, "image_size"),
+    "enhance": (bench_enhance, "image_size"),
+    "gallery": (bench_gallery, "gallery_size"),
+}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    """Prints the change in p95 latency and throughput against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = {_case(r): r for r in json.load(f)["results"]}
+    print(f"\nChange vs {baseline_path}:")
+    for r in results:
+        old = baseline.get(_case(r))
+        if not old or "p95_ms" not in old or "p95_ms" not in r:
+            continue
+        p95 = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        rps = (r["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100 if old["throughput_rps"] else 0.0
+        print(f"  {_label(r):<40} p95 {p95:+7.1f}%   throughput {rps:+7.1f}%")
+
+
+def _case(r: dict) -> tuple:
+    return r["scenario"], r["concurrency"], r.get("image_size"), r.get("gallery_size")
+
+
+def _label(r: dict) -> str:
+    size = f"{r['image_size']}px" if "image_size" in r else f"{r['gallery_size']} runs"
+    return f"{r['scenario']} c={r['concurrency']} {size}"
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SharpifyAI backend load test")
+    parser.add_argument("--scenarios", default="upload,enhance,gallery",
+                        help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 16], help="Concurrent clients, e.g. 1,4,16")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per case")
+    parser.add_argument("--sizes", type=_ints, default=[512, 2048], help="Square image sizes in pixels")
+    parser.add_argument("--gallery-sizes", type=_ints, default=[100, 10000], help="Runs per gallery user")
+    parser.add_argument("--page-size", type=int, default=50, help="Gallery page size")
+    parser.add_argument("--users", type=int, default=4, help="Distinct users submitting enhancement jobs")
+    parser.add_argument("--gradio-latency", type=float, default=0.5, help="Mean stub inference time in seconds")
+    parser.add_argument("--gradio-jitter", type=float, default=0.1, help="Latency standard deviation, as a fraction")
+    parser.add_argument("--gradio-clients", type=int, default=4, help="Concurrent predictions the stub accepts")
+    parser.add_argument("--scale", type=int, default=2, help="Upscaling factor of the stub's output")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare with a previous --output file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's INFO logs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    h = Harness(args)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    results = []
+    try:
+        for scenario in scenarios:
+            fn, dimension = SCENARIOS[scenario]
+            values = args.sizes if dimension == "image_size" else args.gallery_sizes
+            for value in values:
+                for concurrency in args.concurrency:
+                    summary = fn(h, args, concurrency, value)
+                    result = {"scenario": scenario, "concurrency": concurrency, dimension: value, **summary}
+                    results.append(result)
+                    print(f"{_label(result):<40} {result['throughput_rps']:>8.2f} req/s   "
+                          f"p50 {result.get('p50_ms', 0):>9.1f} ms   p95 {result.get('p95_ms', 0):>9.1f} ms   "
+                          f"p99 {result.get('p99_ms', 0):>9.1f} ms   errors {result['errors']}", flush=True)
+    finally:
+        h.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "verbose")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
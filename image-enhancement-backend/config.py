@@ -11,20 +11,94 @@ class Config:
     AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
     AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
     AWS_REGION = os.getenv("AWS_REGION")
-
-    if not all([AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME, AWS_REGION]):
-        raise ValueError("Missing AWS configuration in .env file!")
+    S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))  # seconds
+    S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))  # shared by all threads
 
     # Upload Configuration
     UPLOAD_FOLDER = "./uploads"
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    MAX_WIDTH = int(os.getenv("MAX_WIDTH", "5000"))  # maximum accepted resolution of originals
+    MAX_HEIGHT = int(os.getenv("MAX_HEIGHT", "5000"))
+    MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(MAX_WIDTH * MAX_HEIGHT)))  # decompression bomb limit
+    # Decoding limit for images the backend produces itself (a 4x upscale has 16x the pixels of its input)
+    RESULT_MAX_PIXELS = int(os.getenv("RESULT_MAX_PIXELS", str(MAX_IMAGE_PIXELS * 16)))
+
+    # Tiled enhancement of large originals (raise MAX_WIDTH/MAX_HEIGHT to accept bigger images)
+    TILED_ENHANCEMENT = os.getenv("TILED_ENHANCEMENT", "true").lower() == "true"
+    # Longest side above which inputs are tiled; below PREPROCESS_MAX_SIDE so capped inputs still tile
+    TILE_THRESHOLD = int(os.getenv("TILE_THRESHOLD", "1536"))
+    TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+    TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "64"))  # pixels shared by neighbouring tiles, feathered
+    TILE_WORKERS = int(os.getenv("TILE_WORKERS", "2"))  # tiles in flight per image
+    TILE_TMP_DIR = os.getenv("TILE_TMP_DIR")  # scratch space for memory-mapped buffers (default: system temp)
+
+    # Normalisation of originals before inference: cap the working resolution, apply EXIF orientation,
+    # convert colour modes and re-encode compactly (AUTO keeps JPEG sources in JPEG, others become PNG).
+    # Inputs still above TILE_THRESHOLD are tiled; PREPROCESS_MAX_SIDE=0 keeps full resolution.
+    PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+    PREPROCESS_MAX_SIDE = int(os.getenv("PREPROCESS_MAX_SIDE", "2048"))  # longest side, pixels
+    PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "AUTO").upper()  # AUTO, PNG, JPEG or WEBP
+    PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "95"))  # lossy formats only
+
+    # Re-encoding applied only to uploads that cannot be passed through as-is
+    UPLOAD_CONVERT_FORMAT = os.getenv("UPLOAD_CONVERT_FORMAT", "PNG").upper()  # PNG, JPEG or WEBP
+    UPLOAD_CONVERT_QUALITY = int(os.getenv("UPLOAD_CONVERT_QUALITY", "90"))  # lossy formats only
+
+    # Thumbnail and preview derivatives generated in the background for every original and result
+    DERIVATIVES_ENABLED = os.getenv("DERIVATIVES_ENABLED", "true").lower() == "true"
+    DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+    DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))  # longest side, pixels
+    PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "1024"))
+    DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+
+    # Quality metrics (PSNR, SSIM, ΔE₀₀) and comparison plots computed in the background after enhancement
+    QUALITY_METRICS_ENABLED = os.getenv("QUALITY_METRICS_ENABLED", "true").lower() == "true"
+    QUALITY_WORKERS = int(os.getenv("QUALITY_WORKERS", "1"))  # runs measured in parallel per process
+    QUALITY_BAND_ROWS = int(os.getenv("QUALITY_BAND_ROWS", "256"))  # image rows compared at a time
+
+    # Direct-to-S3 uploads (presigned POST, or multipart above the threshold)
+    PRESIGNED_UPLOAD_EXPIRES = int(os.getenv("PRESIGNED_UPLOAD_EXPIRES", "900"))  # seconds
+    MULTIPART_THRESHOLD = int(os.getenv("MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+    MULTIPART_PART_SIZE = int(os.getenv("MULTIPART_PART_SIZE", str(5 * 1024 * 1024)))  # S3 minimum is 5MB
+    UPLOAD_HEADER_BYTES = int(os.getenv("UPLOAD_HEADER_BYTES", str(256 * 1024)))  # read to check dimensions
     SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "default_secret_key")
 
+    # Concurrent delete_objects batches (1,000 keys each) for run and account deletion
+    DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", "4"))
+
+    # Storage lifecycle job (`python manage.py compact-storage`)
+    LIFECYCLE_STALE_DAYS = float(os.getenv("LIFECYCLE_STALE_DAYS", "30"))  # age of never-enhanced originals removed
+    LIFECYCLE_ORPHAN_HOURS = float(os.getenv("LIFECYCLE_ORPHAN_HOURS", "24"))  # grace for objects without a run
+    LIFECYCLE_TRANSCODE_DAYS = float(os.getenv("LIFECYCLE_TRANSCODE_DAYS", "90"))  # age of originals recompressed
+    LIFECYCLE_MIN_SAVING = float(os.getenv("LIFECYCLE_MIN_SAVING", "0.05"))  # smallest size reduction worth a rewrite
+    LIFECYCLE_WORKERS = int(os.getenv("LIFECYCLE_WORKERS", "4"))  # originals recompressed in parallel
+
+    # Local disk cache of recently uploaded originals and enhanced results, keyed by S3 key (LRU by bytes)
+    DISK_CACHE_ENABLED = os.getenv("DISK_CACHE_ENABLED", "true").lower() == "true"
+    DISK_CACHE_DIR = os.getenv("DISK_CACHE_DIR", os.path.join(UPLOAD_FOLDER, "cache"))
+    DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+    DISK_CACHE_MAX_OBJECT_BYTES = int(os.getenv("DISK_CACHE_MAX_OBJECT_BYTES", str(64 * 1024 * 1024)))
+
+    # Local SQLite index of each user's runs (rebuild with `python manage.py rebuild-index`)
+    INDEX_DB_PATH = os.getenv("INDEX_DB_PATH", "./data/run_index.db")
+
+    # Gallery pagination (server-side default and upper bound for ?limit=)
+    GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "50"))
+    GALLERY_MAX_PAGE_SIZE = int(os.getenv("GALLERY_MAX_PAGE_SIZE", "200"))
+
     # Add Firebase API Key
     FIREBASE_API_KEY = os.getenv("FIREBASE_API_KEY")
 
-    if not FIREBASE_API_KEY:
-        raise ValueError("Missing FIREBASE_API_KEY in .env file!")
+    # Local ID token verification (falls back to the Firebase lookup API without a project ID)
+    FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+    FIREBASE_JWKS_URL = os.getenv(
+        "FIREBASE_JWKS_URL",
+        "https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com"
+    )
+    FIREBASE_LOOKUP_TIMEOUT = float(os.getenv("FIREBASE_LOOKUP_TIMEOUT", "5"))  # seconds
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))  # seconds, never past the token's exp
 
     # Google OAuth Configuration (No longer needed if using Firebase)
     GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -33,5 +107,85 @@ class Config:
     GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
     GRADIO_URL = os.getenv("GRADIO_URL", "https://cb46c50c95c6136918.gradio.live")
 
-    # Ensure the upload directory exists
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+    # Gradio inference backends (comma-separated GRADIO_URLS overrides GRADIO_URL)
+    GRADIO_URLS = [u.strip() for u in os.getenv("GRADIO_URLS", GRADIO_URL).split(",") if u.strip()]
+    GRADIO_CLIENTS_PER_BACKEND = int(os.getenv("GRADIO_CLIENTS_PER_BACKEND", "4"))
+    GRADIO_TIMEOUT = float(os.getenv("GRADIO_TIMEOUT", "300"))  # seconds per prediction
+    GRADIO_MAX_RETRIES = int(os.getenv("GRADIO_MAX_RETRIES", "2"))  # retries of transport errors and timeouts only
+    GRADIO_RETRY_BACKOFF = float(os.getenv("GRADIO_RETRY_BACKOFF", "0.5"))  # seconds, doubled per retry
+    GRADIO_FAILURE_THRESHOLD = int(os.getenv("GRADIO_FAILURE_THRESHOLD", "3"))
+    GRADIO_RESET_TIMEOUT = float(os.getenv("GRADIO_RESET_TIMEOUT", "30"))  # seconds a circuit stays open
+    GRADIO_PROBE_INTERVAL = float(os.getenv("GRADIO_PROBE_INTERVAL", "15"))  # seconds, 0 disables probing
+
+    # Enhancement job queue ("memory" is the in-process backend)
+    JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+    ENHANCE_WORKERS = int(os.getenv("ENHANCE_WORKERS", "4"))
+    ENHANCE_QUEUE_MAX = int(os.getenv("ENHANCE_QUEUE_MAX", "1000"))
+    ENHANCE_RESULT_TTL = int(os.getenv("ENHANCE_RESULT_TTL", "3600"))  # seconds
+    ENHANCE_DEDUP_TTL = int(os.getenv("ENHANCE_DEDUP_TTL", "600"))  # seconds a finished job answers duplicates
+    ENHANCE_SSE_KEEPALIVE = int(os.getenv("ENHANCE_SSE_KEEPALIVE", "15"))  # seconds
+    ENHANCE_QUEUE_DEADLINE = float(os.getenv("ENHANCE_QUEUE_DEADLINE", "300"))  # seconds queued before a job is shed, 0 = never
+
+    # Admission control for /enhance and /upload: token buckets per user and shared, refilled
+    # at RATE tokens per second up to BURST (a rate of 0 turns that limit off)
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ENHANCE_RATE_PER_USER = float(os.getenv("ENHANCE_RATE_PER_USER", "0.5"))
+    ENHANCE_BURST_PER_USER = float(os.getenv("ENHANCE_BURST_PER_USER", "5"))
+    ENHANCE_RATE_GLOBAL = float(os.getenv("ENHANCE_RATE_GLOBAL", "5"))
+    ENHANCE_BURST_GLOBAL = float(os.getenv("ENHANCE_BURST_GLOBAL", "20"))
+    UPLOAD_RATE_PER_USER = float(os.getenv("UPLOAD_RATE_PER_USER", "2"))
+    UPLOAD_BURST_PER_USER = float(os.getenv("UPLOAD_BURST_PER_USER", "10"))
+    UPLOAD_RATE_GLOBAL = float(os.getenv("UPLOAD_RATE_GLOBAL", "50"))
+    UPLOAD_BURST_GLOBAL = float(os.getenv("UPLOAD_BURST_GLOBAL", "100"))
+    ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2"))  # seconds a request may wait for a token
+    ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "64"))  # requests waiting per route
+
+    # Batch enhancement (/enhance/batch)
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+    BATCH_MAX_CONTENT_LENGTH = int(os.getenv("BATCH_MAX_CONTENT_LENGTH", str(512 * 1024 * 1024)))  # whole request
+    BATCH_UPLOAD_WORKERS = int(os.getenv("BATCH_UPLOAD_WORKERS", "8"))  # concurrent original uploads
+
+    # Streaming transfer of enhanced results into S3
+    TRANSFER_CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", str(8 * 1024 * 1024)))  # multipart part size
+    TRANSFER_MAX_CONCURRENCY = int(os.getenv("TRANSFER_MAX_CONCURRENCY", "2"))  # parts in flight per upload
+    TRANSFER_SPOOL_BYTES = int(os.getenv("TRANSFER_SPOOL_BYTES", str(16 * 1024 * 1024)))  # PIL results above this spill to disk
+    TRANSFER_POOL_SIZE = int(os.getenv("TRANSFER_POOL_SIZE", "10"))  # pooled connections for URL results
+
+    # Result cache for identical (image bytes, flags) requests
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))  # entries in the local LRU tier
+
+    # Instrumentation: /metrics (Prometheus text format) and per-request trace IDs in logs
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # if set, /metrics requires "Authorization: Bearer <token>"
+    TRACE_IDS = os.getenv("TRACE_IDS", "false").lower() == "true"
+
+    # Readiness probe (/health/ready) results are reused for this many seconds
+    READINESS_CACHE_TTL = float(os.getenv("READINESS_CACHE_TTL", "5"))
+
+    # Production server (gunicorn.conf.py). "gevent" workers make S3, Gradio, Firebase and SSE waits
+    # cooperative so one worker holds hundreds of open requests; "gthread" uses a thread per request.
+    SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:5000")
+    SERVER_WORKER_CLASS = os.getenv("SERVER_WORKER_CLASS", "gevent")
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))  # job status lives in-process; see README
+    SERVER_WORKER_CONNECTIONS = int(os.getenv("SERVER_WORKER_CONNECTIONS", "1000"))  # gevent only
+    SERVER_THREADS = int(os.getenv("SERVER_THREADS", "16"))  # gthread only
+    SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "120"))  # seconds a worker may stop responding
+    SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))  # seconds
+    CPU_OFFLOAD_THREADS = int(os.getenv("CPU_OFFLOAD_THREADS", "4"))  # native threads for image work under gevent
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))  # pooled connections for Firebase and Google calls
+
+    # Settings without which the backend cannot serve requests
+    REQUIRED_SETTINGS = ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_BUCKET_NAME", "AWS_REGION", "FIREBASE_API_KEY")
+
+    @classmethod
+    def missing_settings(cls) -> list[str]:
+        """Returns the names of required settings that are not configured."""
+        return [name for name in cls.REQUIRED_SETTINGS if not getattr(cls, name)]
+
+    @classmethod
+    def validate(cls) -> None:
+        """Raises ValueError if a required setting is missing. Called at app creation, not at import."""
+        missing = cls.missing_settings()
+        if missing:
+            raise ValueError(f"Missing configuration in .env file: {', '.join(missing)}")
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Production server settings, read from the environment through Config:
+
+    pip install -r requirements-server.txt
+    gunicorn -c gunicorn.conf.py
+
+With the default gevent workers, waits on S3, Gradio, Firebase and open SSE streams
+yield to other requests instead of holding a thread, so a single worker serves
+hundreds of in-flight uploads, enhancements and gallery pages; image decoding and
+encoding run on a small native thread pool (CPU_OFFLOAD_THREADS).
+"""
+import os
+import sys
+
+# gunicorn reads this file before changing into the app directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config  # noqa: E402
+
+wsgi_app = "app:create_app()"
+bind = Config.SERVER_BIND
+worker_class = Config.SERVER_WORKER_CLASS
+workers = Config.SERVER_WORKERS
+worker_connections = Config.SERVER_WORKER_CONNECTIONS
+threads = Config.SERVER_THREADS
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = 30
+keepalive = Config.SERVER_KEEPALIVE
+
+# Build the app in each worker after gevent has patched the standard library, so the
+# locks, conditions and thread pools created at import time are cooperative too.
+preload_app = False
+
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # httpcore (used by gradio_client) imports trio when it happens to be installed, and trio
+    # binds select.epoll, which gevent removes; the app never uses trio, so hide it in workers
+    if worker_class == "gevent":
+        sys.modules.setdefault("trio", None)
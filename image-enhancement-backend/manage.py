@@ -0,0 +1,114 @@
+import argparse
+import json
+import logging
+import sys
+
+# Configure logging for command-line use
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def rebuild_index(args):
+    """Rebuilds the gallery run index from a full paginated bucket scan."""
+    from services.s3_service import rebuild_all_indexes, rebuild_user_index
+    from utils.helpers import user_folder_for
+
+    if args.email:
+        user_folder = user_folder_for(args.email)
+        if not rebuild_user_index(user_folder):
+            logger.error(f"Index rebuild failed for {args.email}")
+            return 1
+        logger.info(f"Index rebuilt for {args.email}")
+    else:
+        count = rebuild_all_indexes()
+        logger.info(f"Index rebuilt for {count} users")
+    return 0
+
+
+def erase_user(args):
+    """Deletes every stored object of a user (account erasure)."""
+    from services.s3_service import delete_user_data
+
+    deleted, errors = delete_user_data(args.email)
+    logger.info(f"Deleted {len(deleted)} objects for {args.email}")
+    for err in errors:
+        logger.error(f"Failed to delete {err['key']}: {err['code']} {err['message']}")
+    return 1 if errors else 0
+
+
+def backfill_derivatives(args):
+    """Generates missing thumbnails and previews for existing originals and results."""
+    from services.s3_service import backfill_derivatives as backfill
+    from utils.helpers import user_folder_for
+
+    prefix = user_folder_for(args.email) + "/" if args.email else ""
+    generated, failed = backfill(prefix, workers=args.workers, force=args.force)
+    logger.info(f"Generated derivatives for {generated} images, {failed} failed")
+    return 1 if failed else 0
+
+
+def quality_metrics(args):
+    """Recomputes PSNR, SSIM and ΔE₀₀ scores and comparison plots across a user's history."""
+    from services.quality import recompute_user
+
+    measured, failed = recompute_user(args.email, workers=args.workers, force=args.force)
+    logger.info(f"Measured {measured} runs, {failed} failed")
+    return 1 if failed else 0
+
+
+def compact_storage(args):
+    """Removes stale runs and orphaned objects (and optionally recompresses old originals); dry run by default."""
+    from services.lifecycle import compact_storage as compact
+    from utils.helpers import user_folder_for
+
+    prefix = user_folder_for(args.email) + "/" if args.email else ""
+    report = compact(prefix, apply=args.apply, stale_days=args.stale_days, orphan_hours=args.orphan_hours,
+                     transcode=args.transcode, transcode_days=args.transcode_days, workers=args.workers)
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SharpifyAI backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("rebuild-index", help="Rebuild the gallery run index from S3")
+    p.add_argument("--email", help="Only rebuild this user's index")
+    p.set_defaults(func=rebuild_index)
+
+    p = commands.add_parser("erase-user", help="Delete every stored object of a user")
+    p.add_argument("--email", required=True, help="Email of the user to erase")
+    p.set_defaults(func=erase_user)
+
+    p = commands.add_parser("backfill-derivatives", help="Generate missing thumbnails and previews")
+    p.add_argument("--email", help="Only backfill this user's images")
+    p.add_argument("--workers", type=int, help="Images rendered in parallel (default: DERIVATIVE_WORKERS)")
+    p.add_argument("--force", action="store_true", help="Re-render derivatives that already exist")
+    p.set_defaults(func=backfill_derivatives)
+
+    p = commands.add_parser("quality-metrics", help="Compute quality scores and plots for a user's runs")
+    p.add_argument("--email", required=True, help="Email of the user whose runs are measured")
+    p.add_argument("--workers", type=int, help="Processes comparing images in parallel (default: one per CPU)")
+    p.add_argument("--force", action="store_true", help="Re-measure runs that already have scores")
+    p.set_defaults(func=quality_metrics)
+
+    p = commands.add_parser("compact-storage", help="Remove stale runs and orphaned objects from S3")
+    p.add_argument("--email", help="Only compact this user's objects")
+    p.add_argument("--apply", action="store_true", help="Delete and rewrite objects (default: report only)")
+    p.add_argument("--stale-days", type=float,
+                   help="Age in days of never-enhanced runs to remove (default: LIFECYCLE_STALE_DAYS)")
+    p.add_argument("--orphan-hours", type=float,
+                   help="Grace period in hours for orphaned objects (default: LIFECYCLE_ORPHAN_HOURS)")
+    p.add_argument("--transcode", action="store_true",
+                   help="Re-save old PNG originals in place as PNG at maximum compression (no format change)")
+    p.add_argument("--transcode-days", type=float,
+                   help="Age in days of originals to recompress (default: LIFECYCLE_TRANSCODE_DAYS)")
+    p.add_argument("--workers", type=int, help="Originals recompressed in parallel (default: LIFECYCLE_WORKERS)")
+    p.set_defaults(func=compact_storage)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
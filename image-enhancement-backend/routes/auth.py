@@ -1,16 +1,75 @@
+import time
 import requests
-from flask import Blueprint, request, jsonify
+from functools import wraps
+from flask import Blueprint, g, request, jsonify
 from config import Config
+from services import metrics
+from services.firebase_auth import (
+    InvalidTokenError, KeysUnavailableError, TokenCache, make_local_verifier, session, unverified_claims,
+    user_from_claims
+)
+from utils.helpers import user_folder_for
 import logging
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 logger = logging.getLogger(__name__)
 
+# Verified tokens and the local verifier shared by all requests
+token_cache = TokenCache(Config.TOKEN_CACHE_SIZE, Config.TOKEN_CACHE_TTL)
+local_verifier = make_local_verifier()
+
 def verify_firebase_token(token):
+    """
+    Verify a Firebase ID token.
+    Serves repeat tokens from the cache, verifies new ones locally against
+    Google's signing keys, and falls back to the Firebase lookup API.
+    """
+    with metrics.span("auth.verify"):
+        return _verify_firebase_token(token)
+
+def _verify_firebase_token(token):
+    user_info = token_cache.get(token)
+    if user_info:
+        metrics.AUTH_VERIFICATIONS.inc(path="cache", outcome="ok")
+        return user_info
+
+    if local_verifier:
+        try:
+            claims = local_verifier.verify(token)
+            user_info = user_from_claims(claims)
+            token_cache.put(token, user_info, claims.get("exp"))
+            metrics.AUTH_VERIFICATIONS.inc(path="local", outcome="ok")
+            logger.info(f"User verified locally: {user_info['uid']}")
+            return user_info
+        except InvalidTokenError as e:
+            metrics.AUTH_VERIFICATIONS.inc(path="local", outcome="invalid")
+            logger.warning(f"Local token verification failed: {str(e)}")
+            # An expired or forged token will not pass the remote check either
+            return None
+        except KeysUnavailableError as e:
+            metrics.AUTH_VERIFICATIONS.inc(path="local", outcome="unavailable")
+            logger.warning(f"{str(e)}, using Firebase lookup")
+        except Exception as e:
+            logger.error(f"Local token verification error, using Firebase lookup: {str(e)}")
+
+    user_info = lookup_firebase_token(token)
+    metrics.AUTH_VERIFICATIONS.inc(path="remote", outcome="ok" if user_info else "invalid")
+    if user_info:
+        token_cache.put(token, user_info, unverified_claims(token).get("exp"))
+    return user_info
+
+def lookup_firebase_token(token):
     """Verify Firebase token by sending request to Firebase API."""
     try:
         url = f"https://identitytoolkit.googleapis.com/v1/accounts:lookup?key={Config.FIREBASE_API_KEY}"
-        response = requests.post(url, json={"idToken": token})
+        started = time.perf_counter()
+        try:
+            response = session.post(url, json={"idToken": token}, timeout=Config.FIREBASE_LOOKUP_TIMEOUT)
+        except requests.exceptions.RequestException:
+            metrics.observe_call("firebase", "accounts.lookup", time.perf_counter() - started, ok=False)
+            raise
+        metrics.observe_call("firebase", "accounts.lookup", time.perf_counter() - started,
+                             ok=response.status_code < 500)
 
         if response.status_code != 200:
             logger.error(f"Firebase API Error: {response.status_code} - {response.text}")
@@ -40,6 +99,43 @@ def verify_firebase_token(token):
         logger.error(f"Unexpected error verifying token: {str(e)}")
         return None
 
+def require_auth(view=None, *, allow_query_token=False):
+    """
+    Decorator that verifies the request's Firebase ID token once and exposes the
+    caller on `flask.g`: `g.user` (verified user info), `g.user_email` and
+    `g.user_folder` (the user's S3 prefix). The token is read from the
+    `Authorization: Bearer` header; views that browsers open through EventSource
+    may also accept it as `?token=`. CORS preflight requests pass through.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.method == "OPTIONS":
+                return fn(*args, **kwargs)
+
+            if getattr(g, "user", None) is None:
+                header = request.headers.get("Authorization", "")
+                token = header[7:].strip() if header.startswith("Bearer ") else None
+                if not token and allow_query_token:
+                    token = request.args.get("token")
+                if not token:
+                    return jsonify({"error": "Missing bearer token"}), 401
+
+                user = verify_firebase_token(token)
+                if not user:
+                    return jsonify({"error": "Invalid token"}), 401
+                if not user.get("email"):
+                    return jsonify({"error": "Account has no email address"}), 403
+
+                g.user = user
+                g.user_email = user["email"]
+                g.user_folder = user_folder_for(user["email"])
+
+            return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator(view) if view is not None else decorator
+
 @auth_bp.route("/verify-token", methods=["POST"])
 def verify_token():
     """Verify Firebase token sent from frontend."""
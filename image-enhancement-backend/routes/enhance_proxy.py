@@ -1,14 +1,16 @@
-import io
-import os
-import base64
+import json
 import logging
-import requests
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
 from flask_cors import cross_origin
-from gradio_client import Client as GradioClient
 from config import Config
-from PIL import Image
-from services.s3_service import upload_main_image
+from routes.auth import require_auth
+from services import metrics, run_index
+from services.admission import admission_control, enhance_admission
+from services.batch import BatchRegistry, upload_items
+from services.enhancement import run_enhancement
+from services.job_queue import JobManager, IdempotencyConflict, QueueFullError, DONE, FAILED, public_view
+from services.s3_service import ORIGINAL_KEY_RE, find_original_key, public_url
+from utils.helpers import allowed_file, parse_enhancement_flags, user_folder_for
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -19,14 +21,53 @@ if not logger.handlers:
     ch.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
     logger.addHandler(ch)
 
-# Create Flask blueprint and initialize Gradio client
+# Create Flask blueprint
 enhance_proxy = Blueprint("enhance_proxy", __name__)
-logger.info(f"[Gradio] Connecting to {Config.GRADIO_URL}")
-gr_client = GradioClient(Config.GRADIO_URL)
+
+def _run_job(payload: dict) -> dict:
+    """Worker entry point: runs the blocking enhancement pipeline for one queued job."""
+    return run_enhancement(
+        file_url=payload["file_url"],
+        user_email=payload["email"],
+        run_id=payload.get("run_id"),
+        flags=payload["flags"]
+    )
+
+def _shed_job(payload: dict) -> None:
+    """Marks the run of a job that expired in the queue as failed, so it is not left enhancing."""
+    if payload.get("run_id"):
+        try:
+            run_index.update_run(user_folder_for(payload["email"]), payload["run_id"], status=run_index.FAILED)
+        except Exception as e:
+            logger.error(f"Failed to record shed run {payload['run_id']}: {str(e)}")
+
+# Background workers draining the enhancement queue, and submitted batches
+jobs = JobManager(_run_job, on_shed=_shed_job)
+batches = BatchRegistry(ttl=Config.ENHANCE_RESULT_TTL)
+
+metrics.register_collector(lambda: [
+    ("sharpify_job_queue_depth", "gauge", "Enhancement jobs waiting for a worker.", [({}, jobs.queue.depth())])
+])
+
+def _find_job(job_id: str) -> dict | None:
+    """Looks up a job, hiding it from callers that do not own it."""
+    job = jobs.get(job_id)
+    if not job or job["user"] != g.user_email:
+        return None
+    return job
 
 @enhance_proxy.route("/enhance", methods=["OPTIONS", "POST"])
 @cross_origin()
+@require_auth
+@admission_control(enhance_admission)
 def proxy_predict():
+    """
+    Enqueues an enhancement job and returns its ID immediately (202).
+    Poll GET /enhance/<job_id> or stream GET /enhance/<job_id>/events for the result.
+    A repeat of a queued, running or recently finished request (same run_id and flags,
+    or the same Idempotency-Key header) returns the existing job instead of running
+    inference again; a finished one is replayed with its result (200).
+    """
     # Handle CORS preflight
     if request.method == "OPTIONS":
         return "", 200
@@ -34,81 +75,214 @@ def proxy_predict():
     # Extract and validate request payload
     payload = request.get_json(force=True, silent=True) or {}
     file_url     = payload.get("file_url")
-    user_email   = payload.get("email")
     run_id       = payload.get("run_id")
-    face         = payload.get("face", False)
-    background   = payload.get("background", False)
-    text         = payload.get("text", False)
-    colorization = payload.get("colorization", False)
 
-    if not file_url or not user_email:
-        return jsonify({"error": "Missing file_url or email"}), 400
+    if not file_url:
+        return jsonify({"error": "Missing file_url"}), 400
 
-    # Step 1: Send prediction request to Gradio backend
     try:
-        result = gr_client.predict(
-            file_url, face, background, text, colorization,
-            api_name="/predict"
-        )
-    except Exception as e:
-        logger.exception("Gradio predict failed")
-        return jsonify({"error": str(e)}), 502
-
-    # Step 2: Convert Gradio output to image bytes
-    img_bytes = None
-    content_type = "image/png"
-
-    if isinstance(result, str) and os.path.isfile(result):
-        # Gradio returned a local file path
-        with open(result, "rb") as f:
-            img_bytes = f.read()
-        ext = os.path.splitext(result)[1].lower().lstrip(".")
-        content_type = f"image/{ext}"
-    elif isinstance(result, str) and result.startswith("data:image"):
-        # Gradio returned a base64-encoded image string
-        header, b64 = result.split(",", 1)
-        content_type = header.split(";")[0].split(":", 1)[1]
-        img_bytes = base64.b64decode(b64)
-    elif isinstance(result, str) and result.startswith("http"):
-        # Gradio returned a direct image URL
-        r = requests.get(result, timeout=60)
-        r.raise_for_status()
-        img_bytes = r.content
-        content_type = r.headers.get("Content-Type", content_type)
-    elif isinstance(result, Image.Image):
-        # Gradio returned a PIL image
-        buf = io.BytesIO()
-        result.save(buf, "PNG")
-        img_bytes = buf.getvalue()
+        job = _submit_job(file_url, run_id, {
+            "face": payload.get("face", False),
+            "background": payload.get("background", False),
+            "text": payload.get("text", False),
+            "colorization": payload.get("colorization", False)
+        }, request.headers.get("Idempotency-Key"))
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+
+    body = {"job_id": job["job_id"], "status": job["status"], "deduplicated": job.get("deduplicated", False)}
+    if job["status"] == DONE:
+        body["data"] = job["result"]
+        return jsonify(body), 200
+    return jsonify(body), 202
+
+def _submit_job(file_url: str, run_id: str | None, flags: dict, idempotency_key: str | None = None) -> dict:
+    """
+    Queues one enhancement for the authenticated user and marks the run as enhancing.
+    Duplicates are keyed on the client's Idempotency-Key, else on run_id and the enabled flags.
+    Raises QueueFullError at capacity and IdempotencyConflict for a reused Idempotency-Key.
+    """
+    payload = {"file_url": file_url, "run_id": run_id, "flags": flags}
+    if idempotency_key:
+        key, fingerprint = f"key:{idempotency_key}", json.dumps(payload, sort_keys=True)
+    elif run_id:
+        key, fingerprint = f"run:{run_id}:{','.join(sorted(n for n, on in flags.items() if on))}", ""
     else:
-        return jsonify({"error": "Cannot decode enhanced image"}), 500
-
-    # Step 3: Upload enhanced image to S3, using provided run_id
-    run_id_final, enhanced_url, _ = upload_main_image(
-        data_bytes=img_bytes,
-        user_email=user_email,
-        enhancements={
-            "face": face,
-            "background": background,
-            "text": text,
-            "colorization": colorization
-        },
-        content_type=content_type,
-        run_id=run_id  # Provided run_id from frontend (used for pairing)
+        key, fingerprint = None, ""
+
+    job = jobs.submit(g.user_email, {
+        **payload,
+        "email": g.user_email,
+        "trace_id": metrics.current_trace_id()
+    }, key, fingerprint)
+    if run_id and not job.get("deduplicated"):
+        try:
+            run_index.update_run(g.user_folder, run_id, status=run_index.ENHANCING, enhancements=flags)
+        except Exception as e:
+            logger.error(f"Failed to record run {run_id}: {str(e)}")
+    return job
+
+def _batch_size() -> int:
+    """Counts the items of a batch request for admission, one token each."""
+    # Admission reads the body first, so the larger batch limit has to be in place already
+    request.max_content_length = Config.BATCH_MAX_CONTENT_LENGTH
+    if request.files:
+        return max(len(request.files.getlist("files")), 1)
+    items = (request.get_json(force=True, silent=True) or {}).get("items")
+    return max(len(items), 1) if isinstance(items, list) else 1
+
+def _parse_batch_items() -> list[dict] | None:
+    """
+    Reads batch items from the request, either uploaded files (multipart `files`,
+    with optional per-file flags as a JSON `options` list) or existing originals
+    (JSON `items` with `run_id` or `key` and optional flags). Shared flags apply
+    to items that do not set their own. Returns None if the body is malformed.
+    """
+    if request.files:
+        shared = parse_enhancement_flags(request.form)
+        try:
+            options = json.loads(request.form.get("options", "[]"))
+        except ValueError:
+            return None
+        items = []
+        for index, file in enumerate(request.files.getlist("files")):
+            own = options[index] if index < len(options) and isinstance(options[index], dict) else {}
+            item = {"index": index, "name": file.filename, "flags": parse_enhancement_flags(own, shared)}
+            if allowed_file(file.filename):
+                item["data"] = file.read()
+            else:
+                item.update(status="failed", error="Invalid file format")
+            items.append(item)
+        return items
+
+    payload = request.get_json(force=True, silent=True) or {}
+    if not isinstance(payload.get("items"), list):
+        return None
+    shared = parse_enhancement_flags(payload)
+    items = []
+    for index, entry in enumerate(payload["items"]):
+        entry = entry if isinstance(entry, dict) else {}
+        item = {"index": index, "flags": parse_enhancement_flags(entry, shared)}
+        run_id = entry.get("run_id")
+        if entry.get("key"):
+            m = ORIGINAL_KEY_RE.match(str(entry["key"]))
+            run_id = m.group("run_id") if m and m.group("folder") == g.user_folder else None
+        item["name"] = entry.get("key") or run_id
+        # Originals are named after their format, so the key comes from the run's record
+        original_key = find_original_key(g.user_folder, str(run_id)) if run_id and str(run_id).isalnum() else None
+        if original_key:
+            item.update(status="uploaded", run_id=str(run_id), file_url=public_url(original_key))
+        else:
+            item.update(status="failed", error="Invalid run_id or key")
+        items.append(item)
+    return items
+
+@enhance_proxy.route("/enhance/batch", methods=["POST"])
+@cross_origin()
+@require_auth
+@admission_control(enhance_admission, cost=_batch_size)
+def enhance_batch():
+    """
+    Enhances many images in one call. Originals are validated and uploaded
+    concurrently, then each item is queued as its own enhancement job.
+    A bad item is reported in its own entry and never fails the batch.
+    Returns 202 with the batch ID and per-item status; poll GET /enhance/batch/<batch_id>.
+    """
+    # Allow larger bodies than single uploads; each file is still checked against MAX_CONTENT_LENGTH
+    request.max_content_length = Config.BATCH_MAX_CONTENT_LENGTH
+
+    items = _parse_batch_items()
+    if items is None:
+        return jsonify({"error": "Expected multipart 'files' or a JSON 'items' list"}), 400
+    if not items:
+        return jsonify({"error": "Empty batch"}), 400
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch exceeds {Config.BATCH_MAX_ITEMS} items"}), 400
+
+    # Step 1: Upload new originals concurrently
+    items = upload_items(items, g.user_email)
+
+    # Step 2: Queue one enhancement job per valid item
+    for item in items:
+        if item["status"] != "uploaded":
+            continue
+        try:
+            item["job_id"] = _submit_job(item["file_url"], item["run_id"], item["flags"])["job_id"]
+            item["status"] = "queued"
+        except QueueFullError as e:
+            item.update(status="failed", error=str(e))
+
+    batch = batches.create(g.user_email, items)
+    logger.info(f"[Batch] {batch['batch_id']}: {len(items)} items for {g.user_email}")
+    return jsonify(_batch_view(batch)), 202
+
+@enhance_proxy.route("/enhance/batch/<batch_id>", methods=["GET"])
+@cross_origin()
+@require_auth
+def get_batch(batch_id):
+    """Reports per-item progress and results of one of the authenticated user's batches."""
+    batch = batches.get(batch_id)
+    if not batch or batch["user"] != g.user_email:
+        return jsonify({"error": "Unknown batch"}), 404
+    return jsonify(_batch_view(batch)), 200
+
+def _batch_view(batch: dict) -> dict:
+    """Builds the client-facing batch status from its items and their jobs."""
+    items, counts = [], {}
+    for item in batch["items"]:
+        view = {k: item.get(k) for k in ("index", "name", "status", "run_id", "job_id", "error")}
+        job = jobs.get(item["job_id"]) if item.get("job_id") else None
+        if job:
+            view["status"] = job["status"]
+            view["error"] = job.get("error")
+            view["data"] = job.get("result")
+        counts[view["status"]] = counts.get(view["status"], 0) + 1
+        items.append(view)
+    return {"batch_id": batch["batch_id"], "counts": counts, "items": items}
+
+@enhance_proxy.route("/enhance/<job_id>", methods=["GET"])
+@cross_origin()
+@require_auth
+def get_job(job_id):
+    """
+    Reports the status of one of the authenticated user's enhancement jobs.
+    A finished job carries the same `data` payload the synchronous endpoint used to return.
+    """
+    job = _find_job(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+
+    body = public_view(job)
+    if job["status"] == DONE:
+        body["data"] = job["result"]
+    return jsonify(body), 200
+
+@enhance_proxy.route("/enhance/<job_id>/events", methods=["GET"])
+@cross_origin()
+@require_auth(allow_query_token=True)
+def stream_job(job_id):
+    """Server-sent events stream emitting the job's status on every change until it finishes."""
+    job = _find_job(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def generate():
+        current = job
+        yield f"event: status\ndata: {json.dumps(public_view(current))}\n\n"
+        while current["status"] not in (DONE, FAILED):
+            updated = jobs.wait(job_id, current.get("version", 0), Config.ENHANCE_SSE_KEEPALIVE)
+            if updated is None:
+                return
+            if updated.get("version", 0) == current.get("version", 0):
+                yield ": keep-alive\n\n"
+                continue
+            current = updated
+            yield f"event: status\ndata: {json.dumps(public_view(current))}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    if not enhanced_url or not run_id_final:
-        return jsonify({"error": "S3 upload failed"}), 502
-
-    # Step 4: Reconstruct original image URL using naming convention and S3 structure
-    orig_filename = f"original_{run_id_final}.png"
-    user_folder = user_email.replace("@", "_").replace(".", "_")
-    original_url = f"https://{Config.AWS_BUCKET_NAME}.s3.{Config.AWS_REGION}.amazonaws.com/{user_folder}/{orig_filename}"
-
-    # Step 5: Return both image URLs and run ID to frontend
-    return jsonify({
-        "data": {
-            "original_url": original_url,
-            "enhanced_url": enhanced_url,
-            "run_id": run_id_final
-        }
-    }), 200
\ No newline at end of file
@@ -1,50 +1,184 @@
+import base64
+import json
 import logging
-from flask import Blueprint, request, jsonify
+import mimetypes
+from flask import Blueprint, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import cross_origin
-from services.s3_service import fetch_user_images, delete_file_from_s3
+from config import Config
+from routes.auth import require_auth
+from services import run_index
+from services.s3_service import (
+    iter_user_images, delete_file_from_s3, delete_run, delete_user_data, user_run_stats, RUN_KEY_RE,
+    derivative_key, open_object
+)
 
 # Set up logger and Flask blueprint
 logger = logging.getLogger(__name__)
 gallery_bp = Blueprint("gallery", __name__)
 
+def encode_cursor(image: dict) -> str:
+    """Encodes the position of the last returned image as an opaque page cursor."""
+    raw = json.dumps([image["created_at"], image["run_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    """Decodes a page cursor back into its (created_at, run_id) position. Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, run_id = json.loads(raw)
+        return float(created_at), str(run_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
 @gallery_bp.route("/gallery", methods=["GET"])
 @cross_origin()
+@require_auth
 def get_gallery():
     """
-    Fetches all images for a given user based on their email address.
-    The email must be passed as a query parameter (?email=...).
+    Fetches one page of images for the authenticated user, newest run first.
+    Optional `limit` (capped server-side) and `cursor` (the previous page's `next_cursor`)
+    select the page. The JSON body is streamed item by item.
+    """
+    email = g.user_email
+
+    # Clamp the page size to the server-side bounds
+    try:
+        limit = int(request.args.get("limit", Config.GALLERY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid 'limit' query param"}), 400
+    limit = max(1, min(limit, Config.GALLERY_MAX_PAGE_SIZE))
+
+    before = None
+    if request.args.get("cursor"):
+        try:
+            before = decode_cursor(request.args["cursor"])
+        except ValueError:
+            return jsonify({"error": "Invalid 'cursor' query param"}), 400
+
+    # Fetch one extra item to know whether another page follows
+    try:
+        images = iter_user_images(email, limit + 1, before)
+        first = next(images, None)
+    except Exception as e:
+        logger.error(f"Gallery lookup failed: {str(e)}")
+        return jsonify({"error": "Failed to fetch gallery"}), 500
+
+    def generate():
+        yield '{"images":['
+        last, count, image = None, 0, first
+        while image is not None and count < limit:
+            yield ("," if count else "") + json.dumps(image)
+            last, count = image, count + 1
+            image = next(images, None)
+        next_cursor = encode_cursor(last) if image is not None else None
+        yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+
+    return Response(stream_with_context(generate()), status=200, mimetype="application/json")
+
+@gallery_bp.route("/gallery/stats", methods=["GET"])
+@cross_origin()
+@require_auth
+def get_gallery_stats():
+    """Summarises the authenticated user's runs: counts by status, stored bytes, plots and mean stage timings."""
+    try:
+        stats = user_run_stats(g.user_email)
+    except Exception as e:
+        logger.error(f"Gallery stats failed: {str(e)}")
+        stats = None
+    if stats is None:
+        return jsonify({"error": "Failed to fetch gallery stats"}), 500
+    return jsonify(stats), 200
+
+@gallery_bp.route("/gallery/runs/<run_id>/image", methods=["GET"])
+@cross_origin()
+@require_auth
+def get_run_image(run_id):
+    """
+    Serves one image of the authenticated user's run through the local disk cache, so
+    recently uploaded or enhanced images are sent without an S3 GET.
+    Query params: `image` ("enhanced" or "original") and `size` ("full", "preview" or "thumb").
+    Falls back to the full image while its thumbnails are still being rendered.
     """
-    email = request.args.get("email")
-    if not email:
-        return jsonify({"error": "Missing 'email' query param"}), 400
+    which = request.args.get("image", "enhanced")
+    size = request.args.get("size", "preview")
+    if which not in ("enhanced", "original") or size not in ("full", "preview", "thumb"):
+        return jsonify({"error": "Invalid 'image' or 'size' query param"}), 400
+    if not run_id.isalnum():
+        return jsonify({"error": "Invalid run_id"}), 400
+
+    record = run_index.get_run(g.user_folder, run_id)
+    key = record and record[f"{which}_key"]
+    if not key:
+        return jsonify({"error": "Unknown image"}), 404
+    if size != "full" and run_index.derived_keys([key]):
+        key = derivative_key(key, size)
+
+    stream = open_object(key)
+    if stream is None:
+        return jsonify({"error": "Failed to fetch image"}), 502
+    mimetype = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    response = send_file(stream, mimetype=mimetype, max_age=3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
-    # Retrieve all image metadata for this user
-    images = fetch_user_images(email)
-    return jsonify({"images": images}), 200
+def _deletion_response(deleted: list[str], errors: list[dict], run_id: str | None = None):
+    """Reports the removed keys and any partial failures (207 when some deletes failed)."""
+    if errors and not deleted:
+        return jsonify({"error": "Failed to delete", "errors": errors}), 500
+    return jsonify({"deleted": deleted, "errors": errors, "run_id": run_id}), 207 if errors else 200
 
 @gallery_bp.route("/gallery", methods=["DELETE"])
 @cross_origin()
+@require_auth
 def delete_gallery_item():
     """
-    Deletes a specific image from S3 for a user.
-    Expects a JSON body containing both `email` and `key` fields.
+    Deletes a specific image from S3 for the authenticated user.
+    Expects a JSON body containing the `key` field. Deleting a run's enhanced
+    image removes the whole run (original and plots included).
+    Returns only what was removed so the client can update its list in place.
     """
     data = request.get_json(force=True) or {}
-    email = data.get("email")
     key   = data.get("key")
-    if not email or not key:
-        return jsonify({"error": "Missing 'email' or 'key'"}), 400
+    if not key:
+        return jsonify({"error": "Missing 'key'"}), 400
 
-    # Optional safety check: Ensure the key starts with the user's folder prefix
-    prefix = email.replace("@", "_").replace(".", "_") + "/"
-    if not key.startswith(prefix) and not key.startswith("enhanced/"):
+    # Safety check: Ensure the key starts with the user's folder prefix
+    prefix = g.user_folder + "/"
+    if not key.startswith(prefix):
         return jsonify({"error": "Invalid key"}), 400
 
+    # Remove the whole run so its original and plots are not orphaned
+    m = RUN_KEY_RE.match(key)
+    if m and m.group("folder") == g.user_folder:
+        deleted, errors = delete_run(g.user_email, m.group("run_id"))
+        return _deletion_response(deleted, errors, m.group("run_id"))
+
     # Attempt to delete the file from S3
     success = delete_file_from_s3(key)
     if not success:
         return jsonify({"error": "Failed to delete"}), 500
 
-    # Return updated list of user's images after deletion
-    images = fetch_user_images(email)
-    return jsonify({"images": images}), 200
\ No newline at end of file
+    # Return the delta instead of re-listing the whole gallery
+    return jsonify({"deleted": [key], "errors": [], "run_id": None}), 200
+
+@gallery_bp.route("/gallery/runs/<run_id>", methods=["DELETE"])
+@cross_origin()
+@require_auth
+def delete_gallery_run(run_id):
+    """Deletes every object of one of the authenticated user's runs."""
+    if not run_id.isalnum():
+        return jsonify({"error": "Invalid run_id"}), 400
+    deleted, errors = delete_run(g.user_email, run_id)
+    if not deleted and not errors:
+        return jsonify({"error": "Unknown run"}), 404
+    return _deletion_response(deleted, errors, run_id)
+
+@gallery_bp.route("/gallery/account", methods=["DELETE"])
+@cross_origin()
+@require_auth
+def delete_gallery_account():
+    """Erases every stored object of the authenticated user (account-level deletion)."""
+    deleted, errors = delete_user_data(g.user_email)
+    logger.info(f"Erased {len(deleted)} objects for {g.user_folder} ({len(errors)} failures)")
+    return _deletion_response(deleted, errors)
@@ -1,8 +1,75 @@
+import logging
+import threading
+import time
 from flask import Blueprint, jsonify
+from config import Config
 
 health_bp = Blueprint('health', __name__)
+logger = logging.getLogger(__name__)
+
+# Last readiness result, reused for READINESS_CACHE_TTL seconds so probes do not hammer S3
+_readiness = {"checked_at": 0.0, "body": None, "status": 503}
+_readiness_lock = threading.Lock()
 
 @health_bp.route('/')
 def home():
     """Health check route."""
-    return jsonify({"message": "Backend is running!"})
\ No newline at end of file
+    return jsonify({"message": "Backend is running!"})
+
+@health_bp.route('/health/live')
+def liveness():
+    """Liveness probe: the process is up and serving requests. Checks no dependencies."""
+    return jsonify({"status": "alive"}), 200
+
+@health_bp.route('/health/ready')
+def readiness():
+    """
+    Readiness probe: configuration is complete, the run index database opens and
+    the S3 bucket answers. Returns 503 until all of these pass. Gradio backends are
+    reported but do not fail the probe, since jobs queue until a backend recovers.
+    The first probe also creates the shared S3 client, warming the worker.
+    """
+    with _readiness_lock:
+        if time.monotonic() - _readiness["checked_at"] >= Config.READINESS_CACHE_TTL:
+            checks = {
+                "config": _check_config(),
+                "index_db": _check_index_db(),
+                "s3": _check_s3(),
+            }
+            ready = all(check["ok"] for check in checks.values())
+            checks["gradio"] = _check_gradio()
+            _readiness.update(
+                checked_at=time.monotonic(),
+                body={"status": "ready" if ready else "not ready", "checks": checks},
+                status=200 if ready else 503,
+            )
+        return jsonify(_readiness["body"]), _readiness["status"]
+
+def _check_config() -> dict:
+    missing = Config.missing_settings()
+    return {"ok": not missing, "missing": missing}
+
+def _check_index_db() -> dict:
+    from services import db
+    try:
+        db.connect().execute("SELECT 1").fetchone()
+        return {"ok": True}
+    except Exception as e:
+        logger.error(f"Readiness: index database unavailable: {str(e)}")
+        return {"ok": False, "error": str(e)}
+
+def _check_s3() -> dict:
+    from services.s3_service import BUCKET, get_s3_client
+    started = time.perf_counter()
+    try:
+        get_s3_client().head_bucket(Bucket=BUCKET)
+        return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        logger.error(f"Readiness: S3 bucket unavailable: {str(e)}")
+        return {"ok": False, "error": str(e)}
+
+def _check_gradio() -> dict:
+    from services.enhancement import gradio_pool
+    backends = gradio_pool.status()
+    available = sum(1 for b in backends if b["healthy"] and not b["circuit_open"])
+    return {"ok": available > 0, "available": available, "backends": len(backends)}
@@ -0,0 +1,23 @@
+import hmac
+from flask import Blueprint, Response, request, jsonify
+from config import Config
+from services import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Exposes request, pipeline-stage and external-call metrics, plus queue depth,
+    result cache counters and Gradio backend health, in the Prometheus text format.
+    Requires `Authorization: Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set.
+    """
+    if not Config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+
+    if Config.METRICS_TOKEN:
+        header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(header, f"Bearer {Config.METRICS_TOKEN}"):
+            return jsonify({"error": "Invalid metrics token"}), 401
+
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,27 +1,34 @@
 import os
 import logging
 import uuid
-import io
-from flask import Blueprint, request, jsonify
-from services.s3_service import upload_file_to_s3
-from utils.helpers import allowed_file
+from flask import Blueprint, g, request, jsonify
+from routes.auth import require_auth
+from services import metrics, result_cache, run_index
+from services.admission import admission_control, upload_admission
+from services.originals import UploadError, store_original
+from services.s3_service import (
+    create_presigned_upload, create_presigned_multipart_upload,
+    complete_multipart_upload, head_object, read_object_range, delete_file_from_s3, public_url,
+    original_key_for, schedule_derivatives, hash_object, ORIGINAL_KEY_RE
+)
+from utils.helpers import allowed_file, parse_enhancement_flags, probe_image
 from config import Config
-from PIL import Image
 
 # Initialize Flask blueprint and logger
 upload_bp = Blueprint('upload', __name__)
 logger = logging.getLogger(__name__)
 
-# Maximum allowed resolution for uploaded images
-MAX_WIDTH = 5000
-MAX_HEIGHT = 5000
+# Content types accepted for direct-to-S3 uploads, and the format their originals are named after
+DIRECT_UPLOAD_TYPES = {"image/png": "PNG", "image/jpeg": "JPEG", "image/gif": "GIF"}
 
 @upload_bp.route('/upload', methods=['POST'])
+@require_auth
+@admission_control(upload_admission)
 def upload_file():
     """
-    Endpoint for uploading an image file.
-    Accepts a file and user email via multipart/form-data.
-    Performs validation, conversion, enhancement flag parsing, and S3 upload.
+    Endpoint for uploading an image file for the authenticated user.
+    Accepts a file and enhancement flags via multipart/form-data.
+    Performs header-only validation, conversion when needed, enhancement flag parsing, and S3 upload.
     Returns the file URL and run_id on success.
     """
 
@@ -31,19 +38,14 @@ def upload_file():
         return jsonify({"message": "No file provided"}), 400
 
     file = request.files['file']
-    user_email = request.form.get("email")
+    user_email = g.user_email
 
-    # Step 2: Validate user email
-    if not user_email:
-        logger.warning("Missing user email in request.")
-        return jsonify({"message": "Missing user email"}), 400
-
-    # Step 3: Validate file format (e.g., only allow PNG, JPG, etc.)
+    # Step 2: Validate file format (e.g., only allow PNG, JPG, etc.)
     if not allowed_file(file.filename):
         logger.warning(f"Invalid file format: {file.filename}")
         return jsonify({"message": "Invalid file format"}), 400
 
-    # Step 4: Validate file size (in bytes)
+    # Step 3: Validate file size (in bytes)
     file.seek(0, os.SEEK_END)
     file_size = file.tell()
     file.seek(0)
@@ -51,53 +53,161 @@ def upload_file():
         logger.warning(f"File too large: {file.filename} ({file_size / 1024:.2f} KB)")
         return jsonify({"message": "File is too large"}), 400
 
+    # Step 4: Validate, convert if needed and upload to S3
+    try:
+        run_id, file_url = store_original(file.read(), user_email, parse_enhancement_flags(request.form))
+    except UploadError as e:
+        return jsonify({"message": e.message}), e.status
+
+    # Step 5: Return success response with file URL and run ID
+    return jsonify({
+        "message": "File uploaded successfully!",
+        "file_url": file_url,
+        "run_id": run_id
+    }), 200
+
+@upload_bp.route('/upload/presign', methods=['POST'])
+@require_auth
+@admission_control(upload_admission)
+def presign_upload():
+    """
+    Issues presigned S3 upload credentials so the client can upload the original
+    directly, keeping the image bytes off the Flask workers.
+    Expects JSON with filename, content_type, size and enhancement flags.
+    Files above MULTIPART_THRESHOLD get a multipart upload with one URL per part;
+    smaller files get a presigned POST. Finish with POST /upload/complete.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    filename = data.get("filename")
+    content_type = data.get("content_type")
+
+    # Step 1: Validate request fields before issuing any credentials
+    if not allowed_file(filename) or content_type not in DIRECT_UPLOAD_TYPES:
+        return jsonify({"message": "Invalid file format"}), 400
     try:
-        # Step 5: Open image with PIL and validate dimensions
-        image = Image.open(file.stream).convert("RGB")
-        width, height = image.size
-        if width > MAX_WIDTH or height > MAX_HEIGHT:
-            logger.warning(f"Image resolution too large: {width}x{height} px")
-            return jsonify({"message": "Image resolution exceeds allowed size"}), 400
-
-        # Step 6: Generate a unique run ID and prepare filename
-        run_id = uuid.uuid4().hex
-        filename = f"original_{run_id}.png"
-
-        # Step 7: Convert the image to in-memory PNG buffer
-        buf = io.BytesIO()
-        image.save(buf, format="PNG")
-        buf.seek(0)
-
-        # Step 8: Parse enhancement flags from form data
-        enhancement_options = {
-            "face": request.form.get("face") == "true",
-            "background": request.form.get("background") == "true",
-            "colorization": request.form.get("colorization") == "true",
-            "text": request.form.get("text") == "true",
-        }
-
-        # Step 9: Upload image to S3 using the helper service
-        file_url = upload_file_to_s3(
-            file_path=None,
-            filename=filename,
-            user_email=user_email,
-            enhancements=enhancement_options,
-            image_data=buf.read()  # Provide raw image bytes
+        size = int(data.get("size", 0))
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0 or size > Config.MAX_CONTENT_LENGTH:
+        return jsonify({"message": "File is too large"}), 400
+
+    # Step 2: Reserve the run ID and key following the usual naming convention
+    run_id = uuid.uuid4().hex
+    key = original_key_for(g.user_folder, run_id, DIRECT_UPLOAD_TYPES[content_type])
+    enhancement_options = parse_enhancement_flags(data)
+
+    # Step 3: Presign either a single POST or a multipart upload
+    if size > Config.MULTIPART_THRESHOLD:
+        multipart = create_presigned_multipart_upload(
+            key, content_type, size, Config.MULTIPART_PART_SIZE,
+            enhancements=enhancement_options, expires_in=Config.PRESIGNED_UPLOAD_EXPIRES
         )
+        if not multipart:
+            return jsonify({"message": "Could not create upload"}), 500
+        return jsonify({"mode": "multipart", "run_id": run_id, "key": key, **multipart}), 200
+
+    post = create_presigned_upload(
+        key, content_type, Config.MAX_CONTENT_LENGTH,
+        enhancements=enhancement_options, expires_in=Config.PRESIGNED_UPLOAD_EXPIRES
+    )
+    if not post:
+        return jsonify({"message": "Could not create upload"}), 500
+    return jsonify({"mode": "post", "run_id": run_id, "key": key, "post": post}), 200
+
+def _parse_parts(parts):
+    """Validates the parts list of a multipart upload. Returns [{PartNumber, ETag}], or None if malformed."""
+    if not isinstance(parts, list) or not parts:
+        return None
+    parsed = []
+    for part in parts:
+        if not isinstance(part, dict):
+            return None
+        try:
+            number = int(part.get("PartNumber"))
+        except (TypeError, ValueError):
+            return None
+        etag = part.get("ETag")
+        if not 1 <= number <= 10000 or not isinstance(etag, str) or not etag:
+            return None
+        parsed.append({"PartNumber": number, "ETag": etag})
+    return parsed
+
+@upload_bp.route('/upload/complete', methods=['POST'])
+@require_auth
+def complete_upload():
+    """
+    Finalises a direct-to-S3 upload and validates the stored object.
+    Expects JSON with run_id and the key returned by /upload/presign, plus upload_id
+    and parts for multipart uploads.
+    Checks size and reads only the image header to check format and dimensions;
+    invalid objects are deleted. Returns the same payload as /upload.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    run_id = data.get("run_id")
+    if not run_id or not str(run_id).isalnum():
+        return jsonify({"message": "Missing run_id"}), 400
 
-        # Step 10: Return success response with file URL and run ID
-        if file_url:
-            logger.info(f"File uploaded successfully to S3: {file_url}")
-            return jsonify({
-                "message": "File uploaded successfully!",
-                "file_url": file_url,
-                "run_id": run_id
-            }), 200
-        else:
-            logger.error("File upload to S3 failed.")
+    # The key returned by /upload/presign names the format; it must be this user's original for this run
+    key = data.get("key")
+    m = ORIGINAL_KEY_RE.match(key) if isinstance(key, str) else None
+    if not m or m.group("folder") != g.user_folder or m.group("run_id") != run_id:
+        return jsonify({"message": "Invalid key"}), 400
+
+    # Step 1: Complete the multipart upload if the client used one
+    if data.get("upload_id"):
+        parts = _parse_parts(data.get("parts"))
+        if parts is None or not isinstance(data["upload_id"], str):
+            return jsonify({"message": "Invalid upload_id or parts"}), 400
+        if not complete_multipart_upload(key, data["upload_id"], parts):
             return jsonify({"message": "File upload failed"}), 500
 
+    # Step 2: Validate size from the object metadata
+    head = head_object(key)
+    if not head:
+        return jsonify({"message": "Uploaded file not found"}), 404
+    if head.get("ContentLength", 0) > Config.MAX_CONTENT_LENGTH:
+        logger.warning(f"Direct upload too large: {key}")
+        delete_file_from_s3(key)
+        return jsonify({"message": "File is too large"}), 400
+
+    # Step 3: Validate format and dimensions from the header bytes only
+    header = read_object_range(key, Config.UPLOAD_HEADER_BYTES)
+    try:
+        _, width, height, _ = probe_image(header or b"")
+    except Exception as e:
+        logger.warning(f"Direct upload is not a valid image: {key} ({str(e)})")
+        delete_file_from_s3(key)
+        return jsonify({"message": "Invalid or corrupted image"}), 400
+    if width > Config.MAX_WIDTH or height > Config.MAX_HEIGHT:
+        logger.warning(f"Image resolution too large: {width}x{height} px")
+        delete_file_from_s3(key)
+        return jsonify({"message": "Image resolution exceeds allowed size"}), 400
+
+    # Step 4: Record the run with the flags chosen at presign time, and the content digest
+    # so /enhance can look up cached results
+    meta = head.get("Metadata", {})
+    try:
+        run_index.record_upload(
+            g.user_folder, run_id, key, [k for k, v in meta.items() if v.lower() == "true"],
+            head.get("ContentLength"), width, height
+        )
     except Exception as e:
-        # Step 11: Handle unexpected errors or invalid image data
-        logger.error(f"Error processing image: {str(e)}")
-        return jsonify({"message": "Invalid or corrupted image"}), 400
\ No newline at end of file
+        logger.error(f"Failed to record run {run_id}: {str(e)}")
+    try:
+        with metrics.span("upload.digest"):
+            digest = hash_object(key)
+        if digest:
+            result_cache.record_original(key, digest)
+    except Exception as e:
+        logger.error(f"Failed to record original digest: {str(e)}")
+
+    # Step 5: Render the gallery thumbnail and preview in the background
+    schedule_derivatives(key)
+
+    file_url = public_url(key)
+    logger.info(f"Direct upload registered: {file_url}")
+    return jsonify({
+        "message": "File uploaded successfully!",
+        "file_url": file_url,
+        "run_id": run_id
+    }), 200
@@ -0,0 +1,190 @@
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from config import Config
+from services import metrics
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+ADMITTED = metrics.Counter("sharpify_admission_admitted_total",
+                           "Requests admitted, by route and whether they had to wait for a token.",
+                           ("route", "outcome"))
+REJECTED = metrics.Counter("sharpify_admission_rejected_total",
+                           "Requests rejected, by route and the limit that refused them (user, global "
+                           "or queue with 429, size with 413).", ("route", "reason"))
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; carries the limit that refused it and a Retry-After hint."""
+
+    def __init__(self, reason: str, retry_after: float, message: str | None = None):
+        super().__init__(message or f"Too many requests ({reason} limit)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `burst`. Tokens are reserved in arrival order:
+    a reservation may drive the balance negative, and the caller waits until it is repaid.
+    A rate of 0 disables the bucket.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        # `now` may predate the bucket when it was created after the caller read the clock
+        if now > self._stamp:
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+
+    def reserve(self, cost: float, now: float) -> float:
+        """Takes `cost` tokens and returns the seconds until they are covered (0 when available now)."""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        self._tokens -= cost
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, cost: float) -> None:
+        """Returns tokens taken by a reservation that was then refused."""
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + cost)
+
+    def idle(self, now: float) -> bool:
+        """True once the bucket has refilled completely, when it is equivalent to a new one."""
+        return not self.rate or self._tokens + (now - self._stamp) * self.rate >= self.burst
+
+
+class AdmissionController:
+    """
+    Token-bucket admission for one route: a bucket per user and one shared by everyone.
+    A request without a token waits for one, in order, when it arrives within `max_wait`
+    seconds and fewer than `max_waiting` requests are already waiting; otherwise it is
+    refused at once with the time until a token frees up, instead of hanging until the
+    client times out.
+    """
+
+    def __init__(self, name: str, user_rate: float, user_burst: float, global_rate: float,
+                 global_burst: float, max_wait: float, max_waiting: int):
+        self.name = name
+        self._user_rate, self._user_burst = user_rate, user_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users: dict[str, TokenBucket] = {}
+        self._max_wait = max_wait
+        self._max_waiting = max_waiting
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, name: str) -> "AdmissionController":
+        """Builds the controller for a route from its <NAME>_RATE_* and <NAME>_BURST_* settings."""
+        prefix = name.upper()
+        return cls(
+            name,
+            getattr(Config, f"{prefix}_RATE_PER_USER"), getattr(Config, f"{prefix}_BURST_PER_USER"),
+            getattr(Config, f"{prefix}_RATE_GLOBAL"), getattr(Config, f"{prefix}_BURST_GLOBAL"),
+            Config.ADMISSION_MAX_WAIT, Config.ADMISSION_MAX_WAITING,
+        )
+
+    def acquire(self, user: str, cost: float = 1) -> float:
+        """
+        Admits a request from `user` worth `cost` tokens, blocking for its turn when needed.
+        The full cost is charged; a request costing more than a bucket can ever hold is
+        refused with reason "size", since waiting would not help.
+        Returns the seconds waited; raises Rejected.
+        """
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._users.get(user)
+            if bucket is None:
+                self._prune(now)
+                bucket = self._users[user] = TokenBucket(self._user_rate, self._user_burst)
+
+            limit = min((b.burst for b in (bucket, self._global) if b.rate), default=None)
+            if limit is not None and cost > limit:
+                REJECTED.inc(route=self.name, reason="size")
+                raise Rejected("size", 0.0, f"Request too large: costs {cost:g} tokens, at most {limit:g} allowed")
+
+            user_wait = bucket.reserve(cost, now)
+            if user_wait > self._max_wait:
+                bucket.refund(cost)
+                self._reject("user", user_wait)
+            global_wait = self._global.reserve(cost, now)
+            wait = max(user_wait, global_wait)
+            if global_wait > self._max_wait or (wait and self._waiting >= self._max_waiting):
+                bucket.refund(cost)
+                self._global.refund(cost)
+                self._reject("global" if global_wait > self._max_wait else "queue", wait)
+            if wait:
+                self._waiting += 1
+
+        if wait:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        ADMITTED.inc(route=self.name, outcome="delayed" if wait else "immediate")
+        metrics.STAGE_SECONDS.observe(wait, stage=f"admission.{self.name}", outcome="ok")
+        return wait
+
+    def _reject(self, reason: str, wait: float) -> None:
+        REJECTED.inc(route=self.name, reason=reason)
+        raise Rejected(reason, wait)
+
+    def _prune(self, now: float) -> None:
+        """Forgets users whose buckets have refilled; called with the lock held as buckets are added."""
+        if len(self._users) >= 1024:
+            self._users = {user: b for user, b in self._users.items() if not b.idle(now)}
+
+    def stats(self) -> dict:
+        """Returns the number of waiting requests and tracked users."""
+        with self._lock:
+            return {"waiting": self._waiting, "users": len(self._users)}
+
+
+def admission_control(controller: AdmissionController, cost=None):
+    """
+    Decorator that admits the authenticated user's request through `controller` before the
+    view runs (apply it under require_auth), answering 429 with Retry-After when refused, or 413
+    when the request costs more than the burst allows. `cost` optionally maps the request to a
+    token count. CORS preflight requests pass through.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            from flask import g, jsonify, request
+
+            if request.method == "OPTIONS" or not Config.ADMISSION_ENABLED:
+                return fn(*args, **kwargs)
+            try:
+                controller.acquire(g.user_email, cost() if cost else 1)
+            except Rejected as e:
+                logger.warning(f"[Admission] {controller.name} refused {g.user_email}: {e.reason} limit")
+                if e.reason == "size":
+                    return jsonify({"error": str(e)}), 413
+                response = jsonify({"error": str(e), "retry_after": round(e.retry_after, 2)})
+                response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+                return response, 429
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Controllers in front of the inference and upload paths
+enhance_admission = AdmissionController.from_config("enhance")
+upload_admission = AdmissionController.from_config("upload")
+
+metrics.register_collector(lambda: [
+    ("sharpify_admission_waiting", "gauge", "Requests waiting for an admission token.",
+     [({"route": c.name}, c.stats()["waiting"]) for c in (enhance_admission, upload_admission)]),
+])
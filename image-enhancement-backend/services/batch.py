@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from services.originals import UploadError, store_original
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Shared, bounded pool for validating and uploading batch originals
+_upload_pool = ThreadPoolExecutor(max_workers=Config.BATCH_UPLOAD_WORKERS, thread_name_prefix="batch-upload")
+
+
+def _store_item(item: dict, user_email: str) -> dict:
+    """Uploads one batch item, turning any failure into an item-level error."""
+    try:
+        run_id, file_url = store_original(item.pop("data"), user_email, item["flags"])
+        return {**item, "status": "uploaded", "run_id": run_id, "file_url": file_url}
+    except UploadError as e:
+        return {**item, "status": "failed", "error": e.message}
+    except Exception as e:
+        logger.error(f"[Batch] upload of {item.get('name')} failed: {str(e)}")
+        return {**item, "status": "failed", "error": "File upload failed"}
+
+
+def upload_items(items: list[dict], user_email: str) -> list[dict]:
+    """
+    Validates and uploads batch originals concurrently on the shared upload pool.
+    Items carrying `data` are uploaded; others pass through unchanged.
+    Returns the items in their original order with status, run_id and file_url or error.
+    """
+    futures = [
+        _upload_pool.submit(_store_item, item, user_email) if "data" in item else None
+        for item in items
+    ]
+    return [future.result() if future else item for item, future in zip(items, futures)]
+
+
+class BatchRegistry:
+    """In-process record of submitted batches, kept for `ttl` seconds and at most `max_size` batches."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 3600):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._batches: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user: str, items: list[dict]) -> dict:
+        batch = {
+            "batch_id": uuid.uuid4().hex,
+            "user": user,
+            "items": items,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._expire()
+            self._batches[batch["batch_id"]] = batch
+            while len(self._batches) > self._max_size:
+                self._batches.popitem(last=False)
+        return batch
+
+    def get(self, batch_id: str) -> dict | None:
+        with self._lock:
+            self._expire()
+            return self._batches.get(batch_id)
+
+    def _expire(self) -> None:
+        """Drops batches older than the TTL. Caller must hold the lock."""
+        cutoff = time.time() - self._ttl
+        while self._batches:
+            batch = next(iter(self._batches.values()))
+            if batch["created_at"] >= cutoff:
+                break
+            self._batches.popitem(last=False)
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import threading
+
+from config import Config
+
+# One SQLite connection per thread; WAL lets gunicorn workers read while another writes
+_local = threading.local()
+_schemas: list[str] = []
+_schemas_lock = threading.Lock()
+
+
+def register_schema(sql: str) -> None:
+    """Registers DDL (CREATE ... IF NOT EXISTS) to apply to every connection of the local database."""
+    with _schemas_lock:
+        _schemas.append(sql)
+
+
+def register_migration(migrate) -> None:
+    """
+    Registers `migrate(conn)`, run in registration order with the schemas on every new
+    connection. It must detect whether its change is already applied and do nothing then.
+    """
+    with _schemas_lock:
+        _schemas.append(migrate)
+
+
+def connect() -> sqlite3.Connection:
+    """Returns this thread's connection to the local database, applying any newly registered schemas."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        db_dir = os.path.dirname(os.path.abspath(Config.INDEX_DB_PATH))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(Config.INDEX_DB_PATH, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.applied = 0
+
+    if _local.applied < len(_schemas):
+        with _schemas_lock:
+            pending = _schemas[_local.applied:]
+        for sql in pending:
+            if callable(sql):
+                sql(conn)
+            else:
+                conn.executescript(sql)
+        _local.applied += len(pending)
+    return conn
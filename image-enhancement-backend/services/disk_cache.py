@@ -0,0 +1,337 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from config import Config
+from services import metrics
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+REQUESTS = metrics.Counter("sharpify_disk_cache_requests_total",
+                           "Local disk cache lookups, by result (hit or miss).", ("result",))
+EVICTIONS = metrics.Counter("sharpify_disk_cache_evictions_total",
+                            "Objects evicted from the local disk cache to stay within its size.")
+
+
+class DiskCache:
+    """
+    Size-bounded local copy of S3 objects, keyed by S3 key. Entries are written to a
+    temporary file and renamed into place, so readers never see a partial object, and
+    are read through read-only memory maps. A file's mtime is its last use: hits touch
+    it, and once the cache grows past `max_bytes` the least recently used files are
+    removed until it is back under 90%. Since all state is on disk, gunicorn workers
+    sharing the directory share the cache.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_object_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self._bytes = None  # estimate, recomputed whenever the cache is trimmed
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_config(cls) -> "DiskCache":
+        return cls(Config.DISK_CACHE_DIR, Config.DISK_CACHE_MAX_BYTES, Config.DISK_CACHE_MAX_OBJECT_BYTES)
+
+    @property
+    def enabled(self) -> bool:
+        return Config.DISK_CACHE_ENABLED and self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, name[:2], name)
+
+    def _count(self, hit: bool) -> None:
+        REQUESTS.inc(result="hit" if hit else "miss")
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def open_file(self, key: str):
+        """
+        Opens the cached copy of an object for reading and marks it as recently used.
+        Returns a binary file object (valid even if the entry is evicted meanwhile), or None.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self._count(False)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(True)
+        return f
+
+    @contextmanager
+    def open(self, key: str):
+        """
+        Yields a read-only memory map of the cached copy of an object (usable as bytes or as a
+        seekable file), or None on a miss. The map must not be used after the block.
+        """
+        f = self.open_file(key)
+        if f is None:
+            yield None
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    def put(self, key: str, data: bytes) -> bool:
+        """Stores an object's bytes, replacing any earlier copy atomically. Returns False if not cached."""
+        if not self.enabled or len(data) > self.max_object_bytes:
+            return False
+        with self.writer(key) as sink:
+            sink.write(data)
+        return True
+
+    def put_file(self, key: str, fileobj) -> bool:
+        """Stores an object from a readable file, read from its current position to the end."""
+        if not self.enabled:
+            return False
+        with self.writer(key) as sink:
+            while True:
+                chunk = fileobj.read(1024 * 1024)
+                if not chunk:
+                    break
+                if not sink.write(chunk):
+                    return False
+        return sink.committed
+
+    @contextmanager
+    def writer(self, key: str):
+        """
+        Yields a sink whose write(data) appends to a new entry and returns False once the entry is
+        over the per-object limit (it is then dropped). The entry replaces any earlier copy when
+        the block exits normally and after sink.abort() or an exception it is discarded.
+        """
+        sink = _Sink(self)
+        try:
+            yield sink
+        except BaseException:
+            sink.abort()
+            raise
+        sink.commit(key)
+
+    def discard(self, keys) -> None:
+        """Removes the cached copies of objects that were deleted or replaced in S3."""
+        if not self.enabled:
+            return
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"[DiskCache] cannot remove {key}: {str(e)}")
+
+    def copy(self, src_key: str, dst_key: str) -> bool:
+        """Caches `dst_key` as a copy of the cached `src_key` (S3 server-side copies). Returns False on a miss."""
+        if not self.enabled:
+            return False
+        try:
+            f = open(self._path(src_key), "rb")
+        except OSError:
+            return False
+        with f:
+            return self.put_file(dst_key, f)
+
+    def _added(self, size: int) -> None:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_bytes()  # already includes the new entry
+            else:
+                self._bytes += size
+            if self._bytes <= self.max_bytes:
+                return
+            self._bytes = self._trim(int(self.max_bytes * 0.9))
+
+    def _entries(self):
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name == "tmp":
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, entry.path
+
+    def _scan_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _trim(self, target: int) -> int:
+        """Removes least recently used entries until at most `target` bytes remain; returns the bytes left."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                total -= size
+        EVICTIONS.inc(removed)
+        logger.info(f"[DiskCache] evicted {removed} objects, {total} bytes cached")
+        return total
+
+    def stats(self) -> dict:
+        """Returns this process's hits, misses and hit rate, and the cached bytes."""
+        with self._lock:
+            if self._bytes is None and os.path.isdir(self.root):
+                self._bytes = self._scan_bytes()
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class _Sink:
+    """A new cache entry being written to a temporary file in the cache directory."""
+
+    def __init__(self, cache: DiskCache):
+        self._cache = cache
+        self._file = None
+        self._size = 0
+        self.committed = False
+
+    def write(self, data) -> bool:
+        if self._size is None:
+            return False
+        self._size += len(data)
+        if self._size > self._cache.max_object_bytes:
+            self.abort()
+            return False
+        if self._file is None:
+            tmp_dir = os.path.join(self._cache.root, "tmp")
+            os.makedirs(tmp_dir, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self._file.write(data)
+        return True
+
+    def abort(self) -> None:
+        self._size = None
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+
+    def commit(self, key: str) -> None:
+        if self._size is None:
+            return
+        if self._file is None:
+            self.write(b"")
+        path = self._cache._path(key)
+        try:
+            self._file.close()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._file.name, path)
+        except OSError as e:
+            logger.error(f"[DiskCache] cannot store {key}: {str(e)}")
+            self.abort()
+            return
+        self._file = None
+        self.committed = True
+        self._cache._added(self._size)
+
+
+class CachingReader:
+    """
+    Wraps a stream being uploaded so the bytes read from it are also written to a cache
+    entry. Seeks are passed through when the stream supports them (the upload may rewind
+    to retry or checksum); bytes read again are not written twice. Call finish(True) after
+    a successful upload to commit the entry; anything else discards it.
+    """
+
+    def __init__(self, stream, cache: DiskCache, key: str):
+        self._stream = stream
+        self._seekable = is_seekable(stream)
+        self._pos = self._stream.tell() if self._seekable else 0
+        self._cached_to = self._pos  # stream position up to which bytes are in the entry
+        self._writer = cache.writer(key) if cache.enabled else None
+        self._sink = self._writer.__enter__() if self._writer else None
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        end = self._pos + len(data)
+        if self._sink is not None and end > self._cached_to:
+            if self._pos > self._cached_to or not self._sink.write(data[self._cached_to - self._pos:]):
+                self._sink = None  # skipped ahead or too large: not cached
+            self._cached_to = end
+        self._pos = end
+        return data
+
+    def seekable(self) -> bool:
+        return self._seekable
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        self._stream.seek(offset, whence)
+        self._pos = self._stream.tell()
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def finish(self, ok: bool) -> None:
+        if self._writer is None:
+            return
+        if self._sink is None or not ok:
+            self._sink = None
+            self._writer.__exit__(RuntimeError, RuntimeError("upload not cached"), None)
+        else:
+            self._writer.__exit__(None, None, None)
+        self._writer = None
+
+
+def is_seekable(stream) -> bool:
+    """True if the stream supports seek() and tell()."""
+    try:
+        return stream.seekable()
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+# Process-wide cache in UPLOAD_FOLDER
+disk_cache = DiskCache.from_config()
+
+def _collect():
+    stats = disk_cache.stats()
+    return [
+        ("sharpify_disk_cache_bytes", "gauge", "Bytes held in the local disk cache (as of the last write).",
+         [({}, stats["bytes"] or 0)]),
+        ("sharpify_disk_cache_hit_ratio", "gauge", "Share of local disk cache lookups served from disk.",
+         [({}, stats["hit_rate"] or 0)]),
+    ]
+
+
+metrics.register_collector(_collect)
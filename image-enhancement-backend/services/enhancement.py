@@ -0,0 +1,298 @@
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+from config import Config
+from services import metrics, preprocess, quality, result_cache, run_index
+from services.gradio_pool import GradioPool
+from services.s3_service import (
+    copy_main_image, delete_file_from_s3, download_object, find_original_key, hash_object, public_url,
+    read_object_range, upload_main_image, upload_temp_file
+)
+from services.transfer import UnsupportedResult, open_result
+from utils.helpers import probe_image, user_folder_for
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Pool of Gradio clients shared by all enhancement workers; connects on first use
+gradio_pool = GradioPool.from_config()
+
+
+def _collect_backend_metrics():
+    """Exposes the load and health of every Gradio backend on /metrics."""
+    status = gradio_pool.status()
+    return [
+        ("sharpify_gradio_outstanding", "gauge", "Predictions in flight per Gradio backend.",
+         [({"backend": b["url"]}, b["outstanding"]) for b in status]),
+        ("sharpify_gradio_healthy", "gauge", "1 if the backend passed its last probe and its circuit is closed.",
+         [({"backend": b["url"]}, b["healthy"] and not b["circuit_open"]) for b in status]),
+        ("sharpify_gradio_consecutive_failures", "gauge", "Consecutive failed calls per Gradio backend.",
+         [({"backend": b["url"]}, b["failures"]) for b in status]),
+    ]
+
+
+metrics.register_collector(_collect_backend_metrics)
+
+
+class EnhancementError(Exception):
+    """Raised when a step of the enhancement pipeline fails; carries the HTTP status to report."""
+
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.status = status
+
+
+def run_enhancement(file_url: str, user_email: str, run_id: str | None, flags: dict) -> dict:
+    """
+    Runs the full enhancement pipeline for one image: result cache lookup, input
+    normalisation, Gradio inference, and a streamed transfer of the result into S3.
+    Blocks for the duration of the GPU call. Records the outcome, stage timings and
+    result size on the run, then queues its quality measurement. Returns the original URL, enhanced URL, run ID and
+    preprocessing report (or None); raises EnhancementError on failure.
+    """
+    user_folder = user_folder_for(user_email)
+    outcome = {"timings": {}, "enhanced_bytes": None}
+    started = time.perf_counter()
+    try:
+        response = _enhance(file_url, user_email, user_folder, run_id, flags, outcome)
+    except EnhancementError:
+        _record_outcome(user_folder, run_id, run_index.FAILED, outcome, started)
+        raise
+    _record_outcome(user_folder, response["run_id"], run_index.ENHANCED, outcome, started)
+    quality.schedule(user_email, response["run_id"])
+    return response
+
+
+@contextmanager
+def _timed(timings: dict, stage: str):
+    """Times a pipeline stage into the run's timings and the enhance.<stage> metric."""
+    start = time.perf_counter()
+    try:
+        with metrics.span(f"enhance.{stage}"):
+            yield
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 4)
+
+
+def _record_outcome(user_folder: str, run_id: str | None, status: str, outcome: dict, started: float) -> None:
+    """Stores the status, stage timings and result size on the run; never fails the job."""
+    if not run_id:
+        return
+    timings = {**outcome["timings"], "total": round(time.perf_counter() - started, 4)}
+    try:
+        run_index.update_run(user_folder, run_id, status=status, timings=timings,
+                             enhanced_bytes=outcome["enhanced_bytes"])
+    except Exception as e:
+        logger.error(f"Failed to record outcome of run {run_id}: {str(e)}")
+
+
+def _enhance(file_url: str, user_email: str, user_folder: str, run_id: str | None, flags: dict,
+             outcome: dict) -> dict:
+    face         = flags.get("face", False)
+    background   = flags.get("background", False)
+    text         = flags.get("text", False)
+    colorization = flags.get("colorization", False)
+    enhancements = {
+        "face": face,
+        "background": background,
+        "text": text,
+        "colorization": colorization
+    }
+    timings = outcome["timings"]
+    original_key = find_original_key(user_folder, run_id) if run_id else None
+
+    # Step 0: Reuse an earlier result for identical input bytes and flags
+    with _timed(timings, "cache_lookup"):
+        ckey = _cache_key(original_key, enhancements) if Config.RESULT_CACHE_ENABLED else None
+        cached = result_cache.lookup(ckey) if ckey else None
+    if cached:
+        with _timed(timings, "cache_copy"):
+            run_id_final, enhanced_url, _ = copy_main_image(
+                cached[0], user_email, enhancements, content_type=cached[1], run_id=run_id,
+                original_key=original_key
+            )
+        if enhanced_url:
+            logger.info(f"[Cache] hit for run {run_id_final}, skipped inference")
+            return _response(original_key, file_url, run_id_final, enhanced_url)
+        # The cached object is gone; forget it and run inference
+        result_cache.invalidate_key(cached[0])
+
+    # Step 1: Normalise the original (working resolution, EXIF orientation, colour mode) before inference
+    prepared = None
+    if original_key and Config.PREPROCESS_ENABLED:
+        with _timed(timings, "preprocess"):
+            prepared = preprocess.prepare_input(user_email, original_key, run_id)
+    # A run's original is always read from the bucket, never from the client's URL: the result is
+    # cached under the original's digest and served to every user who uploads the same bytes.
+    # Inputs known only by a client URL are never cached (there is no cache key for them).
+    input_key = prepared["key"] if prepared else original_key
+    input_url = public_url(input_key) if input_key else file_url
+
+    # Large inputs are enhanced tile by tile instead of in one piece
+    if input_key and Config.TILED_ENHANCEMENT and _is_large(input_key, prepared):
+        with _timed(timings, "tiled"):
+            run_id_final, enhanced_url, enhanced_key, content_type, outcome["enhanced_bytes"] = _run_tiled(
+                user_email, user_folder, run_id, enhancements, input_key, original_key
+            )
+        _store_in_cache(ckey, enhanced_key, content_type)
+        return _response(original_key, file_url, run_id_final, enhanced_url, prepared)
+
+    # Step 2: Send prediction request to Gradio backend
+    try:
+        with _timed(timings, "predict"):
+            result = gradio_pool.predict(
+                input_url, face, background, text, colorization,
+                api_name="/predict"
+            )
+    except Exception as e:
+        logger.exception("Gradio predict failed")
+        raise EnhancementError(str(e), 502) from e
+
+    # Step 3 & 4: Stream the Gradio output into S3, using provided run_id
+    try:
+        with open_result(result) as (stream, content_type):
+            started = time.perf_counter()
+            run_id_final, enhanced_url, enhanced_key = upload_main_image(
+                data_bytes=None,
+                user_email=user_email,
+                enhancements=enhancements,
+                content_type=content_type,
+                run_id=run_id,  # Provided run_id from frontend (used for pairing)
+                fileobj=stream,
+                original_key=original_key
+            )
+            timings["transfer"] = round(time.perf_counter() - started, 4)
+            # Reading the result is pipelined with the upload; attribute the rest to S3
+            if isinstance(stream, metrics.TimedReader):
+                outcome["enhanced_bytes"] = stream.bytes
+                metrics.STAGE_SECONDS.observe(
+                    time.perf_counter() - started - stream.seconds, stage="enhance.s3_upload",
+                    outcome="ok" if enhanced_url else "error"
+                )
+            else:
+                outcome["enhanced_bytes"] = stream.tell()
+    except UnsupportedResult as e:
+        raise EnhancementError("Cannot decode enhanced image", 500) from e
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Downloading enhanced image failed: {str(e)}")
+        raise EnhancementError("Cannot download enhanced image", 502) from e
+
+    if not enhanced_url or not run_id_final:
+        raise EnhancementError("S3 upload failed", 502)
+
+    _store_in_cache(ckey, enhanced_key, content_type)
+    return _response(original_key, file_url, run_id_final, enhanced_url, prepared)
+
+
+def _is_large(key: str, prepared: dict | None = None) -> bool:
+    """
+    Decides whether an input needs tiling, from the preprocessing report when there is one,
+    otherwise by reading the image header with a ranged GET.
+    """
+    if prepared:
+        return max(prepared["input"]["width"], prepared["input"]["height"]) > Config.TILE_THRESHOLD
+    header = read_object_range(key, Config.UPLOAD_HEADER_BYTES)
+    try:
+        _, width, height, _ = probe_image(header or b"")
+    except Exception:
+        return False
+    return max(width, height) > Config.TILE_THRESHOLD
+
+
+def _run_tiled(user_email: str, user_folder: str, run_id: str, enhancements: dict, source_key: str,
+               original_key: str | None = None):
+    """
+    Enhances a large input (the original or its normalised copy) tile by tile. Each tile is uploaded as a scratch object
+    so the backend receives a URL, exactly like a whole image, and deleted afterwards.
+    Returns (run_id, enhanced_url, enhanced_key, content_type, enhanced_bytes); raises EnhancementError.
+    """
+    from services.tiling import enhance_tiled  # numpy is only loaded once an image needs tiling
+
+    flags = (enhancements["face"], enhancements["background"], enhancements["text"], enhancements["colorization"])
+    scratch = f"{user_folder}/tmp/{run_id}_{uuid.uuid4().hex[:8]}"
+
+    def predict_tile(tile_path):
+        key = f"{scratch}_{os.path.basename(tile_path)}"
+        url = upload_temp_file(tile_path, key)
+        if not url:
+            raise EnhancementError("S3 upload failed", 502)
+        try:
+            return gradio_pool.predict(url, *flags, api_name="/predict")
+        finally:
+            delete_file_from_s3(key)
+
+    with tempfile.NamedTemporaryFile(suffix=".img", dir=Config.TILE_TMP_DIR) as source, \
+            tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES, dir=Config.TILE_TMP_DIR) as output:
+        if not download_object(source_key, source):
+            raise EnhancementError("Cannot read original image", 502)
+        source.flush()
+        try:
+            content_type = enhance_tiled(source.name, predict_tile, output)
+        except EnhancementError:
+            raise
+        except Exception as e:
+            logger.exception("Tiled enhancement failed")
+            raise EnhancementError(str(e), 502) from e
+
+        enhanced_bytes = output.tell()
+        output.seek(0)
+        run_id_final, enhanced_url, enhanced_key = upload_main_image(
+            data_bytes=None,
+            user_email=user_email,
+            enhancements=enhancements,
+            content_type=content_type,
+            run_id=run_id,
+            fileobj=output,
+            original_key=original_key
+        )
+    if not enhanced_url:
+        raise EnhancementError("S3 upload failed", 502)
+    return run_id_final, enhanced_url, enhanced_key, content_type, enhanced_bytes
+
+
+def _cache_key(original_key: str | None, enhancements: dict) -> str | None:
+    """
+    Builds the result cache key from the original's content digest and the flags.
+    Uses the digest recorded at upload time, hashing the S3 object only when it is unknown.
+    Returns None when the original cannot be identified.
+    """
+    if not original_key:
+        return None
+    try:
+        digest = result_cache.original_digest(original_key)
+        if digest is None:
+            digest = hash_object(original_key)
+            if digest is None:
+                return None
+            result_cache.record_original(original_key, digest)
+        variant = preprocess.settings() if Config.PREPROCESS_ENABLED else ""
+        return result_cache.cache_key(digest, enhancements, variant)
+    except Exception as e:
+        logger.error(f"[Cache] key lookup failed: {str(e)}")
+        return None
+
+
+def _store_in_cache(ckey: str | None, enhanced_key: str, content_type: str) -> None:
+    """Records a fresh result in the result cache; cache failures never fail the request."""
+    if not ckey:
+        return
+    try:
+        result_cache.store(ckey, enhanced_key, content_type)
+    except Exception as e:
+        logger.error(f"[Cache] store failed: {str(e)}")
+
+
+def _response(original_key: str | None, file_url: str, run_id: str, enhanced_url: str,
+              prepared: dict | None = None) -> dict:
+    """Builds the job result from the run's recorded original key, or the client's URL when there is none."""
+    return {
+        "original_url": public_url(original_key) if original_key else file_url,
+        "enhanced_url": enhanced_url,
+        "run_id": run_id,
+        "preprocess": prepared
+    }
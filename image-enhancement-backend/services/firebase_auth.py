@@ -0,0 +1,208 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from services import metrics
+
+try:
+    import jwt
+except ImportError:  # PyJWT[crypto] not installed: only the remote lookup is available
+    jwt = None
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Pooled session for Google key fetches and the Firebase lookup fallback
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=Config.HTTP_POOL_SIZE, pool_maxsize=Config.HTTP_POOL_SIZE))
+
+
+class InvalidTokenError(Exception):
+    """Raised when an ID token fails local verification."""
+
+
+class KeysUnavailableError(Exception):
+    """Raised when a token cannot be checked locally because Google's signing keys could not be fetched."""
+
+
+def unverified_claims(token: str) -> dict:
+    """Decodes a JWT payload without checking its signature. Returns {} if malformed."""
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except Exception:
+        return {}
+
+
+def fetch_google_jwks(url: str) -> tuple[dict, float]:
+    """
+    Downloads Google's JSON Web Key Set for Firebase ID tokens.
+    Returns ({kid: jwk}, max_age seconds from Cache-Control).
+    """
+    started = time.perf_counter()
+    try:
+        r = session.get(url, timeout=5)
+        r.raise_for_status()
+    except Exception:
+        metrics.observe_call("google", "jwks", time.perf_counter() - started, ok=False)
+        raise
+    metrics.observe_call("google", "jwks", time.perf_counter() - started)
+    match = re.search(r"max-age=(\d+)", r.headers.get("Cache-Control", ""))
+    max_age = float(match.group(1)) if match else 3600.0
+    return {k["kid"]: k for k in r.json().get("keys", [])}, max_age
+
+
+class PublicKeyCache:
+    """
+    Caches signing keys by key ID until their Cache-Control expiry.
+    Refetches on expiry or on an unknown key ID (key rotation), at most
+    once every `min_refresh` seconds. `fetch` returns ({kid: jwk}, max_age).
+    """
+
+    def __init__(self, fetch, min_refresh: float = 60):
+        self._fetch = fetch
+        self._min_refresh = min_refresh
+        self._keys: dict = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def get(self, kid: str):
+        """
+        Returns the public key object for `kid`, or None if Google does not publish it.
+        Raises KeysUnavailableError if the key is not known and the last fetch failed,
+        since the key may simply not have been loaded yet.
+        """
+        now = time.time()
+        with self._lock:
+            stale = now >= self._expires_at or kid not in self._keys
+            if stale and now - self._fetched_at >= self._min_refresh:
+                self._fetched_at = now
+                try:
+                    jwks, max_age = self._fetch()
+                    self._keys = {k: jwt.PyJWK(v).key for k, v in jwks.items()}
+                    self._expires_at = now + max_age
+                    self._failed = False
+                    logger.info(f"[Auth] loaded {len(self._keys)} signing keys")
+                except Exception as e:
+                    # Keep using the previous keys if the refresh fails
+                    logger.error(f"[Auth] signing key refresh failed: {str(e)}")
+                    self._failed = True
+            key = self._keys.get(kid)
+            if key is None and self._failed:
+                raise KeysUnavailableError("Signing keys could not be fetched")
+            return key
+
+
+class FirebaseTokenVerifier:
+    """Verifies Firebase ID tokens locally: RS256 signature, audience, issuer, expiry and subject."""
+
+    def __init__(self, project_id: str, keys: PublicKeyCache, leeway: float = 10):
+        self.project_id = project_id
+        self.keys = keys
+        self.leeway = leeway
+
+    def verify(self, token: str) -> dict:
+        """
+        Returns the token's verified claims. Raises InvalidTokenError otherwise, or
+        KeysUnavailableError if its signing key could not be fetched.
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise InvalidTokenError(f"Malformed token: {e}") from e
+        if header.get("alg") != "RS256":
+            raise InvalidTokenError("Unexpected signing algorithm")
+
+        key = self.keys.get(header.get("kid", ""))
+        if key is None:
+            raise InvalidTokenError("Unknown signing key")
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                leeway=self.leeway,
+                options={"require": ["exp", "iat", "sub"]},
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidTokenError(str(e)) from e
+
+        if not claims.get("sub") or claims.get("auth_time", 0) > time.time() + self.leeway:
+            raise InvalidTokenError("Invalid subject or auth_time")
+        return claims
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified tokens -> user info. Entries expire at the token's
+    own `exp` or after `ttl` seconds, whichever comes first.
+    Tokens are stored by SHA-256 digest, never in clear.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return user
+
+    def put(self, token: str, user: dict, exp: float | None) -> None:
+        expires_at = time.time() + self._ttl
+        if exp:
+            expires_at = min(expires_at, exp)
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (user, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+def user_from_claims(claims: dict) -> dict:
+    """Maps verified ID token claims to the user info shape returned by the remote lookup."""
+    return {
+        "uid": claims["sub"],
+        "email": claims.get("email", ""),
+        "email_verified": claims.get("email_verified", False),
+        "name": claims.get("name", "Anonymous"),
+        "profile_pic": claims.get("picture", ""),
+    }
+
+
+def make_local_verifier() -> FirebaseTokenVerifier | None:
+    """Builds the local verifier from Config, or None when PyJWT or the project ID is missing."""
+    if jwt is None or not Config.FIREBASE_PROJECT_ID:
+        logger.warning("[Auth] local token verification disabled; using Firebase lookup only")
+        return None
+    keys = PublicKeyCache(lambda: fetch_google_jwks(Config.FIREBASE_JWKS_URL))
+    return FirebaseTokenVerifier(Config.FIREBASE_PROJECT_ID, keys)
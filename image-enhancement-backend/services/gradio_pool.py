@@ -0,0 +1,264 @@
+import concurrent.futures
+import logging
+import queue
+import random
+import threading
+import time
+
+import requests
+
+try:
+    import httpx  # transport of gradio_client
+except ImportError:
+    httpx = None
+
+from config import Config
+from services import metrics
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def connect_gradio(url: str):
+    """Default client factory; gradio_client is imported on the first connection, not at startup."""
+    from gradio_client import Client
+
+    return Client(url)
+
+
+# Errors that mean a backend could not be reached or did not answer in time. Only these
+# are retried and count toward the circuit breaker; errors raised by the app itself
+# (bad input, a failed prediction) reach the caller unchanged.
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    concurrent.futures.TimeoutError,
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+) + ((httpx.TransportError,) if httpx else ())
+
+
+class NoBackendAvailable(Exception):
+    """Raised when every inference backend is unhealthy or has its circuit open."""
+
+
+class Backend:
+    """
+    One Gradio inference endpoint: a small pool of clients, the number of
+    in-flight requests, and circuit breaker state.
+    """
+
+    def __init__(self, url: str, max_clients: int, client_factory):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.healthy = True
+        self._client_factory = client_factory
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_clients)
+
+    def acquire_client(self):
+        """Borrows an idle client, connecting a new one while under the per-backend limit."""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            logger.info(f"[Gradio] Connecting to {self.url}")
+            return self._client_factory(self.url)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release_client(self, client, broken: bool = False) -> None:
+        """Returns a client to the pool; broken clients are dropped and reconnected on demand."""
+        if not broken:
+            self._idle.put(client)
+        self._slots.release()
+
+
+class GradioPool:
+    """
+    Spreads Gradio predictions over several backends.
+    Picks the healthy backend with the fewest outstanding requests, retries
+    transport failures and timeouts on other backends with exponential backoff,
+    opens a backend's circuit after repeated failures, and probes backends in
+    the background. `client_factory(url)` returns an object with gradio_client's
+    submit() / Job interface, so tests can inject fakes.
+    """
+
+    def __init__(self, urls: list[str], client_factory=connect_gradio, max_clients: int = 4,
+                 timeout: float = 300, max_retries: int = 2, backoff: float = 0.5,
+                 failure_threshold: int = 3, reset_timeout: float = 30,
+                 probe_interval: float = 15, transient_errors: tuple = TRANSIENT_ERRORS):
+        if not urls:
+            raise ValueError("GradioPool needs at least one backend URL")
+        self.backends = [Backend(url.rstrip("/"), max_clients, client_factory) for url in urls]
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.transient_errors = transient_errors
+        self._lock = threading.Lock()
+        self._prober: threading.Thread | None = None
+        self._session = requests.Session()
+
+    @classmethod
+    def from_config(cls) -> "GradioPool":
+        """Builds a pool from the GRADIO_* settings in Config."""
+        return cls(
+            urls=Config.GRADIO_URLS,
+            max_clients=Config.GRADIO_CLIENTS_PER_BACKEND,
+            timeout=Config.GRADIO_TIMEOUT,
+            max_retries=Config.GRADIO_MAX_RETRIES,
+            backoff=Config.GRADIO_RETRY_BACKOFF,
+            failure_threshold=Config.GRADIO_FAILURE_THRESHOLD,
+            reset_timeout=Config.GRADIO_RESET_TIMEOUT,
+            probe_interval=Config.GRADIO_PROBE_INTERVAL,
+        )
+
+    def predict(self, *args, api_name: str = "/predict"):
+        """
+        Runs a prediction on the least loaded available backend.
+        Retries transport errors and timeouts up to `max_retries` times, preferring
+        backends not tried yet; a timed-out job is cancelled first. Errors raised by
+        the app are not retried and do not count against the backend.
+        Raises the app's error, the last transport error, or NoBackendAvailable if
+        no backend can be used.
+        """
+        self._ensure_prober()
+        tried: set[str] = set()
+        last_error: Exception | None = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self.backoff * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+            backend = self._pick(exclude=tried) or self._pick()
+            if backend is None:
+                raise NoBackendAvailable("No Gradio backend available") from last_error
+            tried.add(backend.url)
+
+            try:
+                client = backend.acquire_client()
+            except Exception as e:
+                self._record(backend, ok=False)
+                last_error = e
+                logger.warning(f"[Gradio] connect to {backend.url} failed: {str(e)}")
+                continue
+
+            job = None
+            failed, broken = True, False
+            started = time.perf_counter()
+            try:
+                job = client.submit(*args, api_name=api_name)
+                result = job.result(timeout=self.timeout)
+                failed = False
+            except self.transient_errors as e:
+                broken = True
+                last_error = e
+                if job is not None:
+                    self._cancel(job)
+                logger.warning(f"[Gradio] attempt {attempt + 1} on {backend.url} failed: {str(e)}")
+            finally:
+                metrics.observe_call("gradio", api_name, time.perf_counter() - started, ok=not failed)
+                backend.release_client(client, broken=broken)
+                # The backend answered, even if with an error: only transport failures trip the breaker
+                self._record(backend, ok=not broken)
+
+            if not broken:
+                return result
+
+        raise last_error
+
+    @staticmethod
+    def _cancel(job) -> None:
+        """Cancels a job that timed out or lost its connection, so the backend stops working on it."""
+        try:
+            job.cancel()
+        except Exception as e:
+            logger.warning(f"[Gradio] cancelling job failed: {str(e)}")
+
+    def status(self) -> list[dict]:
+        """Returns a snapshot of every backend's load and health."""
+        with self._lock:
+            return [
+                {
+                    "url": b.url,
+                    "outstanding": b.outstanding,
+                    "healthy": b.healthy,
+                    "circuit_open": b.opened_at is not None,
+                    "failures": b.failures,
+                }
+                for b in self.backends
+            ]
+
+    def _available(self, backend: Backend, now: float) -> bool:
+        """A backend is usable when healthy and its circuit is closed or ready for a half-open trial."""
+        if not backend.healthy:
+            return False
+        return backend.opened_at is None or now - backend.opened_at >= self.reset_timeout
+
+    def _pick(self, exclude: set[str] = frozenset()) -> Backend | None:
+        """Reserves the available backend with the fewest outstanding requests."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                b for b in self.backends
+                if b.url not in exclude and self._available(b, now)
+            ]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: b.outstanding)
+            if backend.opened_at is not None:
+                # Half-open: let this single trial through and hold the circuit until it reports back
+                backend.opened_at = now
+            backend.outstanding += 1
+            return backend
+
+    def _record(self, backend: Backend, ok: bool) -> None:
+        """Releases the reservation and updates the circuit breaker."""
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                backend.opened_at = None
+                return
+            backend.failures += 1
+            if backend.failures >= self.failure_threshold:
+                if backend.opened_at is None:
+                    logger.error(f"[Gradio] circuit opened for {backend.url}")
+                backend.opened_at = time.monotonic()
+
+    def _ensure_prober(self) -> None:
+        """Starts the background health prober on first use."""
+        if self._prober is not None or self.probe_interval <= 0:
+            return
+        with self._lock:
+            if self._prober is None:
+                self._prober = threading.Thread(target=self._probe_loop, name="gradio-prober", daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            for backend in self.backends:
+                healthy = self.probe(backend.url)
+                with self._lock:
+                    if healthy != backend.healthy:
+                        logger.info(f"[Gradio] {backend.url} is now {'healthy' if healthy else 'unhealthy'}")
+                    backend.healthy = healthy
+            time.sleep(self.probe_interval)
+
+    def probe(self, url: str) -> bool:
+        """Checks that a Gradio app answers its /config endpoint."""
+        try:
+            r = self._session.get(f"{url}/config", timeout=5)
+            return r.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
@@ -0,0 +1,354 @@
+import io
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from config import Config
+from services.tiling import load_rgb
+from utils.helpers import pil_image
+
+# This module is imported by the first quality measurement, which keeps numpy out of worker startup
+Image = pil_image()
+
+# SSIM on BT.601 luma with a 7x7 uniform window and sample covariance (the usual defaults)
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Longest side of the SSIM and ΔE₀₀ heatmaps, in cells, and of each image in the comparison plot
+MAP_SIDE = 256
+PANEL_SIDE = 384
+# ΔE₀₀ values are histogrammed in 0.1 steps up to this value to estimate the 95th percentile
+DELTA_E_RANGE = 100.0
+DELTA_E_BINS = 1000
+
+# sRGB (D65) to CIE XYZ, and the D65 white point
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+# 8-bit sRGB value -> linear light
+_SRGB_TO_LINEAR = np.array([
+    c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+    for c in (np.arange(256) / 255.0)
+], dtype=np.float32)
+
+# Viridis anchors for heatmaps; cells without a value are drawn grey
+_COLORMAP = np.array([(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)], dtype=np.float32)
+_NO_VALUE = (128, 128, 128)
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Converts (..., 3) 8-bit sRGB pixels to CIE L*a*b* (D65) as float32."""
+    xyz = _SRGB_TO_LINEAR[rgb] @ _RGB_TO_XYZ.T / _WHITE
+    eps = (6 / 29) ** 3
+    f = np.where(xyz > eps, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def delta_e00(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """Returns the CIEDE2000 colour difference between two (..., 3) L*a*b* arrays, element-wise."""
+    L1, a1, b1 = np.moveaxis(lab1, -1, 0)
+    L2, a2, b2 = np.moveaxis(lab2, -1, 0)
+
+    c_bar7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - np.sqrt(c_bar7 / (c_bar7 + 25.0 ** 7)))
+    a1p, a2p = (1 + g) * a1, (1 + g) * a2
+    c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+    chroma = c1p * c2p
+    achromatic = chroma == 0
+
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(achromatic, 0, dh)
+    dL = L2 - L1
+    dC = c2p - c1p
+    dH = 2 * np.sqrt(chroma) * np.sin(np.radians(dh) / 2)
+
+    L_bar = (L1 + L2) / 2
+    C_bar = (c1p + c2p) / 2
+    h_sum = h1p + h2p
+    h_bar = np.where(np.abs(h1p - h2p) <= 180, h_sum / 2,
+                     np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    h_bar = np.where(achromatic, h_sum, h_bar)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    d_theta = 30 * np.exp(-(((h_bar - 275) / 25) ** 2))
+    C_bar7 = C_bar ** 7
+    r_c = 2 * np.sqrt(C_bar7 / (C_bar7 + 25.0 ** 7))
+    s_l = 1 + 0.015 * (L_bar - 50) ** 2 / np.sqrt(20 + (L_bar - 50) ** 2)
+    s_c = 1 + 0.045 * C_bar
+    s_h = 1 + 0.015 * C_bar * t
+    r_t = -np.sin(np.radians(2 * d_theta)) * r_c
+
+    l_term, c_term, h_term = dL / s_l, dC / s_c, dH / s_h
+    return np.sqrt(np.maximum(l_term ** 2 + c_term ** 2 + h_term ** 2 + r_t * c_term * h_term, 0))
+
+
+def _luma(rgb: np.ndarray) -> np.ndarray:
+    return rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float64)
+
+
+def _window_sums(x: np.ndarray, k: int) -> np.ndarray:
+    """Sums every k x k window of a 2-D array with a summed-area table; returns the valid part."""
+    table = np.zeros((x.shape[0] + 1, x.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(x, axis=0), axis=1, out=table[1:, 1:])
+    return table[k:, k:] - table[:-k, k:] - table[k:, :-k] + table[:-k, :-k]
+
+
+def ssim_map(x: np.ndarray, y: np.ndarray, k: int = SSIM_WINDOW) -> np.ndarray:
+    """
+    Computes the SSIM of two 2-D luma arrays for every window that fits entirely inside
+    them. Returns an array of shape (h - k + 1, w - k + 1), one value per window centre.
+    """
+    n = k * k
+    mx, my = _window_sums(x, k) / n, _window_sums(y, k) / n
+    cov = n / (n - 1)
+    vx = (_window_sums(x * x, k) / n - mx * mx) * cov
+    vy = (_window_sums(y * y, k) / n - my * my) * cov
+    vxy = (_window_sums(x * y, k) / n - mx * my) * cov
+    return ((2 * mx * my + SSIM_C1) * (2 * vxy + SSIM_C2)) / ((mx * mx + my * my + SSIM_C1) * (vx + vy + SSIM_C2))
+
+
+def _block_means(values: np.ndarray, block: int) -> np.ndarray:
+    """Averages a 2-D array over block x block cells, ignoring NaN; cells with no value are NaN."""
+    rows, cols = -(-values.shape[0] // block), -(-values.shape[1] // block)
+    padded = np.full((rows * block, cols * block), np.nan, dtype=np.float64)
+    padded[:values.shape[0], :values.shape[1]] = values
+    cells = padded.reshape(rows, block, cols, block)
+    present = ~np.isnan(cells)
+    counts = present.sum(axis=(1, 3))
+    sums = np.where(present, cells, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+# EXIF orientation -> the array view that makes the image upright (as ImageOps.exif_transpose)
+_ORIENTATIONS = {
+    2: lambda a: a[:, ::-1],
+    3: lambda a: a[::-1, ::-1],
+    4: lambda a: a[::-1],
+    5: lambda a: a.transpose(1, 0, 2),
+    6: lambda a: np.rot90(a, -1),
+    7: lambda a: a[::-1, ::-1].transpose(1, 0, 2),
+    8: lambda a: np.rot90(a),
+}
+
+
+def _decode(data, path: str, upright: bool, panel: int):
+    """
+    Decodes an image into a disk-backed RGB memmap and renders its comparison panel.
+    Only one decoded image is resident at a time; everything after works on bands of
+    the memmap. With `upright`, the returned view applies the EXIF orientation.
+    Returns (pixels, panel image).
+    """
+    with Image.open(_as_file(data)) as image:
+        orientation = image.getexif().get(0x0112, 1) if upright else 1
+        pixels = load_rgb(image, path)
+        image.thumbnail((panel, panel), Image.LANCZOS)
+        view = image.convert("RGB")
+    if orientation in _ORIENTATIONS:
+        pixels = _ORIENTATIONS[orientation](pixels)
+        view = Image.fromarray(np.ascontiguousarray(_ORIENTATIONS[orientation](np.asarray(view))))
+    return pixels, view
+
+
+def _resampled_rows(result: np.ndarray, first: int, last: int, width: int, scale_y: float) -> np.ndarray:
+    """
+    Resamples (Lanczos) rows first..last of the image at the original's size from only the
+    result rows those output rows depend on, matching a resize of the whole result.
+    """
+    margin = math.ceil(3 * max(scale_y, 1)) + 1
+    top = max(0, math.floor(first * scale_y) - margin)
+    bottom = min(result.shape[0], math.ceil(last * scale_y) + margin)
+    piece = Image.fromarray(np.ascontiguousarray(result[top:bottom]))
+    box = (0, first * scale_y - top, result.shape[1], last * scale_y - top)
+    return np.asarray(piece.resize((width, last - first), Image.LANCZOS, box=box))
+
+
+def evaluate(original, enhanced, band_rows: int | None = None) -> tuple[dict, list[bytes]]:
+    """
+    Compares an enhanced image with its original. `original` and `enhanced` are paths,
+    file objects or bytes. The original is upright by its EXIF orientation and the
+    enhanced image is resampled (Lanczos) to its size. PSNR is measured on RGB, SSIM on
+    luma and ΔE₀₀ on CIE L*a*b*. Each image is decoded once into a disk-backed buffer
+    (under TILE_TMP_DIR), and resampling and all float work run one band of rows at a
+    time, so memory beyond the decoder grows with the width of the image, not its area.
+    Returns (scores, plots): scores has psnr (None for identical images), ssim,
+    delta_e00 (mean, p95, max) and both sizes; plots are PNG bytes of a side-by-side
+    comparison and the SSIM and ΔE₀₀ heatmaps. CPU-bound; callers use run_cpu_bound
+    or a process pool.
+    """
+    with tempfile.TemporaryDirectory(dir=Config.TILE_TMP_DIR) as workdir:
+        source, source_view = _decode(original, os.path.join(workdir, "original.rgb"), True, PANEL_SIDE)
+        result, result_view = _decode(enhanced, os.path.join(workdir, "enhanced.rgb"), False, PANEL_SIDE)
+        return _evaluate(source, result, source_view, result_view, band_rows or Config.QUALITY_BAND_ROWS)
+
+
+def _evaluate(source: np.ndarray, result: np.ndarray, source_view, result_view,
+              band_rows: int) -> tuple[dict, list[bytes]]:
+    height, width = source.shape[:2]
+    scale_y = result.shape[0] / height
+
+    block = max(1, math.ceil(max(width, height) / MAP_SIDE))
+    band_rows = max(block, band_rows // block * block)
+    halo = SSIM_WINDOW // 2
+    squared_error = 0.0
+    ssim_sum, ssim_count = 0.0, 0
+    de_sum, de_max = 0.0, 0.0
+    de_hist = np.zeros(DELTA_E_BINS, dtype=np.int64)
+    ssim_rows, de_rows = [], []
+
+    for top in range(0, height, band_rows):
+        bottom = min(height, top + band_rows)
+        # Read SSIM_WINDOW // 2 extra rows on each side so windows centred in the band are complete
+        first, last = max(0, top - halo), min(height, bottom + halo)
+        a = np.asarray(source[first:last])
+        if result.shape == source.shape:
+            b = np.asarray(result[first:last])
+        else:
+            b = _resampled_rows(result, first, last, width, scale_y)
+        core = slice(top - first, bottom - first)
+
+        diff = a[core].astype(np.float32) - b[core]
+        squared_error += float(np.square(diff, dtype=np.float64).sum())
+
+        de = delta_e00(rgb_to_lab(a[core]), rgb_to_lab(b[core]))
+        de_sum += float(de.sum(dtype=np.float64))
+        de_max = max(de_max, float(de.max()))
+        de_hist += np.bincount(np.minimum((de * (DELTA_E_BINS / DELTA_E_RANGE)).astype(np.int64), DELTA_E_BINS - 1).ravel(),
+                               minlength=DELTA_E_BINS)
+        de_rows.append(_block_means(de, block))
+
+        band_ssim = np.full((bottom - top, width), np.nan)
+        if min(width, height) >= SSIM_WINDOW:
+            values = ssim_map(_luma(a), _luma(b))
+            # Window centres cover rows first + halo .. last - halo - 1 and columns halo .. width - halo - 1
+            centre = first + halo
+            rows = slice(max(top, centre) - centre, min(bottom, last - halo) - centre)
+            values = values[rows]
+            ssim_sum += float(values.sum())
+            ssim_count += values.size
+            start = max(top, centre) - top
+            band_ssim[start:start + values.shape[0], halo:width - halo] = values
+        ssim_rows.append(_block_means(band_ssim, block))
+
+    pixels = width * height
+    mse = squared_error / (pixels * 3)
+    p95_bin = int(np.searchsorted(np.cumsum(de_hist), 0.95 * pixels))
+    scores = {
+        "psnr": round(10 * math.log10(255 ** 2 / mse), 3) if mse else None,
+        "ssim": round(ssim_sum / ssim_count, 5) if ssim_count else None,
+        "delta_e00": {
+            "mean": round(de_sum / pixels, 3),
+            "p95": round((p95_bin + 1) * DELTA_E_RANGE / DELTA_E_BINS, 3),
+            "max": round(de_max, 3),
+        },
+        "width": width,
+        "height": height,
+        "enhanced_width": result.shape[1],
+        "enhanced_height": result.shape[0],
+    }
+    de_map, ssim_grid = np.vstack(de_rows), np.vstack(ssim_rows)
+    plots = [
+        _comparison_plot(source, result, source_view, result_view, de_map, block, scores),
+        _heatmap_plot(ssim_grid, "SSIM (1 = structure unchanged)", 0.0, 1.0),
+        _heatmap_plot(de_map, "dE00 colour difference", 0.0, 20.0),
+    ]
+    return scores, plots
+
+
+def _as_file(data):
+    return io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+
+
+def _colorize(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Maps a 2-D array onto the heatmap colours; NaN cells are grey."""
+    t = np.clip((np.nan_to_num(values, nan=low) - low) / (high - low), 0, 1) * (len(_COLORMAP) - 1)
+    i = np.minimum(t.astype(np.int64), len(_COLORMAP) - 2)
+    frac = (t - i)[..., None]
+    rgb = _COLORMAP[i] * (1 - frac) + _COLORMAP[i + 1] * frac
+    rgb[np.isnan(values)] = _NO_VALUE
+    return rgb.astype(np.uint8)
+
+
+def _to_png(image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _heatmap_plot(values: np.ndarray, title: str, low: float, high: float, side: int = 512) -> bytes:
+    """Renders a heatmap with a title and a colour bar labelled with its range."""
+    from PIL import ImageDraw
+
+    cell = max(1, side // max(values.shape))
+    heat = Image.fromarray(_colorize(values, low, high)).resize(
+        (values.shape[1] * cell, values.shape[0] * cell), Image.NEAREST
+    )
+    canvas = Image.new("RGB", (max(heat.width, 320) + 20, heat.height + 70), "white")
+    canvas.paste(heat, (10, 24))
+    draw = ImageDraw.Draw(canvas)
+    draw.text((10, 6), title, fill="black")
+
+    bar = _colorize(np.linspace(low, high, 256)[None, :].repeat(10, axis=0), low, high)
+    bar_top = heat.height + 34
+    canvas.paste(Image.fromarray(bar).resize((256, 10)), (10, bar_top))
+    draw.text((10, bar_top + 14), f"{low:g}", fill="black")
+    draw.text((246, bar_top + 14), f"{high:g}", fill="black")
+    return _to_png(canvas)
+
+
+def _comparison_plot(source: np.ndarray, result: np.ndarray, source_view, result_view, de_map: np.ndarray,
+                     block: int, scores: dict, panel: int = PANEL_SIDE) -> bytes:
+    """
+    Renders original and enhanced side by side (from their panel-sized views), above a
+    close-up of the region with the largest colour difference at the original's pixel
+    scale, captioned with the scores.
+    """
+    from PIL import ImageDraw
+
+    canvas = Image.new("RGB", (2 * panel + 30, 2 * panel + 80), "white")
+    draw = ImageDraw.Draw(canvas)
+    for column, (label, view) in enumerate((("Original", source_view), ("Enhanced", result_view))):
+        x = 10 + column * (panel + 10)
+        canvas.paste(view, (x + (panel - view.width) // 2, 24 + (panel - view.height) // 2))
+        draw.text((x, 6), label, fill="black")
+
+    # Close-up around the cell with the largest mean ΔE₀₀
+    height, width = source.shape[:2]
+    size = min(128, width, height)
+    cy, cx = np.unravel_index(np.nanargmax(de_map), de_map.shape) if np.isfinite(de_map).any() else (0, 0)
+    left = int(min(max(cx * block + block // 2 - size // 2, 0), width - size))
+    top = int(min(max(cy * block + block // 2 - size // 2, 0), height - size))
+    scale_x, scale_y = result.shape[1] / width, result.shape[0] / height
+    region = result[round(top * scale_y):max(round((top + size) * scale_y), round(top * scale_y) + 1),
+                    round(left * scale_x):max(round((left + size) * scale_x), round(left * scale_x) + 1)]
+    crops = (
+        Image.fromarray(np.ascontiguousarray(source[top:top + size, left:left + size])).resize(
+            (panel, panel), Image.NEAREST),
+        Image.fromarray(np.ascontiguousarray(region)).resize((panel, panel), Image.LANCZOS),
+    )
+    for column, crop in enumerate(crops):
+        canvas.paste(crop, (10 + column * (panel + 10), panel + 44))
+    draw.text((10, panel + 28), f"Close-up {size}x{size} px at ({left}, {top})", fill="black")
+
+    psnr = f"{scores['psnr']:.2f} dB" if scores["psnr"] is not None else "identical"
+    ssim = f"{scores['ssim']:.4f}" if scores["ssim"] is not None else "n/a"
+    de = scores["delta_e00"]
+    draw.text((10, 2 * panel + 54),
+              f"PSNR {psnr}   SSIM {ssim}   dE00 mean {de['mean']:.2f} / p95 {de['p95']:.2f} / max {de['max']:.2f}",
+              fill="black")
+    return _to_png(canvas)
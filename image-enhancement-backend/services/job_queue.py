@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from config import Config
+from services import metrics
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Job lifecycle states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEDUPLICATED = metrics.Counter("sharpify_jobs_deduplicated_total",
+                               "Duplicate submissions answered by an existing job, by whether it was "
+                               "still in flight (joined) or finished (replayed).", ("state",))
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+
+class JobQueue:
+    """
+    Storage interface for enhancement jobs: pending work plus job status.
+    A persistent backend (Redis, SQL, ...) implements the same methods and is
+    selected through Config.JOB_QUEUE_BACKEND.
+    """
+
+    def put(self, job: dict) -> None:
+        """Stores a new job and makes it available to workers."""
+        raise NotImplementedError
+
+    def put_unique(self, job: dict, key: str, fingerprint: str) -> dict:
+        """
+        Stores `job` under an idempotency key unless a queued, running or recently finished
+        job already holds the key; returns whichever job holds it. Failed jobs release their
+        key so a retry runs again. Raises IdempotencyConflict if the holder was submitted
+        with a different `fingerprint` (request body).
+        """
+        raise NotImplementedError
+
+    def get(self, timeout: float | None = None) -> dict | None:
+        """Removes and returns the next job to run, or None after `timeout` seconds."""
+        raise NotImplementedError
+
+    def save(self, job: dict) -> None:
+        """Persists a status change of a job and wakes anyone waiting on it."""
+        raise NotImplementedError
+
+    def load(self, job_id: str) -> dict | None:
+        """Returns a copy of the job with the given ID, or None if unknown or expired."""
+        raise NotImplementedError
+
+    def wait(self, job_id: str, version: int, timeout: float) -> dict | None:
+        """Blocks until the job's version exceeds `version` or the timeout expires, then returns it."""
+        raise NotImplementedError
+
+    def depth(self) -> int:
+        """Returns the number of queued jobs."""
+        raise NotImplementedError
+
+
+class InMemoryJobQueue(JobQueue):
+    """
+    Process-local queue with per-user fair scheduling: workers take jobs
+    round-robin across users, so one user's backlog cannot starve others.
+    Finished jobs are kept for `result_ttl` seconds, and replayed to duplicate
+    submissions for `dedup_ttl` seconds.
+    """
+
+    def __init__(self, max_size: int = 1000, result_ttl: float = 3600, dedup_ttl: float = 600):
+        self._max_size = max_size
+        self._result_ttl = result_ttl
+        self._dedup_ttl = min(dedup_ttl, result_ttl)
+        self._pending: OrderedDict[str, deque] = OrderedDict()
+        self._jobs: dict[str, dict] = {}
+        self._keys: dict[str, tuple[str, str]] = {}  # idempotency key -> (job_id, fingerprint)
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, job: dict) -> None:
+        with self._cond:
+            if self._size >= self._max_size:
+                raise QueueFullError("Enhancement queue is full")
+            self._expire()
+            self._jobs[job["job_id"]] = job
+            self._pending.setdefault(job["user"], deque()).append(job["job_id"])
+            self._size += 1
+            self._cond.notify_all()
+
+    def put_unique(self, job: dict, key: str, fingerprint: str) -> dict:
+        with self._cond:
+            job_id, held_for = self._keys.get(key, (None, None))
+            holder = self._jobs.get(job_id) if job_id else None
+            if holder and self._replayable(holder):
+                if held_for != fingerprint:
+                    raise IdempotencyConflict("Idempotency key was already used for a different request")
+                return dict(holder)
+            self.put(job)
+            self._keys[key] = (job["job_id"], fingerprint)
+            return job
+
+    def _replayable(self, job: dict) -> bool:
+        """True while a job can stand in for a duplicate: not failed, and finished within the dedup window."""
+        if job["status"] == FAILED:
+            return False
+        return job["status"] != DONE or job.get("finished_at", 0) >= time.time() - self._dedup_ttl
+
+    def get(self, timeout: float | None = None) -> dict | None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            # Take the oldest job of the first user, then rotate that user to the back
+            user, jobs = next(iter(self._pending.items()))
+            job_id = jobs.popleft()
+            del self._pending[user]
+            if jobs:
+                self._pending[user] = jobs
+            self._size -= 1
+            return dict(self._jobs[job_id])
+
+    def save(self, job: dict) -> None:
+        with self._cond:
+            job["version"] = job.get("version", 0) + 1
+            self._jobs[job["job_id"]] = dict(job)
+            self._cond.notify_all()
+
+    def load(self, job_id: str) -> dict | None:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, version: int, timeout: float) -> dict | None:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job.get("version", 0) > version or remaining <= 0:
+                    return dict(job) if job else None
+                self._cond.wait(remaining)
+
+    def depth(self) -> int:
+        with self._cond:
+            return self._size
+
+    def _expire(self) -> None:
+        """Drops finished jobs older than the result TTL. Caller must hold the lock."""
+        cutoff = time.time() - self._result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in (DONE, FAILED) and job.get("finished_at", 0) < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        for key in [key for key, (job_id, _) in self._keys.items() if job_id not in self._jobs]:
+            del self._keys[key]
+
+
+def make_queue() -> JobQueue:
+    """Creates the job queue selected by Config.JOB_QUEUE_BACKEND."""
+    backend = Config.JOB_QUEUE_BACKEND
+    if backend == "memory":
+        return InMemoryJobQueue(Config.ENHANCE_QUEUE_MAX, Config.ENHANCE_RESULT_TTL, Config.ENHANCE_DEDUP_TTL)
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+
+
+class JobManager:
+    """
+    Submits jobs to a JobQueue and drains it with a bounded pool of
+    background worker threads that call `handler(payload)`. Jobs queued longer than
+    Config.ENHANCE_QUEUE_DEADLINE fail without running, and `on_shed(payload)` is called.
+    Workers are started on the first submission.
+    """
+
+    def __init__(self, handler, queue: JobQueue | None = None, workers: int | None = None, on_shed=None):
+        self._handler = handler
+        self._on_shed = on_shed
+        self._queue = queue
+        self._workers = workers or Config.ENHANCE_WORKERS
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @property
+    def queue(self) -> JobQueue:
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = make_queue()
+        return self._queue
+
+    def submit(self, user: str, payload: dict, key: str | None = None, fingerprint: str = "") -> dict:
+        """
+        Enqueues a job for `user` and returns it. With an idempotency `key`, a duplicate of a
+        queued, running or recently finished job returns that job instead, marked "deduplicated".
+        Raises QueueFullError at capacity and IdempotencyConflict for a reused key.
+        """
+        self._ensure_workers()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "user": user,
+            "payload": payload,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "version": 0,
+        }
+        if key is None:
+            self.queue.put(job)
+        else:
+            held = self.queue.put_unique(job, f"{user}:{key}", fingerprint)
+            if held["job_id"] != job["job_id"]:
+                DEDUPLICATED.inc(state="replayed" if held["status"] == DONE else "joined")
+                logger.info(f"[Jobs] {held['job_id']} reused for a duplicate request from {user}")
+                return {**held, "deduplicated": True}
+        logger.info(f"[Jobs] queued {job['job_id']} for {user} (depth={self.queue.depth()})")
+        return job
+
+    def get(self, job_id: str) -> dict | None:
+        return self.queue.load(job_id)
+
+    def wait(self, job_id: str, version: int, timeout: float) -> dict | None:
+        return self.queue.wait(job_id, version, timeout)
+
+    def _ensure_workers(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                t = threading.Thread(target=self._work, name=f"enhance-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                continue
+            job["started_at"] = time.time()
+            waited = job["started_at"] - job["created_at"]
+            if Config.ENHANCE_QUEUE_DEADLINE and waited > Config.ENHANCE_QUEUE_DEADLINE:
+                # The client has most likely given up; do not spend a GPU call on it
+                logger.warning(f"[Jobs] {job['job_id']} shed after {waited:.0f}s in the queue")
+                metrics.STAGE_SECONDS.observe(waited, stage="jobs.queue_wait", outcome="shed")
+                job.update(status=FAILED, error="Expired in the queue, try again", error_status=503,
+                           finished_at=time.time())
+                self.queue.save(job)
+                if self._on_shed:
+                    self._on_shed(job["payload"])
+                continue
+            job["status"] = RUNNING
+            self.queue.save(job)
+            metrics.STAGE_SECONDS.observe(waited, stage="jobs.queue_wait", outcome="ok")
+            try:
+                with metrics.trace(job["payload"].get("trace_id")), metrics.span("jobs.run"):
+                    job["result"] = self._handler(job["payload"])
+                job["status"] = DONE
+            except Exception as e:
+                logger.error(f"[Jobs] {job['job_id']} failed: {str(e)}")
+                job["error"] = str(e)
+                job["error_status"] = getattr(e, "status", 500)
+                job["status"] = FAILED
+            job["finished_at"] = time.time()
+            self.queue.save(job)
+
+
+def public_view(job: dict) -> dict:
+    """Returns the client-facing fields of a job."""
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
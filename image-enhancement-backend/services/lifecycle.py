@@ -0,0 +1,252 @@
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import Config
+from services import result_cache, run_index
+from services.offload import run_cpu_bound
+from services.s3_service import (
+    DERIVATIVE_KEY_RE, INPUT_KEY_RE, ORIGINAL_KEY_RE, PLOT_KEY_RE, RUN_KEY_RE,
+    delete_keys, download_object, head_object, iter_bucket_objects, replace_metadata, replace_object
+)
+from utils.helpers import pil_image
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Why an object is removed
+STALE_RUN = "stale_run"                  # original never enhanced, with its input and derivatives
+ORPHAN_PLOT = "orphan_plot"              # plot of a run without an enhanced image
+ORPHAN_DERIVATIVE = "orphan_derivative"  # thumbnail or preview of an image that is gone
+ORPHAN_INPUT = "orphan_input"            # normalised input of an original that is gone
+SCRATCH = "scratch"                      # tile left in <folder>/tmp/ by an interrupted tiled run
+CATEGORIES = (STALE_RUN, ORPHAN_PLOT, ORPHAN_DERIVATIVE, ORPHAN_INPUT, SCRATCH)
+
+SAMPLE_KEYS = 5  # keys listed per category in the report
+
+
+def _age(obj: dict, now: float) -> float:
+    modified = obj.get("LastModified")
+    return now - modified.timestamp() if isinstance(modified, datetime) else 0.0
+
+
+def _enhancing(user_folder: str, run_id: str) -> bool:
+    record = run_index.get_run(user_folder, run_id)
+    return bool(record) and record["status"] == run_index.ENHANCING
+
+
+def _folder_objects(contents):
+    """Groups a listing, which S3 returns in key order, into (user folder, objects) one folder at a time."""
+    folder, objects = None, []
+    for obj in contents:
+        current = obj["Key"].split("/", 1)[0]
+        if current != folder and objects:
+            yield folder, objects
+            objects = []
+        folder = current
+        objects.append(obj)
+    if objects:
+        yield folder, objects
+
+
+def classify(folder: str, objects: list[dict], now: float, stale_days: float, orphan_hours: float,
+             transcode_days: float | None = None) -> tuple[list[tuple[str, dict]], list[dict]]:
+    """
+    Sorts one user folder's objects by the key naming conventions of s3_service.
+    Returns the objects to remove as (category, object) and the originals old enough to recompress.
+    Nothing younger than `orphan_hours` is touched, so uploads and runs in flight are safe.
+    """
+    enhanced, originals, images = set(), {}, set()
+    for obj in objects:
+        key = obj["Key"]
+        m = RUN_KEY_RE.match(key)
+        if m:
+            enhanced.add(m.group("run_id"))
+            images.add(key.rsplit(".", 1)[0])
+            continue
+        m = ORIGINAL_KEY_RE.match(key)
+        if m:
+            originals[m.group("run_id")] = obj
+            images.add(key.rsplit(".", 1)[0])
+
+    # Runs uploaded long ago and never enhanced (unless an enhancement is running now)
+    stale = {
+        run_id for run_id, obj in originals.items()
+        if run_id not in enhanced and _age(obj, now) > stale_days * 86400 and not _enhancing(folder, run_id)
+    }
+    stale_stems = {originals[run_id]["Key"].rsplit(".", 1)[0] for run_id in stale}
+
+    removals, transcode = [], []
+    grace = orphan_hours * 3600
+    for obj in objects:
+        key = obj["Key"]
+        m = ORIGINAL_KEY_RE.match(key)
+        if m:
+            if m.group("run_id") in stale:
+                removals.append((STALE_RUN, obj))
+            elif transcode_days is not None and m.group("run_id") in enhanced and key.endswith(".png") \
+                    and _age(obj, now) > transcode_days * 86400:
+                transcode.append(obj)
+            continue
+        if RUN_KEY_RE.match(key):
+            continue
+        old = _age(obj, now) > grace
+        m = PLOT_KEY_RE.match(key)
+        if m:
+            if m.group("run_id") not in enhanced and old:
+                removals.append((ORPHAN_PLOT, obj))
+            continue
+        m = INPUT_KEY_RE.match(key)
+        if m:
+            if m.group("run_id") in stale:
+                removals.append((STALE_RUN, obj))
+            elif m.group("run_id") not in originals and old:
+                removals.append((ORPHAN_INPUT, obj))
+            continue
+        m = DERIVATIVE_KEY_RE.match(key)
+        if m:
+            if m.group("source") in stale_stems:
+                removals.append((STALE_RUN, obj))
+            elif m.group("source") not in images and old:
+                removals.append((ORPHAN_DERIVATIVE, obj))
+            continue
+        if key.startswith(f"{folder}/tmp/") and old:
+            removals.append((SCRATCH, obj))
+    return removals, transcode
+
+
+def _encode_png(data: bytes) -> bytes | None:
+    """
+    Re-encodes a PNG at maximum compression, keeping its colour profile, EXIF, DPI,
+    transparency and text chunks. Returns None unless the result decodes to exactly the
+    same pixels (animated PNGs and anything that is not a PNG are left alone).
+    """
+    Image = pil_image()
+    from PIL import PngImagePlugin
+
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format != "PNG" or getattr(image, "is_animated", False):
+            return None
+        image.load()
+        options = {k: image.info[k] for k in ("icc_profile", "exif", "dpi", "transparency") if k in image.info}
+        text = PngImagePlugin.PngInfo()
+        for k, v in getattr(image, "text", {}).items():
+            text.add_text(k, v)
+        out = io.BytesIO()
+        image.save(out, "PNG", optimize=True, pnginfo=text, **options)
+        with Image.open(io.BytesIO(out.getvalue())) as check:
+            if check.mode != image.mode or check.size != image.size or check.tobytes() != image.tobytes():
+                return None
+    return out.getvalue()
+
+
+def recompress_original(key: str) -> tuple[int, int] | None:
+    """
+    Rewrites an original PNG in place with lossless maximum compression when that saves at
+    least LIFECYCLE_MIN_SAVING. The key, pixels, metadata and result cache entries are kept.
+    Returns (bytes before, bytes after), or None if the original was skipped or failed.
+    """
+    try:
+        head = head_object(key)
+        if head is None or head.get("Metadata", {}).get("compacted") == "true":
+            return None
+        buffer = io.BytesIO()
+        if not download_object(key, buffer):
+            return None
+        data = buffer.getvalue()
+        compact = run_cpu_bound(_encode_png, data)
+        if compact is None or len(compact) > len(data) * (1 - Config.LIFECYCLE_MIN_SAVING):
+            # Flag it so later passes do not download it again
+            replace_metadata(key, {**head.get("Metadata", {}), "compacted": "true"},
+                             head.get("ContentType", "image/png"))
+            return None
+
+        # Results cached for the original's bytes stay valid: the pixels are the same
+        if result_cache.original_digest(key) is None:
+            result_cache.record_original(key, result_cache.digest_bytes(data))
+        metadata = {**head.get("Metadata", {}), "compacted": "true"}
+        if not replace_object(key, compact, head.get("ContentType", "image/png"), metadata):
+            return None
+        m = ORIGINAL_KEY_RE.match(key)
+        run_index.update_run(m.group("folder"), m.group("run_id"), original_bytes=len(compact))
+        return len(data), len(compact)
+    except Exception as e:
+        logger.error(f"[Lifecycle] recompressing {key} failed: {str(e)}")
+        return None
+
+
+def compact_storage(prefix: str = "", apply: bool = False, stale_days: float | None = None,
+                    orphan_hours: float | None = None, transcode: bool = False,
+                    transcode_days: float | None = None, workers: int | None = None) -> dict:
+    """
+    Streams the bucket (or a prefix) with a paginated listing, one user folder at a time, and
+    removes stale runs and orphaned objects, optionally recompressing old originals. Removals go
+    out in concurrent 1,000-key batches as they accumulate, so memory stays bounded by the
+    largest user folder. Without `apply` nothing is changed and the report says what would be.
+    Returns the report: scanned objects and bytes, removals per category with sample keys,
+    recompression totals and any delete errors.
+    """
+    stale_days = Config.LIFECYCLE_STALE_DAYS if stale_days is None else stale_days
+    orphan_hours = Config.LIFECYCLE_ORPHAN_HOURS if orphan_hours is None else orphan_hours
+    if transcode:
+        transcode_days = Config.LIFECYCLE_TRANSCODE_DAYS if transcode_days is None else transcode_days
+    else:
+        transcode_days = None
+
+    report = {
+        "dry_run": not apply,
+        "scanned": {"users": 0, "objects": 0, "bytes": 0},
+        "remove": {name: {"objects": 0, "bytes": 0, "sample": []} for name in CATEGORIES},
+        "recompress": {"candidates": 0, "candidate_bytes": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0},
+        "deleted": 0,
+        "errors": [],
+    }
+    started, now = time.perf_counter(), time.time()
+    pending = []
+    batch_limit = 1000 * max(1, Config.DELETE_WORKERS)
+
+    def flush():
+        deleted, errors = delete_keys(pending)
+        report["deleted"] += len(deleted)
+        report["errors"] += errors
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=workers or Config.LIFECYCLE_WORKERS) as pool:
+        for folder, objects in _folder_objects(iter_bucket_objects(prefix)):
+            report["scanned"]["users"] += 1
+            report["scanned"]["objects"] += len(objects)
+            report["scanned"]["bytes"] += sum(obj.get("Size", 0) for obj in objects)
+
+            removals, originals = classify(folder, objects, now, stale_days, orphan_hours, transcode_days)
+            for category, obj in removals:
+                entry = report["remove"][category]
+                entry["objects"] += 1
+                entry["bytes"] += obj.get("Size", 0)
+                if len(entry["sample"]) < SAMPLE_KEYS:
+                    entry["sample"].append(obj["Key"])
+            report["recompress"]["candidates"] += len(originals)
+            report["recompress"]["candidate_bytes"] += sum(obj.get("Size", 0) for obj in originals)
+            if not apply:
+                continue
+
+            pending.extend(obj["Key"] for _, obj in removals)
+            if len(pending) >= batch_limit:
+                flush()
+            for result in pool.map(recompress_original, [obj["Key"] for obj in originals]):
+                if result:
+                    report["recompress"]["rewritten"] += 1
+                    report["recompress"]["bytes_before"] += result[0]
+                    report["recompress"]["bytes_after"] += result[1]
+        if pending:
+            flush()
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    removed = sum(entry["objects"] for entry in report["remove"].values())
+    logger.info(
+        f"[Lifecycle] {'removed' if apply else 'would remove'} {removed} of "
+        f"{report['scanned']['objects']} objects, recompressed {report['recompress']['rewritten']} originals "
+        f"in {report['seconds']} s ({len(report['errors'])} errors)"
+    )
+    return report
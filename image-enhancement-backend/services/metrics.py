@@ -0,0 +1,321 @@
+import contextvars
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from config import Config
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+ENABLED = Config.METRICS_ENABLED
+
+# Latency buckets in seconds, from token cache hits up to long GPU calls
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Size buckets in bytes, from 1KB to 256MB in powers of 4
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+_registry: list = []
+_collectors: list = []
+
+# Per-request trace ID, propagated to enhancement workers through the job payload
+_trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter with optional labels. inc() is a no-op when metrics are disabled."""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in values]
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels. observe() is a no-op when metrics are disabled."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._values: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {state[-1]}")
+        return lines
+
+
+def register_collector(collect) -> None:
+    """
+    Adds a callback evaluated at scrape time for state owned elsewhere (queue depth,
+    cache counters, backend health). `collect()` returns a list of
+    (name, type, help, [(labels dict, value), ...]).
+    """
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for collect in _collectors:
+        try:
+            samples = collect()
+        except Exception as e:
+            logger.error(f"[Metrics] collector failed: {str(e)}")
+            continue
+        for name, kind, help, values in samples:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in values:
+                names = tuple(labels)
+                lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across the backend
+HTTP_SECONDS = Histogram("sharpify_http_request_seconds", "Time to produce an HTTP response.",
+                         ("method", "endpoint", "status"))
+STAGE_SECONDS = Histogram("sharpify_stage_seconds", "Time spent in one step of a request or job.",
+                          ("stage", "outcome"))
+EXTERNAL_SECONDS = Histogram("sharpify_external_call_seconds", "Latency of calls to S3, Gradio and Firebase.",
+                             ("service", "operation", "outcome"))
+TRANSFER_BYTES = Histogram("sharpify_transfer_bytes", "Size of payloads moved to or from external services.",
+                           ("service", "direction"), BYTES_BUCKETS)
+AUTH_VERIFICATIONS = Counter("sharpify_auth_verifications_total", "Token verifications by path and outcome.",
+                             ("path", "outcome"))
+
+
+class _Span:
+    """Times a block into STAGE_SECONDS; the outcome is "error" if the block raised."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, stage=self.stage, outcome="error" if exc_type else "ok")
+        logger.debug(f"[Span] {self.stage} took {elapsed * 1000:.1f} ms")
+        return False
+
+
+_NOOP = nullcontext()
+
+
+def span(stage: str):
+    """Returns a context manager timing one pipeline stage (a shared no-op when disabled)."""
+    return _Span(stage) if ENABLED else _NOOP
+
+
+def observe_call(service: str, operation: str, seconds: float, ok: bool = True) -> None:
+    """Records one call to an external service."""
+    EXTERNAL_SECONDS.observe(seconds, service=service, operation=operation, outcome="ok" if ok else "error")
+
+
+class TimedReader:
+    """
+    Wraps a readable stream and accumulates the bytes and seconds spent in read(),
+    which separates the producer's time (download, decoding) from the consumer's (S3 upload).
+    Other attributes (seek, tell, ...) are delegated to the wrapped stream.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self._stream.read(size)
+        self.seconds += time.perf_counter() - start
+        self.bytes += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _body_size(body) -> int:
+    """Returns the size of a request body (bytes, sized chunk or seekable file), or 0 if unknown."""
+    if not body:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        pass
+    try:
+        position = body.tell()
+        end = body.seek(0, 2)
+        body.seek(position)
+        return end - position
+    except Exception:
+        return 0
+
+
+def instrument_boto_client(client, service: str = "s3") -> None:
+    """Records latency and payload sizes of every call made by a boto3 client through its event hooks."""
+    if not ENABLED:
+        return
+    prefix = client.meta.service_model.service_name
+
+    def before_call(model, params, context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+        context["metrics_operation"] = model.name
+        size = _body_size(params.get("body"))
+        if size:
+            TRANSFER_BYTES.observe(size, service=service, direction="upload")
+
+    def after_call(model, http_response, parsed, context, **kwargs):
+        start = context.get("metrics_start")
+        if start is not None:
+            observe_call(service, model.name, time.perf_counter() - start, http_response.status_code < 400)
+        if model.name == "GetObject" and parsed.get("ContentLength"):
+            TRANSFER_BYTES.observe(parsed["ContentLength"], service=service, direction="download")
+
+    def after_call_error(context, **kwargs):
+        # Emitted with the exception and context only; the operation was noted before the call
+        start = context.get("metrics_start")
+        if start is not None:
+            operation = context.get("metrics_operation", "unknown")
+            observe_call(service, operation, time.perf_counter() - start, ok=False)
+
+    client.meta.events.register(f"before-call.{prefix}", before_call)
+    client.meta.events.register(f"after-call.{prefix}", after_call)
+    client.meta.events.register(f"after-call-error.{prefix}", after_call_error)
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: str | None):
+    """Sets the trace ID for log records emitted inside the block (e.g. in a worker thread)."""
+    token = _trace_id.set(trace_id or "-")
+    try:
+        yield
+    finally:
+        _trace_id.reset(token)
+
+
+_trace_factory_installed = False
+
+
+def install_log_trace_ids() -> None:
+    """Adds a `trace_id` attribute to every log record so formats can include %(trace_id)s."""
+    global _trace_factory_installed
+    if _trace_factory_installed:
+        return
+    _trace_factory_installed = True
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = _trace_id.get()
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+
+
+_TRACE_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def init_app(app) -> None:
+    """
+    Times every request into HTTP_SECONDS and, when Config.TRACE_IDS is set, tags it with a
+    trace ID taken from a well-formed X-Request-ID header or generated, echoed in the response.
+    """
+    from flask import g, request
+
+    if Config.TRACE_IDS:
+        install_log_trace_ids()
+
+    if not ENABLED and not Config.TRACE_IDS:
+        return
+
+    @app.before_request
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        if Config.TRACE_IDS:
+            incoming = request.headers.get("X-Request-ID", "")
+            g.trace_id = incoming if _TRACE_ID_RE.match(incoming) else uuid.uuid4().hex[:16]
+            g.trace_token = _trace_id.set(g.trace_id)
+
+    @app.after_request
+    def finish_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                 endpoint=endpoint, status=response.status_code)
+        if Config.TRACE_IDS and "trace_id" in g:
+            response.headers["X-Request-ID"] = g.trace_id
+        return response
+
+    @app.teardown_request
+    def reset_trace(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            _trace_id.reset(token)
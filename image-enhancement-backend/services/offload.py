@@ -0,0 +1,30 @@
+import sys
+
+from config import Config
+
+_pool_sized = False
+
+
+def cooperative() -> bool:
+    """True when running under gevent with the standard library patched (gunicorn's gevent workers)."""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """
+    Calls `fn(*args, **kwargs)` and returns its result. Under gevent the call runs on
+    a native thread from the hub's pool, so decoding, encoding and blending images does
+    not stall every other request on the worker; otherwise it runs inline.
+    `fn` must not log or take locks, since those are greenlet primitives under gevent.
+    """
+    global _pool_sized
+    if not cooperative():
+        return fn(*args, **kwargs)
+
+    from gevent import get_hub
+    pool = get_hub().threadpool
+    if not _pool_sized:
+        pool.maxsize = Config.CPU_OFFLOAD_THREADS
+        _pool_sized = True
+    return pool.apply(fn, args, kwargs)
@@ -0,0 +1,92 @@
+import logging
+import uuid
+
+from config import Config
+from services import metrics, result_cache, run_index
+from services.offload import run_cpu_bound
+from services.s3_service import original_key_for, schedule_derivatives, upload_file_to_s3
+from utils.helpers import probe_image, needs_conversion, convert_image, user_folder_for
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Raised when an original cannot be validated or stored; carries the HTTP status to report."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def store_original(data: bytes, user_email: str, enhancements: dict | None = None) -> tuple[str, str]:
+    """
+    Validates an uploaded original from its header, converts it only when needed,
+    uploads it to S3 under a new run ID, records the run and the content digest,
+    and queues its thumbnail and preview.
+    Returns (run_id, file_url); raises UploadError on failure.
+    """
+    # Step 1: Validate size, then format and dimensions from the header without decoding pixels
+    if len(data) > Config.MAX_CONTENT_LENGTH:
+        raise UploadError("File is too large")
+    try:
+        with metrics.span("upload.probe"):
+            image_format, width, height, mode = probe_image(data)
+    except Exception as e:
+        logger.error(f"Error processing image: {str(e)}")
+        raise UploadError("Invalid or corrupted image") from e
+    if width > Config.MAX_WIDTH or height > Config.MAX_HEIGHT:
+        logger.warning(f"Image resolution too large: {width}x{height} px")
+        raise UploadError("Image resolution exceeds allowed size")
+
+    # Step 2: Generate a unique run ID
+    run_id = uuid.uuid4().hex
+
+    # Step 3: Pass acceptable images through untouched; convert only the rest
+    if needs_conversion(image_format, mode):
+        try:
+            with metrics.span("upload.convert"):
+                image_data, content_type = run_cpu_bound(
+                    convert_image, data, Config.UPLOAD_CONVERT_FORMAT, Config.UPLOAD_CONVERT_QUALITY
+                )
+        except Exception as e:
+            logger.error(f"Error converting image: {str(e)}")
+            raise UploadError("Invalid or corrupted image") from e
+        logger.info(f"Converted {image_format}/{mode} upload to {Config.UPLOAD_CONVERT_FORMAT}")
+        image_format = Config.UPLOAD_CONVERT_FORMAT
+    else:
+        image_data, content_type = data, f"image/{image_format.lower()}"
+
+    # Step 4: Upload image to S3 under a key named after its stored format
+    user_folder = user_folder_for(user_email)
+    key = original_key_for(user_folder, run_id, image_format)
+    with metrics.span("upload.s3_put"):
+        file_url = upload_file_to_s3(
+            file_path=None,
+            filename=key.rsplit("/", 1)[1],
+            user_email=user_email,
+            enhancements=enhancements,
+            image_data=image_data,  # Provide raw image bytes
+            content_type=content_type
+        )
+    if not file_url:
+        logger.error("File upload to S3 failed.")
+        raise UploadError("File upload failed", 500)
+
+    # Step 5: Record the run, and the content digest so /enhance can look up cached results
+    try:
+        run_index.record_upload(user_folder, run_id, key, enhancements, len(image_data), width, height)
+    except Exception as e:
+        logger.error(f"Failed to record run {run_id}: {str(e)}")
+    try:
+        with metrics.span("upload.digest"):
+            result_cache.record_original(key, result_cache.digest_bytes(image_data))
+    except Exception as e:
+        logger.error(f"Failed to record original digest: {str(e)}")
+
+    # Step 6: Render the gallery thumbnail and preview in the background
+    schedule_derivatives(key, image_data)
+
+    logger.info(f"File uploaded successfully to S3: {file_url}")
+    return run_id, file_url
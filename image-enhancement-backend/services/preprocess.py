@@ -0,0 +1,171 @@
+import io
+import logging
+import tempfile
+import time
+
+from config import Config
+from services import metrics, run_index
+from services.offload import run_cpu_bound
+from services.s3_service import download_object, public_url, read_object_range, upload_file_to_s3
+from utils.helpers import PASSTHROUGH_FORMATS, PASSTHROUGH_MODES, pil_image, probe_image
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# EXIF tag holding the camera orientation (1 = upright)
+ORIENTATION_TAG = 0x0112
+
+BYTES_SAVED = metrics.Counter("sharpify_preprocess_saved_bytes_total",
+                              "Bytes not sent to Gradio thanks to input normalisation.")
+PIXELS_SAVED = metrics.Counter("sharpify_preprocess_saved_pixels_total",
+                               "Pixels not sent to Gradio thanks to input normalisation.")
+
+
+def settings() -> str:
+    """Identifies the normalisation settings; results and stored inputs are only reused for the same ones."""
+    return f"{Config.PREPROCESS_MAX_SIDE}:{Config.PREPROCESS_FORMAT}:{Config.PREPROCESS_QUALITY}"
+
+
+def plan(header: bytes) -> tuple[list[str], dict]:
+    """
+    Decides from an image header which normalisation steps an original needs.
+    Returns (steps, info) where steps is a subset of ["resize", "orient", "convert"]
+    (empty when the original can be sent as-is) and info has format, width, height and mode.
+    """
+    image_format, width, height, mode = probe_image(header)
+    orientation = 1
+    try:
+        Image = pil_image()
+        with Image.open(io.BytesIO(header)) as image:
+            orientation = image.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        pass
+
+    steps = []
+    if Config.PREPROCESS_MAX_SIDE and max(width, height) > Config.PREPROCESS_MAX_SIDE:
+        steps.append("resize")
+    if orientation not in (None, 1):
+        steps.append("orient")
+    if image_format not in PASSTHROUGH_FORMATS or mode not in PASSTHROUGH_MODES:
+        steps.append("convert")
+    return steps, {"format": image_format, "width": width, "height": height, "mode": mode}
+
+
+def _output_format(source_format: str) -> str:
+    """Resolves PREPROCESS_FORMAT; "auto" keeps JPEG sources in JPEG and encodes everything else as PNG."""
+    if Config.PREPROCESS_FORMAT != "AUTO":
+        return Config.PREPROCESS_FORMAT
+    return "JPEG" if source_format == "JPEG" else "PNG"
+
+
+def normalise(stream, target_format: str, max_side: int = 0, quality: int = 95) -> tuple[bytes, str, int, int]:
+    """
+    Decodes an image, shrinks it to fit `max_side` (JPEG DCT scaling, then a reducing-gap
+    Lanczos resize), applies its EXIF orientation, flattens alpha onto white, converts it
+    to RGB (greyscale stays L) and encodes it without metadata.
+    Returns (bytes, content_type, width, height). CPU-bound; callers use run_cpu_bound.
+    """
+    Image = pil_image()
+    from PIL import ImageOps
+
+    with Image.open(stream) as image:
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in PASSTHROUGH_MODES:
+            if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                image = image.convert("RGB")
+
+        buf = io.BytesIO()
+        options = {"quality": quality} if target_format in ("JPEG", "WEBP") else {}
+        image.save(buf, format=target_format, **options)
+        return buf.getvalue(), Image.MIME[target_format], image.width, image.height
+
+
+def prepare_input(user_email: str, original_key: str, run_id: str) -> dict | None:
+    """
+    Normalises an original before inference and stores the result next to it as
+    `original_<run_id>_input.<ext>`, recording both in the run index. Originals that
+    need no change are sent as-is, and inputs already prepared with the same settings
+    are reused. Returns a report with the key and URL to send and the bytes and pixels
+    saved, or None when the original should be sent unchanged (including on failure).
+    """
+    started = time.perf_counter()
+    try:
+        recorded = run_index.input_for(original_key)
+        if recorded and recorded["settings"] == settings():
+            return _report(recorded, 0.0, reused=True)
+
+        # Step 1: Decide from the header alone; most originals need nothing
+        header = read_object_range(original_key, Config.UPLOAD_HEADER_BYTES)
+        if not header:
+            return None
+        steps, info = plan(header)
+        if not steps:
+            return None
+
+        # Step 2: Download and normalise the original
+        with tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES) as spool:
+            if not download_object(original_key, spool):
+                return None
+            original_bytes = spool.tell()
+            spool.seek(0)
+            target_format = _output_format(info["format"])
+            data, content_type, width, height = run_cpu_bound(
+                normalise, spool, target_format, Config.PREPROCESS_MAX_SIDE, Config.PREPROCESS_QUALITY
+            )
+
+        # Step 3: Store the normalised input and record it with the original
+        ext = "jpg" if target_format == "JPEG" else target_format.lower()
+        filename = f"original_{run_id}_input.{ext}"
+        if not upload_file_to_s3(file_path=None, filename=filename, user_email=user_email,
+                                 image_data=data, content_type=content_type):
+            return None
+        record = {
+            "original_key": original_key,
+            "input_key": original_key.rsplit("/", 1)[0] + "/" + filename,
+            "settings": settings(),
+            "steps": steps,
+            "original_width": info["width"],
+            "original_height": info["height"],
+            "original_bytes": original_bytes,
+            "input_width": width,
+            "input_height": height,
+            "input_bytes": len(data),
+        }
+        run_index.record_input(**record)
+    except Exception as e:
+        logger.error(f"[Preprocess] {original_key} sent as-is: {str(e)}")
+        return None
+
+    report = _report(record, time.perf_counter() - started)
+    BYTES_SAVED.inc(max(0, report["bytes_saved"]))
+    PIXELS_SAVED.inc(max(0, report["pixels_saved"]))
+    logger.info(
+        f"[Preprocess] {original_key}: {'+'.join(steps)} "
+        f"{info['width']}x{info['height']} -> {width}x{height}, "
+        f"{report['bytes_saved']} bytes saved in {report['seconds'] * 1000:.0f} ms"
+    )
+    return report
+
+
+def _report(record: dict, seconds: float, reused: bool = False) -> dict:
+    """Builds the per-request preprocessing summary returned with the job result."""
+    return {
+        "key": record["input_key"],
+        "url": public_url(record["input_key"]),
+        "steps": record["steps"],
+        "original": {"width": record["original_width"], "height": record["original_height"],
+                     "bytes": record["original_bytes"]},
+        "input": {"width": record["input_width"], "height": record["input_height"],
+                  "bytes": record["input_bytes"]},
+        "bytes_saved": record["original_bytes"] - record["input_bytes"],
+        "pixels_saved": (record["original_width"] * record["original_height"]
+                         - record["input_width"] * record["input_height"]),
+        "seconds": round(seconds, 4),
+        "reused": reused,
+    }
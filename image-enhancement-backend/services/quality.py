@@ -0,0 +1,129 @@
+import io
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from config import Config
+from services import metrics, run_index
+from services.offload import run_cpu_bound
+from services.s3_service import download_object, rebuild_user_index, upload_plot_image
+from utils.helpers import user_folder_for
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Background pool measuring finished runs off the request path
+_quality_pool = ThreadPoolExecutor(max_workers=Config.QUALITY_WORKERS, thread_name_prefix="quality")
+
+
+def schedule(user_email: str, run_id: str):
+    """Queues the quality measurement of an enhanced run on the background pool. Returns the future, or None if disabled."""
+    if not Config.QUALITY_METRICS_ENABLED:
+        return None
+    return _quality_pool.submit(_timed_measure, user_email, run_id)
+
+
+def _timed_measure(user_email: str, run_id: str) -> dict | None:
+    with metrics.span("quality.measure"):
+        return measure_run(user_email, run_id)
+
+
+def measure_run(user_email: str, run_id: str) -> dict | None:
+    """
+    Compares a run's enhanced image with its original, uploads the comparison plots
+    and stores the scores on the run. Returns the scores, or None if the run has no
+    enhanced image or the measurement failed.
+    """
+    from services.image_metrics import evaluate  # numpy is only loaded once a run is measured
+
+    user_folder = user_folder_for(user_email)
+    record = run_index.get_run(user_folder, run_id)
+    if not record or not record["enhanced_key"] or not record["original_key"]:
+        return None
+
+    started = time.perf_counter()
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES) as original, \
+                tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES) as enhanced:
+            if not download_object(record["original_key"], original) or \
+                    not download_object(record["enhanced_key"], enhanced):
+                return None
+            original.seek(0)
+            enhanced.seek(0)
+            scores, plots = run_cpu_bound(evaluate, original, enhanced)
+    except Exception as e:
+        logger.error(f"[Quality] measuring run {run_id} failed: {str(e)}")
+        return None
+    return _store(user_email, user_folder, run_id, scores, plots, time.perf_counter() - started)
+
+
+def _store(user_email: str, user_folder: str, run_id: str, scores: dict, plots: list[bytes],
+           seconds: float) -> dict:
+    """Uploads the plots of a measured run and records its scores with their keys."""
+    scores["plots"] = []
+    for idx, plot in enumerate(plots):
+        _, key = upload_plot_image(plot, user_email, run_id, idx)
+        if key:
+            scores["plots"].append(key)
+    scores["seconds"] = round(seconds, 3)
+    scores["computed_at"] = time.time()
+    run_index.record_quality(user_folder, run_id, scores)
+    logger.info(
+        f"[Quality] run {run_id}: PSNR {scores['psnr']} dB, SSIM {scores['ssim']}, "
+        f"dE00 {scores['delta_e00']['mean']} in {seconds * 1000:.0f} ms"
+    )
+    return scores
+
+
+def _download(key: str) -> bytes | None:
+    buffer = io.BytesIO()
+    return buffer.getvalue() if download_object(key, buffer) else None
+
+
+def recompute_user(user_email: str, workers: int | None = None, force: bool = False) -> tuple[int, int]:
+    """
+    Measures every enhanced run of a user that has no scores yet (all of them with `force`).
+    Images are downloaded and results stored here, while the comparisons run on a pool of
+    `workers` processes (default: one per CPU), with at most two runs per process in flight.
+    Returns (measured, failed).
+    """
+    from services.image_metrics import evaluate
+
+    user_folder = user_folder_for(user_email)
+    if not run_index.is_indexed(user_folder) and not rebuild_user_index(user_folder):
+        logger.error(f"[Quality] run index unavailable for {user_folder}")
+        return 0, 0
+    runs = [run_index.get_run(user_folder, run["run_id"]) for run in run_index.list_runs(user_folder)]
+    todo = [run for run in runs if run and run["original_key"] and (force or not run["quality"])]
+    logger.info(f"[Quality] measuring {len(todo)} of {len(runs)} runs of {user_folder}")
+
+    workers = workers or os.cpu_count() or 1
+    measured = failed = 0
+    pending = {}
+
+    def collect(done):
+        nonlocal measured, failed
+        for future in done:
+            run_id, started = pending.pop(future)
+            try:
+                scores, plots = future.result()
+                _store(user_email, user_folder, run_id, scores, plots, time.perf_counter() - started)
+                measured += 1
+            except Exception as e:
+                logger.error(f"[Quality] measuring run {run_id} failed: {str(e)}")
+                failed += 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for run in todo:
+            if len(pending) >= 2 * workers:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            original, enhanced = _download(run["original_key"]), _download(run["enhanced_key"])
+            if original is None or enhanced is None:
+                failed += 1
+                continue
+            pending[pool.submit(evaluate, original, enhanced)] = (run["run_id"], time.perf_counter())
+        while pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+    return measured, failed
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from services import db, metrics
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Persistent tier: content digest + flags -> enhanced S3 object, plus known digests of originals
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    cache_key    TEXT PRIMARY KEY,
+    enhanced_key TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_cache_by_key ON result_cache (enhanced_key);
+
+CREATE TABLE IF NOT EXISTS original_digests (
+    key    TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+"""
+db.register_schema(_SCHEMA)
+
+# Enhancement flags in the order they are sent to Gradio
+FLAG_NAMES = ("face", "background", "text", "colorization")
+
+# Local tier: bounded LRU of cache_key -> (enhanced_key, content_type)
+_lru: OrderedDict[str, tuple[str, str]] = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "local_hits": 0, "misses": 0, "invalidations": 0}
+
+
+def digest_bytes(data: bytes) -> str:
+    """Returns the hex SHA-256 of an image's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(digest: str, flags: dict, variant: str = "") -> str:
+    """
+    Builds the cache key from the original's digest and the enhancement flag tuple.
+    `variant` distinguishes results of the same original prepared differently (e.g. preprocessing settings).
+    """
+    bits = "".join("1" if flags.get(name) else "0" for name in FLAG_NAMES)
+    return f"{digest}:{bits}:{variant}" if variant else f"{digest}:{bits}"
+
+
+def record_original(key: str, digest: str) -> None:
+    """Remembers the digest of an uploaded original so /enhance does not have to re-download it."""
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO original_digests (key, sha256) VALUES (?, ?)", (key, digest)
+        )
+
+
+def original_digest(key: str) -> str | None:
+    """Returns the recorded digest of an original, or None if unknown."""
+    row = db.connect().execute(
+        "SELECT sha256 FROM original_digests WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _remember_local(ckey: str, value: tuple[str, str]) -> None:
+    """Inserts into the LRU tier, evicting the least recently used entry when full. Caller holds the lock."""
+    _lru[ckey] = value
+    _lru.move_to_end(ckey)
+    while len(_lru) > Config.RESULT_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+def lookup(ckey: str) -> tuple[str, str] | None:
+    """
+    Returns (enhanced_key, content_type) of a previous result for this cache key,
+    checking the local LRU tier before the persistent tier.
+    """
+    with _lock:
+        value = _lru.get(ckey)
+        if value is not None:
+            _lru.move_to_end(ckey)
+            _stats["hits"] += 1
+            _stats["local_hits"] += 1
+            return value
+
+    row = db.connect().execute(
+        "SELECT enhanced_key, content_type FROM result_cache WHERE cache_key = ?", (ckey,)
+    ).fetchone()
+    with _lock:
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        _remember_local(ckey, (row[0], row[1]))
+    return row[0], row[1]
+
+
+def store(ckey: str, enhanced_key: str, content_type: str) -> None:
+    """Records a freshly computed result in both tiers."""
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO result_cache (cache_key, enhanced_key, content_type, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (ckey, enhanced_key, content_type, time.time()),
+        )
+    with _lock:
+        _remember_local(ckey, (enhanced_key, content_type))
+
+
+def invalidate_key(s3_key: str) -> None:
+    """Drops every cache entry that points at, or was derived from, a deleted S3 object."""
+    invalidate_keys([s3_key])
+
+
+def invalidate_keys(s3_keys: list[str]) -> None:
+    """Drops every cache entry that points at, or was derived from, any of the deleted S3 objects."""
+    rows = [(key,) for key in s3_keys]
+    conn = db.connect()
+    with conn:
+        before = conn.total_changes
+        conn.executemany("DELETE FROM result_cache WHERE enhanced_key = ?", rows)
+        removed = conn.total_changes - before
+        conn.executemany("DELETE FROM original_digests WHERE key = ?", rows)
+    deleted = set(s3_keys)
+    with _lock:
+        stale = [k for k, (enhanced_key, _) in _lru.items() if enhanced_key in deleted]
+        for k in stale:
+            del _lru[k]
+        if removed or stale:
+            _stats["invalidations"] += max(removed, len(stale))
+    if removed or stale:
+        logger.info(f"[Cache] invalidated {max(removed, len(stale))} results")
+
+
+def stats() -> dict:
+    """Returns hit/miss counters and the current size of the local tier."""
+    with _lock:
+        return {**_stats, "local_size": len(_lru)}
+
+
+def _collect_metrics():
+    current = stats()
+    return [
+        (f"sharpify_result_cache_{name}_total", "counter", f"Result cache {name.replace('_', ' ')}.",
+         [({}, current[name])])
+        for name in ("hits", "local_hits", "misses", "invalidations")
+    ] + [("sharpify_result_cache_local_size", "gauge", "Entries in the local LRU tier.", [({}, current["local_size"])])]
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,494 @@
+import json
+import logging
+import time
+
+from services import db
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# One record per run: the original, the enhanced image (NULL until enhanced), flags, sizes and timings
+_RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS runs (
+    user_folder     TEXT NOT NULL,
+    run_id          TEXT NOT NULL,
+    original_key    TEXT,
+    enhanced_key    TEXT UNIQUE,
+    status          TEXT NOT NULL DEFAULT 'uploaded',
+    enhancements    TEXT NOT NULL DEFAULT '[]',
+    original_bytes  INTEGER,
+    original_width  INTEGER,
+    original_height INTEGER,
+    enhanced_bytes  INTEGER,
+    content_type    TEXT,
+    timings         TEXT NOT NULL DEFAULT '{}',
+    quality         TEXT,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL,
+    PRIMARY KEY (user_folder, run_id)
+)
+"""
+
+# Run statuses
+UPLOADED, ENHANCING, ENHANCED, FAILED = "uploaded", "enhancing", "enhanced", "failed"
+
+
+def _migrate_runs(conn) -> None:
+    """
+    Upgrades the gallery-only `runs` table (enhanced key, flags and time) to run records,
+    keeping every row. Originals follow the upload naming convention of that layout.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+    if not columns or "enhanced_key" in columns:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another worker may have migrated while we waited for the write lock
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+        if "enhanced_key" not in columns:
+            conn.execute("ALTER TABLE runs RENAME TO runs_v1")
+            conn.execute(_RUNS_TABLE)
+            conn.execute(
+                "INSERT INTO runs (user_folder, run_id, original_key, enhanced_key, status, enhancements, "
+                "created_at, updated_at) "
+                "SELECT user_folder, run_id, user_folder || '/original_' || run_id || '.png', key, ?, "
+                "enhancements, created_at, created_at FROM runs_v1",
+                (ENHANCED,),
+            )
+            conn.execute("DROP TABLE runs_v1")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info("[Index] migrated runs to run records")
+
+
+_SCHEMA = _RUNS_TABLE + """;
+CREATE INDEX IF NOT EXISTS runs_by_user_time ON runs (user_folder, created_at);
+CREATE INDEX IF NOT EXISTS runs_by_original ON runs (original_key);
+
+CREATE TABLE IF NOT EXISTS plots (
+    key         TEXT PRIMARY KEY,
+    user_folder TEXT NOT NULL,
+    run_id      TEXT NOT NULL,
+    idx         INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plots_by_run ON plots (user_folder, run_id);
+
+CREATE TABLE IF NOT EXISTS derivatives (
+    source_key TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inputs (
+    original_key    TEXT PRIMARY KEY,
+    input_key       TEXT NOT NULL,
+    settings        TEXT NOT NULL,
+    steps           TEXT NOT NULL DEFAULT '[]',
+    original_width  INTEGER NOT NULL,
+    original_height INTEGER NOT NULL,
+    original_bytes  INTEGER NOT NULL,
+    input_width     INTEGER NOT NULL,
+    input_height    INTEGER NOT NULL,
+    input_bytes     INTEGER NOT NULL,
+    created_at      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS inputs_by_input_key ON inputs (input_key);
+
+CREATE TABLE IF NOT EXISTS indexed_users (
+    user_folder TEXT PRIMARY KEY,
+    rebuilt_at  REAL NOT NULL
+);
+"""
+
+
+def _add_quality_column(conn) -> None:
+    """Adds the quality scores column to run records created before it existed."""
+    if "quality" in {row[1] for row in conn.execute("PRAGMA table_info(runs)")}:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if "quality" not in {row[1] for row in conn.execute("PRAGMA table_info(runs)")}:
+            conn.execute("ALTER TABLE runs ADD COLUMN quality TEXT")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+db.register_migration(_migrate_runs)
+db.register_schema(_SCHEMA)
+db.register_migration(_add_quality_column)
+
+
+def _flag_names(enhancements: dict | list | None) -> list[str]:
+    """Accepts flags as a dict or as a list of enabled flag names."""
+    if isinstance(enhancements, dict):
+        return [k for k, v in enhancements.items() if v]
+    return list(enhancements or [])
+
+
+def record_upload(user_folder: str, run_id: str, original_key: str, enhancements: dict | list | None = None,
+                  original_bytes: int | None = None, width: int | None = None, height: int | None = None,
+                  created_at: float | None = None) -> None:
+    """Creates the record of a run when its original is stored, with the original's size."""
+    now = time.time()
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO runs (user_folder, run_id, original_key, status, enhancements, original_bytes, "
+            "original_width, original_height, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_folder, run_id) DO UPDATE SET original_key = excluded.original_key, "
+            "original_bytes = excluded.original_bytes, original_width = excluded.original_width, "
+            "original_height = excluded.original_height, updated_at = excluded.updated_at",
+            (user_folder, run_id, original_key, UPLOADED, json.dumps(_flag_names(enhancements)),
+             original_bytes, width, height, created_at or now, now),
+        )
+
+
+def record_run(user_folder: str, run_id: str, key: str, enhancements: dict | list | None = None,
+               created_at: float | None = None, original_key: str | None = None,
+               content_type: str | None = None) -> None:
+    """
+    Records the enhanced image of a run, creating the record if the upload was not recorded.
+    Quality scores of an earlier result are cleared.
+    Enhancements may be passed as a flag dict or as a list of enabled flag names.
+    """
+    now = time.time()
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO runs (user_folder, run_id, original_key, enhanced_key, status, enhancements, "
+            "content_type, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_folder, run_id) DO UPDATE SET enhanced_key = excluded.enhanced_key, "
+            "original_key = COALESCE(runs.original_key, excluded.original_key), status = excluded.status, "
+            "enhancements = excluded.enhancements, content_type = excluded.content_type, "
+            "quality = NULL, updated_at = excluded.updated_at",
+            (user_folder, run_id, original_key, key, ENHANCED, json.dumps(_flag_names(enhancements)),
+             content_type, created_at or now, now),
+        )
+
+
+def update_run(user_folder: str, run_id: str, status: str | None = None, enhancements: dict | list | None = None,
+               enhanced_bytes: int | None = None, timings: dict | None = None,
+               original_bytes: int | None = None) -> bool:
+    """
+    Updates fields of an existing record; arguments left as None are unchanged and
+    `timings` (stage -> seconds) is merged into the recorded ones.
+    Returns False if the run has no record.
+    """
+    conn = db.connect()
+    with conn:
+        row = conn.execute(
+            "SELECT timings FROM runs WHERE user_folder = ? AND run_id = ?", (user_folder, run_id)
+        ).fetchone()
+        if row is None:
+            return False
+        merged = {**json.loads(row[0]), **(timings or {})}
+        conn.execute(
+            "UPDATE runs SET status = COALESCE(?, status), enhancements = COALESCE(?, enhancements), "
+            "enhanced_bytes = COALESCE(?, enhanced_bytes), original_bytes = COALESCE(?, original_bytes), "
+            "timings = ?, updated_at = ? WHERE user_folder = ? AND run_id = ?",
+            (status, json.dumps(_flag_names(enhancements)) if enhancements is not None else None,
+             enhanced_bytes, original_bytes, json.dumps(merged), time.time(), user_folder, run_id),
+        )
+    return True
+
+
+def record_quality(user_folder: str, run_id: str, quality: dict) -> bool:
+    """Stores the quality scores of a run's enhanced image. Returns False if the run has no record."""
+    conn = db.connect()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE runs SET quality = ?, updated_at = ? WHERE user_folder = ? AND run_id = ?",
+            (json.dumps(quality), time.time(), user_folder, run_id),
+        )
+    return cursor.rowcount > 0
+
+
+_RUN_COLUMNS = ("run_id", "original_key", "enhanced_key", "status", "enhancements", "original_bytes",
+                "original_width", "original_height", "enhanced_bytes", "content_type", "timings",
+                "quality", "created_at", "updated_at")
+
+
+def get_run(user_folder: str, run_id: str) -> dict | None:
+    """Returns the full record of a run with its plot keys, or None."""
+    conn = db.connect()
+    row = conn.execute(
+        f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs WHERE user_folder = ? AND run_id = ?",
+        (user_folder, run_id),
+    ).fetchone()
+    if row is None:
+        return None
+    record = dict(zip(_RUN_COLUMNS, row))
+    record["enhancements"] = json.loads(record["enhancements"])
+    record["timings"] = json.loads(record["timings"])
+    record["quality"] = json.loads(record["quality"]) if record["quality"] else None
+    record["plots"] = [key for (key,) in conn.execute(
+        "SELECT key FROM plots WHERE user_folder = ? AND run_id = ? ORDER BY idx", (user_folder, run_id)
+    )]
+    return record
+
+
+def user_stats(user_folder: str) -> dict:
+    """Aggregates a user's runs: counts by status, stored bytes, plots, mean stage timings and quality scores."""
+    conn = db.connect()
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM runs WHERE user_folder = ? GROUP BY status", (user_folder,)
+    ).fetchall())
+    original_bytes, enhanced_bytes, first, last = conn.execute(
+        "SELECT COALESCE(SUM(original_bytes), 0), COALESCE(SUM(enhanced_bytes), 0), "
+        "MIN(created_at), MAX(created_at) FROM runs WHERE user_folder = ?",
+        (user_folder,),
+    ).fetchone()
+    plots = conn.execute("SELECT COUNT(*) FROM plots WHERE user_folder = ?", (user_folder,)).fetchone()[0]
+
+    quality = conn.execute(
+        "SELECT COUNT(*), AVG(json_extract(quality, '$.psnr')), AVG(json_extract(quality, '$.ssim')), "
+        "AVG(json_extract(quality, '$.delta_e00.mean')) FROM runs WHERE user_folder = ? AND quality IS NOT NULL",
+        (user_folder,),
+    ).fetchone()
+
+    totals: dict[str, list] = {}
+    for (timings,) in conn.execute(
+        "SELECT timings FROM runs WHERE user_folder = ? AND timings != '{}'", (user_folder,)
+    ):
+        for stage, seconds in json.loads(timings).items():
+            totals.setdefault(stage, []).append(seconds)
+
+    return {
+        "runs": sum(counts.values()),
+        "by_status": counts,
+        "plots": plots,
+        "original_bytes": original_bytes,
+        "enhanced_bytes": enhanced_bytes,
+        "first_run_at": first,
+        "last_run_at": last,
+        "mean_timings": {stage: round(sum(v) / len(v), 4) for stage, v in totals.items()},
+        "quality": {
+            "measured": quality[0],
+            "mean_psnr": quality[1],
+            "mean_ssim": quality[2],
+            "mean_delta_e00": quality[3],
+        },
+    }
+
+
+def record_plot(user_folder: str, run_id: str, key: str, idx: int) -> None:
+    """Inserts or replaces a plot image of a run and touches the run's record in the same transaction."""
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO plots (key, user_folder, run_id, idx) VALUES (?, ?, ?, ?)",
+            (key, user_folder, run_id, idx),
+        )
+        conn.execute(
+            "UPDATE runs SET updated_at = ? WHERE user_folder = ? AND run_id = ?",
+            (time.time(), user_folder, run_id),
+        )
+
+
+def record_derivatives(source_key: str) -> None:
+    """Marks that thumbnail and preview derivatives of an image exist."""
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO derivatives (source_key, created_at) VALUES (?, ?)",
+            (source_key, time.time()),
+        )
+
+
+def derived_keys(keys: list[str]) -> set[str]:
+    """Returns the subset of `keys` whose derivatives have been generated."""
+    if not keys:
+        return set()
+    placeholders = ",".join("?" * len(keys))
+    rows = db.connect().execute(
+        f"SELECT source_key FROM derivatives WHERE source_key IN ({placeholders})", keys
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def record_input(original_key: str, input_key: str, settings: str, steps: list[str],
+                 original_width: int, original_height: int, original_bytes: int,
+                 input_width: int, input_height: int, input_bytes: int) -> None:
+    """Records the normalised inference input prepared from an original, with both sizes."""
+    conn = db.connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO inputs (original_key, input_key, settings, steps, original_width, "
+            "original_height, original_bytes, input_width, input_height, input_bytes, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (original_key, input_key, settings, json.dumps(steps), original_width, original_height,
+             original_bytes, input_width, input_height, input_bytes, time.time()),
+        )
+
+
+def input_for(original_key: str) -> dict | None:
+    """Returns the recorded normalised input of an original, or None."""
+    conn = db.connect()
+    row = conn.execute(
+        "SELECT original_key, input_key, settings, steps, original_width, original_height, original_bytes, "
+        "input_width, input_height, input_bytes, created_at FROM inputs WHERE original_key = ?",
+        (original_key,),
+    ).fetchone()
+    if row is None:
+        return None
+    names = ("original_key", "input_key", "settings", "steps", "original_width", "original_height",
+             "original_bytes", "input_width", "input_height", "input_bytes", "created_at")
+    record = dict(zip(names, row))
+    record["steps"] = json.loads(record["steps"])
+    return record
+
+
+def remove_key(key: str) -> None:
+    """
+    Drops whatever index entry points at the given S3 key.
+    Removing a run's original or enhanced image removes the run's record.
+    """
+    conn = db.connect()
+    with conn:
+        conn.execute("DELETE FROM runs WHERE enhanced_key = ? OR original_key = ?", (key, key))
+        conn.execute("DELETE FROM plots WHERE key = ?", (key,))
+        conn.execute("DELETE FROM derivatives WHERE source_key = ?", (key,))
+        conn.execute("DELETE FROM inputs WHERE original_key = ? OR input_key = ?", (key, key))
+
+
+def remove_keys(keys: list[str]) -> None:
+    """Drops the index entries of many deleted S3 keys in one transaction."""
+    conn = db.connect()
+    rows = [(key,) for key in keys]
+    with conn:
+        conn.executemany("DELETE FROM runs WHERE enhanced_key = ? OR original_key = ?", [(key, key) for key in keys])
+        conn.executemany("DELETE FROM plots WHERE key = ?", rows)
+        conn.executemany("DELETE FROM derivatives WHERE source_key = ?", rows)
+        conn.executemany("DELETE FROM inputs WHERE original_key = ? OR input_key = ?", [(key, key) for key in keys])
+
+
+def is_indexed(user_folder: str) -> bool:
+    """Returns True once the user's index has been built from a bucket scan."""
+    row = db.connect().execute(
+        "SELECT 1 FROM indexed_users WHERE user_folder = ?", (user_folder,)
+    ).fetchone()
+    return row is not None
+
+
+def replace_user(user_folder: str, runs: list[dict], plots: list[dict]) -> None:
+    """
+    Reconciles a user's records with the results of a bucket scan in one transaction.
+    `runs` items need run_id, key (the enhanced image, or None for runs that were only
+    uploaded), enhancements and created_at, and may carry original_key; `plots` items
+    need run_id, key and idx. Recorded sizes and timings of runs still present are kept;
+    runs and plots the scan did not find are dropped.
+    """
+    now = time.time()
+    conn = db.connect()
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS scanned_runs (run_id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM scanned_runs")
+        conn.executemany("INSERT OR IGNORE INTO scanned_runs (run_id) VALUES (?)", [(r["run_id"],) for r in runs])
+        conn.execute(
+            "DELETE FROM runs WHERE user_folder = ? AND run_id NOT IN (SELECT run_id FROM scanned_runs)",
+            (user_folder,),
+        )
+        conn.executemany(
+            "INSERT INTO runs (user_folder, run_id, original_key, enhanced_key, status, enhancements, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_folder, run_id) DO UPDATE SET "
+            "original_key = COALESCE(excluded.original_key, runs.original_key), "
+            "enhanced_key = excluded.enhanced_key, "
+            "status = CASE WHEN excluded.enhanced_key IS NOT NULL THEN excluded.status "
+            "WHEN runs.status = 'enhanced' THEN 'uploaded' ELSE runs.status END, "
+            "enhancements = excluded.enhancements, updated_at = excluded.updated_at",
+            [(user_folder, r["run_id"], r.get("original_key"), r["key"], ENHANCED if r["key"] else UPLOADED,
+              json.dumps(r["enhancements"]), r["created_at"], now) for r in runs],
+        )
+        conn.execute("DELETE FROM plots WHERE user_folder = ?", (user_folder,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO plots (key, user_folder, run_id, idx) VALUES (?, ?, ?, ?)",
+            [(p["key"], user_folder, p["run_id"], p["idx"]) for p in plots],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO indexed_users (user_folder, rebuilt_at) VALUES (?, ?)",
+            (user_folder, now),
+        )
+    logger.info(f"[Index] rebuilt {user_folder}: {len(runs)} runs, {len(plots)} plots")
+
+
+def _gallery_entry(row, plots: dict[str, list[str]]) -> dict:
+    run_id, original_key, enhanced_key, enhancements, created_at = row
+    return {
+        "run_id": run_id,
+        "key": enhanced_key,
+        "original_key": original_key,
+        "enhancements": json.loads(enhancements),
+        "created_at": created_at,
+        "plots": plots.get(run_id, []),
+    }
+
+
+def list_runs(user_folder: str) -> list[dict]:
+    """
+    Returns the enhanced runs of a user in creation order.
+    Each item carries run_id, key (the enhanced image), original_key, enhancements,
+    created_at and the keys of its plots.
+    """
+    conn = db.connect()
+    rows = conn.execute(
+        "SELECT run_id, original_key, enhanced_key, enhancements, created_at FROM runs "
+        "WHERE user_folder = ? AND enhanced_key IS NOT NULL ORDER BY created_at",
+        (user_folder,),
+    ).fetchall()
+    plot_rows = conn.execute(
+        "SELECT run_id, key FROM plots WHERE user_folder = ? ORDER BY run_id, idx",
+        (user_folder,),
+    ).fetchall()
+
+    plots: dict[str, list[str]] = {}
+    for run_id, key in plot_rows:
+        plots.setdefault(run_id, []).append(key)
+
+    return [_gallery_entry(row, plots) for row in rows]
+
+
+def iter_runs(user_folder: str, limit: int, before: tuple[float, str] | None = None,
+              batch_size: int = 200):
+    """
+    Yields up to `limit` enhanced runs of a user, newest first, starting after the `before`
+    position (created_at, run_id). Rows and their plots are read in batches so a long
+    history is never held in memory at once.
+    """
+    conn = db.connect()
+    if before is None:
+        cursor = conn.execute(
+            "SELECT run_id, original_key, enhanced_key, enhancements, created_at FROM runs "
+            "WHERE user_folder = ? AND enhanced_key IS NOT NULL "
+            "ORDER BY created_at DESC, run_id DESC LIMIT ?",
+            (user_folder, limit),
+        )
+    else:
+        cursor = conn.execute(
+            "SELECT run_id, original_key, enhanced_key, enhancements, created_at FROM runs "
+            "WHERE user_folder = ? AND enhanced_key IS NOT NULL "
+            "AND (created_at < ? OR (created_at = ? AND run_id < ?)) "
+            "ORDER BY created_at DESC, run_id DESC LIMIT ?",
+            (user_folder, before[0], before[0], before[1], limit),
+        )
+
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        run_ids = [row[0] for row in rows]
+        placeholders = ",".join("?" * len(run_ids))
+        plots: dict[str, list[str]] = {}
+        for run_id, key in conn.execute(
+            f"SELECT run_id, key FROM plots WHERE user_folder = ? AND run_id IN ({placeholders}) "
+            "ORDER BY run_id, idx",
+            (user_folder, *run_ids),
+        ):
+            plots.setdefault(run_id, []).append(key)
+
+        for row in rows:
+            yield _gallery_entry(row, plots)
@@ -1,25 +1,102 @@
+import hashlib
+import io
 import logging
 import re
+import tempfile
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 
 from config import Config
+from services import metrics, result_cache, run_index
+from services.disk_cache import CachingReader, disk_cache, is_seekable
+from services.offload import run_cpu_bound
+from utils.helpers import pil_image, user_folder_for
 
 # Configure logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# Initialize S3 client using credentials from config
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
-    region_name=Config.AWS_REGION,
-)
 BUCKET = Config.AWS_BUCKET_NAME
 
+# Shared S3 client, created on first use so importing this module (and forking workers) stays cheap
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    """Returns the process-wide S3 client, creating it on first use. boto3 clients are thread-safe."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config as BotoConfig
+
+                client = boto3.client(
+                    "s3",
+                    aws_access_key_id=Config.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=Config.AWS_SECRET_ACCESS_KEY,
+                    region_name=Config.AWS_REGION,
+                    config=BotoConfig(
+                        connect_timeout=Config.S3_CONNECT_TIMEOUT,
+                        max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+                    ),
+                )
+                metrics.instrument_boto_client(client)
+                _s3_client = client
+    return _s3_client
+
+@lru_cache(maxsize=1)
+def transfer_config():
+    """Chunked multipart settings for streamed transfers; peak memory is about chunk size x concurrency."""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=Config.TRANSFER_CHUNK_SIZE,
+        multipart_chunksize=Config.TRANSFER_CHUNK_SIZE,
+        max_concurrency=Config.TRANSFER_MAX_CONCURRENCY,
+    )
+
+# Key naming conventions shared by uploads, listing and index rebuilds
+RUN_KEY_RE = re.compile(r"^(?P<folder>[^/]+)/enhanced_(?P<run_id>[0-9a-f]+)\.png$")
+ORIGINAL_KEY_RE = re.compile(r"^(?P<folder>[^/]+)/original_(?P<run_id>[0-9a-f]+)\.(?:png|jpg|gif|webp)$")
+PLOT_KEY_RE = re.compile(r"^(?P<folder>[^/]+)/enhanced_(?P<run_id>[0-9a-f]+)_plot_(?P<idx>[0-9]+)\.png$")
+INPUT_KEY_RE = re.compile(r"^(?P<folder>[^/]+)/original_(?P<run_id>[0-9a-f]+)_input\.(?:png|jpg|webp)$")
+DERIVATIVE_KEY_RE = re.compile(
+    r"^(?P<source>[^/]+/(?:original|enhanced)_[0-9a-f]+)_(?P<name>thumb|preview)\.(?:webp|jpg)$"
+)
+
+def original_key_for(user_folder: str, run_id: str, image_format: str = "PNG") -> str:
+    """
+    Returns the key under which a new run's original is stored, named after its format
+    (PNG, the default, is also what runs recorded before other formats were kept used).
+    """
+    ext = "jpg" if image_format.upper() == "JPEG" else image_format.lower()
+    return f"{user_folder}/original_{run_id}.{ext}"
+
+def find_original_key(user_folder: str, run_id: str) -> str | None:
+    """
+    Returns the key of a run's original from its record. Runs stored before run records
+    existed were always uploaded as PNG, so that name is used only if the object is there.
+    Returns None when the run has no original.
+    """
+    record = run_index.get_run(user_folder, run_id)
+    if record:
+        return record["original_key"]
+    key = original_key_for(user_folder, run_id)
+    return key if head_object(key) else None
+
+# Derivative name -> longest side in pixels, largest first so each is resized from the previous one
+DERIVATIVE_SIZES = {"preview": Config.PREVIEW_SIZE, "thumb": Config.THUMBNAIL_SIZE}
+DERIVATIVE_EXT = "jpg" if Config.DERIVATIVE_FORMAT == "JPEG" else Config.DERIVATIVE_FORMAT.lower()
+
+# Background pool so derivatives never delay the upload or enhancement response
+_derivative_pool = ThreadPoolExecutor(max_workers=Config.DERIVATIVE_WORKERS, thread_name_prefix="derivatives")
+
 def upload_file_to_s3(
     file_path: str | None,
     filename: str,
@@ -35,7 +112,7 @@ def upload_file_to_s3(
     Returns a public S3 URL on success.
     """
     try:
-        user_folder = user_email.replace("@", "_").replace(".", "_")
+        user_folder = user_folder_for(user_email)
         key = f"{user_folder}/{filename}"  # Use passed-in filename structure
 
         # Prepare metadata based on selected enhancements
@@ -51,13 +128,14 @@ def upload_file_to_s3(
             raise ValueError("No file_path or image_data provided")
 
         # Upload to S3
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=BUCKET,
             Key=key,
             Body=body,
             Metadata=metadata,
             ContentType=content_type
         )
+        disk_cache.put(key, body)
 
         url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
         logger.info(f"[S3] uploaded -> {url}")
@@ -67,6 +145,174 @@ def upload_file_to_s3(
         logger.error("upload_file_to_s3 error: %s", e)
         return None
 
+def create_presigned_upload(
+    key: str,
+    content_type: str,
+    max_size: int,
+    enhancements: dict | None = None,
+    expires_in: int = 900
+) -> dict | None:
+    """
+    Creates a presigned POST that lets the browser upload one object straight to S3.
+    The policy pins the key and content type and caps the object size.
+    Returns {"url", "fields"} or None on failure.
+    """
+    metadata = {f"x-amz-meta-{k}": "true" for k, v in (enhancements or {}).items() if v}
+    fields = {"Content-Type": content_type, **metadata}
+    conditions = [
+        {"Content-Type": content_type},
+        ["content-length-range", 1, max_size],
+        *({k: v} for k, v in metadata.items())
+    ]
+    try:
+        return get_s3_client().generate_presigned_post(
+            Bucket=BUCKET,
+            Key=key,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires_in
+        )
+    except (BotoCoreError, ClientError) as e:
+        logger.error("create_presigned_upload failed: %s", e)
+        return None
+
+def create_presigned_multipart_upload(
+    key: str,
+    content_type: str,
+    size: int,
+    part_size: int,
+    enhancements: dict | None = None,
+    expires_in: int = 900
+) -> dict | None:
+    """
+    Starts a multipart upload and presigns one upload_part URL per part.
+    Returns {"upload_id", "part_size", "part_urls"} or None on failure.
+    """
+    metadata = {k: "true" for k, v in (enhancements or {}).items() if v}
+    try:
+        upload_id = get_s3_client().create_multipart_upload(
+            Bucket=BUCKET, Key=key, ContentType=content_type, Metadata=metadata
+        )["UploadId"]
+        part_count = max(1, -(-size // part_size))
+        part_urls = [
+            get_s3_client().generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": BUCKET, "Key": key, "UploadId": upload_id, "PartNumber": n},
+                ExpiresIn=expires_in
+            )
+            for n in range(1, part_count + 1)
+        ]
+        return {"upload_id": upload_id, "part_size": part_size, "part_urls": part_urls}
+    except (BotoCoreError, ClientError) as e:
+        logger.error("create_presigned_multipart_upload failed: %s", e)
+        return None
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list[dict]) -> bool:
+    """
+    Completes a multipart upload from the client's list of {"PartNumber", "ETag"}.
+    Aborts the upload on failure so no orphaned parts are billed.
+    Returns True on success, False on failure.
+    """
+    try:
+        get_s3_client().complete_multipart_upload(
+            Bucket=BUCKET,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+        )
+        return True
+    except (BotoCoreError, ClientError) as e:
+        logger.error("complete_multipart_upload failed: %s", e)
+        try:
+            get_s3_client().abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+        except (BotoCoreError, ClientError):
+            pass
+        return False
+
+def head_object(key: str) -> dict | None:
+    """Returns the object's head_object response, or None if missing or on failure."""
+    try:
+        return get_s3_client().head_object(Bucket=BUCKET, Key=key)
+    except (BotoCoreError, ClientError) as e:
+        logger.error("head_object failed: %s", e)
+        return None
+
+def read_object_range(key: str, length: int, start: int = 0) -> bytes | None:
+    """
+    Reads `length` bytes of an object from `start` with a ranged GET
+    (e.g. the header of an image), or from the local disk cache when it
+    holds the object. Returns None on failure.
+    """
+    with disk_cache.open(key) as cached:
+        if cached is not None:
+            return bytes(cached[start:start + length])
+    try:
+        resp = get_s3_client().get_object(Bucket=BUCKET, Key=key, Range=f"bytes={start}-{start + length - 1}")
+        return resp["Body"].read()
+    except (BotoCoreError, ClientError) as e:
+        logger.error("read_object_range failed: %s", e)
+        return None
+
+def download_object(key: str, fileobj) -> bool:
+    """
+    Streams an S3 object into a writable file-like object with chunked ranged GETs,
+    or copies it from the local disk cache when it holds the object. Downloads into
+    seekable files are added to the cache. Returns True on success, False on failure.
+    """
+    with disk_cache.open(key) as cached:
+        if cached is not None:
+            for offset in range(0, len(cached), Config.TRANSFER_CHUNK_SIZE):
+                fileobj.write(cached[offset:offset + Config.TRANSFER_CHUNK_SIZE])
+            return True
+    return _fetch_object(key, fileobj)
+
+def _fetch_object(key: str, fileobj) -> bool:
+    """Downloads an object from S3 into a file-like object, caching it when the file is seekable."""
+    try:
+        start = fileobj.tell() if is_seekable(fileobj) else None
+        get_s3_client().download_fileobj(BUCKET, key, fileobj, Config=transfer_config())
+    except (BotoCoreError, ClientError) as e:
+        logger.error("download_object failed: %s", e)
+        return False
+
+    end = fileobj.tell() if start is not None else None
+    if disk_cache.enabled and end is not None and end - start <= disk_cache.max_object_bytes:
+        fileobj.seek(start)
+        disk_cache.put_file(key, fileobj)
+        fileobj.seek(end)
+    return True
+
+def open_object(key: str):
+    """
+    Opens an object for reading: its copy in the local disk cache, or else a download
+    from S3 (which is then cached). Returns a binary file object the caller closes, or None.
+    """
+    cached = disk_cache.open_file(key)
+    if cached is not None:
+        return cached
+    spool = tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES)
+    if not _fetch_object(key, spool):
+        spool.close()
+        return None
+    spool.seek(0)
+    return spool
+
+def upload_temp_file(path: str, key: str, content_type: str = "image/png") -> str | None:
+    """
+    Uploads a scratch file (e.g. an image tile sent for inference) under the given key.
+    Returns its public URL, or None on failure. Callers delete it with delete_file_from_s3.
+    """
+    try:
+        get_s3_client().upload_file(path, BUCKET, key, ExtraArgs={"ContentType": content_type}, Config=transfer_config())
+        return public_url(key)
+    except (BotoCoreError, ClientError) as e:
+        logger.error("upload_temp_file failed: %s", e)
+        return None
+
+def public_url(key: str) -> str:
+    """Returns the public S3 URL of a key."""
+    return f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
+
 def upload_bytes_to_s3(
     data_bytes: bytes,
     user_email: str,
@@ -78,12 +324,12 @@ def upload_bytes_to_s3(
     Returns the public S3 URL or None on failure.
     """
     try:
-        user_folder = user_email.replace("@", "_").replace(".", "_")
+        user_folder = user_folder_for(user_email)
         key = f"{user_folder}/enhanced_{uuid.uuid4().hex}.png"
 
         metadata = {k: "true" for k,v in (enhancements or {}).items() if v}
 
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=BUCKET,
             Key=key,
             Body=data_bytes,
@@ -98,29 +344,182 @@ def upload_bytes_to_s3(
         logger.error("upload_bytes_to_s3 failed: %s", e)
         return None
 
-def upload_main_image(data_bytes, user_email, enhancements, content_type="image/png", run_id=None):
+def upload_fileobj_to_s3(
+    fileobj,
+    filename: str,
+    user_email: str,
+    enhancements: dict | None = None,
+    content_type: str = "image/png"
+) -> str | None:
+    """
+    Streams a readable file-like object to S3 with chunked multipart upload,
+    so the whole object is never held in memory.
+    Returns a public S3 URL on success.
+    """
+    try:
+        user_folder = user_folder_for(user_email)
+        key = f"{user_folder}/{filename}"
+        metadata = {k: "true" for k, v in (enhancements or {}).items() if v}
+
+        # Keep a local copy of the bytes as they are uploaded
+        reader = CachingReader(fileobj, disk_cache, key)
+        try:
+            get_s3_client().upload_fileobj(
+                reader,
+                BUCKET,
+                key,
+                ExtraArgs={"Metadata": metadata, "ContentType": content_type},
+                Config=transfer_config()
+            )
+        except BaseException:
+            reader.finish(False)
+            raise
+        reader.finish(True)
+
+        url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
+        logger.info(f"[S3] streamed -> {url}")
+        return url
+
+    except (BotoCoreError, ClientError, OSError) as e:
+        logger.error("upload_fileobj_to_s3 error: %s", e)
+        return None
+
+def upload_main_image(data_bytes, user_email, enhancements, content_type="image/png", run_id=None, fileobj=None,
+                      original_key=None):
     """
     Uploads a main enhanced image to S3, optionally with a given run_id.
+    Pass `fileobj` instead of `data_bytes` to stream the image without buffering it, and
+    `original_key` to record the original of a run that has no record yet.
     Returns the run_id, public URL, and S3 key.
     """
     if run_id is None:
         run_id = uuid.uuid4().hex  # Generate run ID if not passed
 
     filename = f"enhanced_{run_id}.png"
-    user_folder = user_email.replace("@", "_").replace(".", "_")
+    user_folder = user_folder_for(user_email)
     s3_key = f"{user_folder}/{filename}"
 
     # Use core upload function with specified filename and metadata
-    s3_url = upload_file_to_s3(
-        file_path=None,
-        filename=filename,
-        user_email=user_email,
-        enhancements=enhancements,
-        image_data=data_bytes
-    )
+    if fileobj is not None:
+        s3_url = upload_fileobj_to_s3(
+            fileobj,
+            filename=filename,
+            user_email=user_email,
+            enhancements=enhancements,
+            content_type=content_type
+        )
+    else:
+        s3_url = upload_file_to_s3(
+            file_path=None,
+            filename=filename,
+            user_email=user_email,
+            enhancements=enhancements,
+            image_data=data_bytes,
+            content_type=content_type
+        )
+
+    # Record the enhanced image on the run so listings never need a bucket scan
+    if s3_url:
+        try:
+            run_index.record_run(user_folder, run_id, s3_key, enhancements,
+                                 original_key=original_key, content_type=content_type)
+        except Exception as e:
+            logger.error("run_index.record_run failed: %s", e)
+        schedule_derivatives(s3_key, data_bytes if fileobj is None else None)
 
     return run_id, s3_url, s3_key
 
+def copy_main_image(src_key, user_email, enhancements, content_type="image/png", run_id=None, original_key=None):
+    """
+    Stores an existing enhanced object as the main image of a new run using a
+    server-side S3 copy, so no image bytes pass through the backend.
+    Returns the run_id, public URL, and S3 key, or None for the URL on failure.
+    """
+    if run_id is None:
+        run_id = uuid.uuid4().hex
+
+    user_folder = user_folder_for(user_email)
+    s3_key = f"{user_folder}/enhanced_{run_id}.png"
+    metadata = {k: "true" for k, v in (enhancements or {}).items() if v}
+
+    try:
+        get_s3_client().copy_object(
+            Bucket=BUCKET,
+            Key=s3_key,
+            CopySource={"Bucket": BUCKET, "Key": src_key},
+            Metadata=metadata,
+            MetadataDirective="REPLACE",
+            ContentType=content_type
+        )
+    except (BotoCoreError, ClientError) as e:
+        logger.error("copy_main_image failed: %s", e)
+        return run_id, None, s3_key
+    disk_cache.copy(src_key, s3_key)
+
+    try:
+        run_index.record_run(user_folder, run_id, s3_key, enhancements,
+                             original_key=original_key, content_type=content_type)
+    except Exception as e:
+        logger.error("run_index.record_run failed: %s", e)
+    copy_derivatives(src_key, s3_key)
+
+    url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{s3_key}"
+    logger.info(f"[S3] copied {src_key} -> {url}")
+    return run_id, url, s3_key
+
+def replace_object(key: str, data: bytes, content_type: str, metadata: dict | None = None) -> bool:
+    """
+    Overwrites an existing object with new bytes (e.g. a recompressed original), keeping
+    the local disk cache in step. Returns True on success, False on failure.
+    """
+    try:
+        get_s3_client().put_object(
+            Bucket=BUCKET,
+            Key=key,
+            Body=data,
+            Metadata=metadata or {},
+            ContentType=content_type
+        )
+    except (BotoCoreError, ClientError) as e:
+        logger.error("replace_object failed: %s", e)
+        return False
+    disk_cache.put(key, data)
+    return True
+
+def replace_metadata(key: str, metadata: dict, content_type: str) -> bool:
+    """Replaces an object's metadata with a server-side copy onto itself. Returns True on success."""
+    try:
+        get_s3_client().copy_object(
+            Bucket=BUCKET,
+            Key=key,
+            CopySource={"Bucket": BUCKET, "Key": key},
+            Metadata=metadata,
+            MetadataDirective="REPLACE",
+            ContentType=content_type
+        )
+        return True
+    except (BotoCoreError, ClientError) as e:
+        logger.error("replace_metadata failed: %s", e)
+        return False
+
+def hash_object(key: str) -> str | None:
+    """
+    Computes the SHA-256 of an S3 object by streaming its body (or reading
+    its copy in the local disk cache). Returns the hex digest, or None on failure.
+    """
+    with disk_cache.open(key) as cached:
+        if cached is not None:
+            return hashlib.sha256(cached).hexdigest()
+    try:
+        body = get_s3_client().get_object(Bucket=BUCKET, Key=key)["Body"]
+        digest = hashlib.sha256()
+        for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+            digest.update(chunk)
+        return digest.hexdigest()
+    except (BotoCoreError, ClientError) as e:
+        logger.error("hash_object failed: %s", e)
+        return None
+
 def upload_plot_image(
     data_bytes: bytes,
     user_email: str,
@@ -132,72 +531,309 @@ def upload_plot_image(
     Includes run_id and index in the filename.
     Returns the URL and key, or (None, None) on failure.
     """
-    user_folder = user_email.replace("@", "_").replace(".", "_")
+    user_folder = user_folder_for(user_email)
     key = f"{user_folder}/enhanced_{run_id}_plot_{idx}.png"
     try:
-        s3_client.put_object(
+        get_s3_client().put_object(
             Bucket=BUCKET,
             Key=key,
             Body=data_bytes,
             ContentType="image/png"
         )
         url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
-        return url, key
     except Exception as e:
         logger.error("upload_plot_image failed: %s", e)
         return None, None
 
+    try:
+        run_index.record_plot(user_folder, run_id, key, idx)
+    except Exception as e:
+        logger.error("run_index.record_plot failed: %s", e)
+    return url, key
+
+def derivative_key(key: str, name: str) -> str:
+    """Returns the key of a derivative ("thumb" or "preview") of an image key."""
+    return f"{key.rsplit('.', 1)[0]}_{name}.{DERIVATIVE_EXT}"
+
+def generate_derivatives(key: str, data: bytes | None = None) -> bool:
+    """
+    Renders the thumbnail and preview of an image and stores them next to it in S3.
+    Uses `data` when the caller still holds the image bytes, otherwise streams
+    the object from S3. Returns True on success, False on failure.
+    """
+    try:
+        if data is None:
+            with tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES) as spool:
+                if not download_object(key, spool):
+                    return False
+                spool.seek(0)
+                renditions = run_cpu_bound(_render_derivatives, spool)
+        else:
+            renditions = run_cpu_bound(_render_derivatives, io.BytesIO(data))
+
+        content_type = f"image/{Config.DERIVATIVE_FORMAT.lower()}"
+        for name, body in renditions.items():
+            get_s3_client().put_object(
+                Bucket=BUCKET,
+                Key=derivative_key(key, name),
+                Body=body,
+                ContentType=content_type,
+                CacheControl="public, max-age=31536000, immutable"
+            )
+            disk_cache.put(derivative_key(key, name), body)
+        run_index.record_derivatives(key)
+        return True
+    except Exception as e:
+        logger.error("generate_derivatives failed for %s: %s", key, e)
+        return False
+
+def _render_derivatives(stream) -> dict[str, bytes]:
+    """Decodes an image once and encodes each derivative size from the previous, larger one."""
+    Image = pil_image()
+    with Image.open(stream) as image:
+        largest = max(DERIVATIVE_SIZES.values())
+        image.draft("RGB", (largest, largest))  # JPEG only: decode at reduced scale
+        keep_alpha = Config.DERIVATIVE_FORMAT != "JPEG" and "A" in image.getbands()
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+
+    renditions = {}
+    for name, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+        buffer = io.BytesIO()
+        image.save(buffer, Config.DERIVATIVE_FORMAT, quality=Config.DERIVATIVE_QUALITY)
+        renditions[name] = buffer.getvalue()
+    return renditions
+
+def schedule_derivatives(key: str, data: bytes | None = None):
+    """Queues derivative generation for an image on the background pool. Returns the future, or None if disabled."""
+    if not Config.DERIVATIVES_ENABLED:
+        return None
+    return _derivative_pool.submit(_timed_derivatives, key, data)
+
+def _timed_derivatives(key: str, data: bytes | None) -> bool:
+    with metrics.span("derivatives.generate"):
+        return generate_derivatives(key, data)
+
+def copy_derivatives(src_key: str, dst_key: str) -> None:
+    """Reuses the derivatives of a copied image with server-side copies, or renders new ones."""
+    if not Config.DERIVATIVES_ENABLED:
+        return
+    if not run_index.derived_keys([src_key]):
+        schedule_derivatives(dst_key)
+        return
+    try:
+        for name in DERIVATIVE_SIZES:
+            get_s3_client().copy_object(
+                Bucket=BUCKET,
+                Key=derivative_key(dst_key, name),
+                CopySource={"Bucket": BUCKET, "Key": derivative_key(src_key, name)}
+            )
+        run_index.record_derivatives(dst_key)
+    except (BotoCoreError, ClientError) as e:
+        logger.error("copy_derivatives failed: %s", e)
+        schedule_derivatives(dst_key)
+
+def backfill_derivatives(prefix: str = "", workers: int | None = None, force: bool = False) -> tuple[int, int]:
+    """
+    Generates missing derivatives for every original and enhanced image under a prefix.
+    One paginated listing finds both images and existing derivatives; missing ones
+    are rendered on a thread pool, existing ones are recorded in the index.
+    Returns (generated, failed).
+    """
+    sources, existing = [], set()
+    for obj in iter_bucket_objects(prefix):
+        key = obj["Key"]
+        if RUN_KEY_RE.match(key) or ORIGINAL_KEY_RE.match(key):
+            sources.append(key)
+        else:
+            m = DERIVATIVE_KEY_RE.match(key)
+            if m:
+                existing.add((m.group("source"), m.group("name")))
+
+    missing = []
+    for key in sources:
+        stem = key.rsplit(".", 1)[0]
+        if not force and all((stem, name) in existing for name in DERIVATIVE_SIZES):
+            run_index.record_derivatives(key)
+        else:
+            missing.append(key)
+
+    logger.info(f"[S3] rendering derivatives for {len(missing)} of {len(sources)} images")
+    generated = failed = 0
+    with ThreadPoolExecutor(max_workers=workers or Config.DERIVATIVE_WORKERS) as pool:
+        for ok in pool.map(generate_derivatives, missing):
+            generated, failed = generated + ok, failed + (not ok)
+    return generated, failed
+
+def _ensure_user_index(user_folder: str) -> bool:
+    """
+    Imports a user's runs from a one-time bucket scan if they were never indexed
+    (runs stored before run records existed). Afterwards listings only read the records.
+    """
+    if run_index.is_indexed(user_folder):
+        return True
+    return rebuild_user_index(user_folder)
+
+def _original_key(run: dict) -> str:
+    """Returns the key of the original image a run was enhanced from."""
+    return run.get("original_key") or original_key_for(run["key"].split("/", 1)[0], run["run_id"])
+
+def _image_entry(run: dict, derived: set[str] = frozenset()) -> dict:
+    """
+    Converts an index entry into the metadata dictionary returned to the frontend.
+    Thumbnail and preview URLs are set only for images in `derived`, the keys whose
+    derivatives exist; otherwise they are None and the client falls back to the full image.
+    """
+    base = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/"
+    original_key = _original_key(run)
+
+    def derivative_url(key, name):
+        return base + derivative_key(key, name) if key in derived else None
+
+    return {
+        "run_id": run["run_id"],
+        "url": base + run["key"],
+        "key": run["key"],
+        "thumbnail_url": derivative_url(run["key"], "thumb"),
+        "preview_url": derivative_url(run["key"], "preview"),
+        "original_url": base + original_key,
+        "original_thumbnail_url": derivative_url(original_key, "thumb"),
+        "original_preview_url": derivative_url(original_key, "preview"),
+        "enhancements": run["enhancements"],
+        "plots": [base + key for key in run["plots"]],
+        "created_at": run["created_at"],
+    }
+
+def _image_entries(runs, batch_size: int = 100):
+    """Converts index entries into gallery entries, looking up derivatives one batch at a time."""
+    batch = []
+    for run in runs:
+        batch.append(run)
+        if len(batch) >= batch_size:
+            yield from _derived_entries(batch)
+            batch = []
+    yield from _derived_entries(batch)
+
+def _derived_entries(runs: list[dict]) -> list[dict]:
+    keys = [key for run in runs for key in (run["key"], _original_key(run))]
+    with metrics.span("gallery.derivatives"):
+        derived = run_index.derived_keys(keys)
+    return [_image_entry(run, derived) for run in runs]
+
 def fetch_user_images(email: str) -> list[dict]:
     """
     Fetches all enhanced images (and associated plots) for a user.
-    Scans S3 keys based on the user folder prefix and groups by run_id.
+    Reads the run records; runs of never-indexed users are imported once from a bucket scan.
     Returns a list of image metadata dictionaries.
     """
-    prefix = email.replace("@", "_").replace(".", "_") + "/"
+    user_folder = user_folder_for(email)
     try:
-        resp = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
-        contents = resp.get("Contents", [])
+        with metrics.span("gallery.index"):
+            if not _ensure_user_index(user_folder):
+                return []
+            runs = run_index.list_runs(user_folder)
     except Exception as e:
-        logger.error("list_objects_v2 failed: %s", e)
+        logger.error("run index lookup failed: %s", e)
         return []
 
-    runs: dict[str, dict] = {}
+    return list(_image_entries(runs))
 
-    # Match enhanced images and extract metadata
-    for obj in contents:
-        key = obj["Key"]
-        m = re.match(rf"^{re.escape(prefix)}enhanced_([0-9a-f]+)\\.png$", key)
-        if not m:
-            continue
-        run_id = m.group(1)
-        try:
-            head = s3_client.head_object(Bucket=BUCKET, Key=key)
-            meta = head.get("Metadata", {})
-            enhancements = [k for k,v in meta.items() if v.lower()=="true"]
-        except Exception:
-            enhancements = []
+def iter_user_images(email: str, limit: int, before: tuple[float, str] | None = None):
+    """
+    Yields one page of a user's images, newest first, starting after `before`.
+    Raises RuntimeError if the user's index cannot be built.
+    """
+    user_folder = user_folder_for(email)
+    with metrics.span("gallery.index"):
+        indexed = _ensure_user_index(user_folder)
+    if not indexed:
+        raise RuntimeError(f"Run index unavailable for {user_folder}")
+    yield from _image_entries(run_index.iter_runs(user_folder, limit, before))
 
-        url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
-        runs[run_id] = {
-            "run_id": run_id,
-            "url": url,
-            "key": key,
-            "enhancements": enhancements,
-            "plots": []
-        }
-
-    # Match and group any plot images linked to a run_id
+def user_run_stats(email: str) -> dict | None:
+    """
+    Summarises a user's runs from their records (counts by status, bytes, plots, timings).
+    Returns None if the user's index cannot be built.
+    """
+    user_folder = user_folder_for(email)
+    with metrics.span("gallery.index"):
+        if not _ensure_user_index(user_folder):
+            return None
+        return run_index.user_stats(user_folder)
+
+def iter_bucket_objects(prefix: str = ""):
+    """
+    Yields every object under a prefix, following list_objects_v2 continuation tokens
+    so listings are not truncated at 1,000 keys.
+    """
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+def _scan_runs(contents) -> dict[str, tuple[list[dict], list[dict]]]:
+    """
+    Groups listed objects into run records and plots per user folder.
+    Runs with an original but no enhanced image yet are included with key None.
+    Reads enhancement flags with one head_object per enhanced image.
+    """
+    grouped: dict[str, tuple[dict[str, dict], list[dict]]] = {}
     for obj in contents:
         key = obj["Key"]
-        m = re.match(rf"^{re.escape(prefix)}enhanced_([0-9a-f]+)_plot_[0-9]+\\.png$", key)
-        if not m:
+        modified = obj.get("LastModified")
+        created_at = modified.timestamp() if isinstance(modified, datetime) else 0.0
+        m = RUN_KEY_RE.match(key)
+        if m:
+            try:
+                head = get_s3_client().head_object(Bucket=BUCKET, Key=key)
+                meta = head.get("Metadata", {})
+                enhancements = [k for k, v in meta.items() if v.lower() == "true"]
+            except Exception:
+                enhancements = []
+            run = grouped.setdefault(m.group("folder"), ({}, []))[0].setdefault(
+                m.group("run_id"), {"run_id": m.group("run_id"), "original_key": None}
+            )
+            run.update(key=key, enhancements=enhancements, created_at=created_at)
             continue
-        run_id = m.group(1)
-        if run_id in runs:
-            url = f"https://{BUCKET}.s3.{Config.AWS_REGION}.amazonaws.com/{key}"
-            runs[run_id]["plots"].append(url)
+        m = ORIGINAL_KEY_RE.match(key)
+        if m:
+            run = grouped.setdefault(m.group("folder"), ({}, []))[0].setdefault(
+                m.group("run_id"), {"run_id": m.group("run_id"), "key": None, "enhancements": [],
+                                    "created_at": created_at}
+            )
+            run["original_key"] = key
+            continue
+        m = PLOT_KEY_RE.match(key)
+        if m:
+            grouped.setdefault(m.group("folder"), ({}, []))[1].append({
+                "run_id": m.group("run_id"),
+                "key": key,
+                "idx": int(m.group("idx")),
+            })
+    return {folder: (list(runs.values()), plots) for folder, (runs, plots) in grouped.items()}
 
-    return list(runs.values())
+def rebuild_user_index(user_folder: str) -> bool:
+    """
+    Rebuilds one user's run index from a full paginated scan of their S3 prefix.
+    Returns True on success, False on failure.
+    """
+    try:
+        grouped = _scan_runs(iter_bucket_objects(user_folder + "/"))
+    except Exception as e:
+        logger.error("rebuild_user_index scan failed: %s", e)
+        return False
+    runs, plots = grouped.get(user_folder, ([], []))
+    run_index.replace_user(user_folder, runs, plots)
+    return True
+
+def rebuild_all_indexes() -> int:
+    """
+    Rebuilds the run index of every user found in the bucket.
+    Returns the number of user folders indexed.
+    """
+    grouped = _scan_runs(iter_bucket_objects())
+    for user_folder, (runs, plots) in grouped.items():
+        run_index.replace_user(user_folder, runs, plots)
+    return len(grouped)
 
 def delete_file_from_s3(key: str) -> bool:
     """
@@ -205,8 +841,99 @@ def delete_file_from_s3(key: str) -> bool:
     Returns True on success, False on failure.
     """
     try:
-        s3_client.delete_object(Bucket=BUCKET, Key=key)
-        return True
+        get_s3_client().delete_object(Bucket=BUCKET, Key=key)
     except Exception as e:
         logger.error("delete_file_from_s3 failed: %s", e)
-        return False
\ No newline at end of file
+        return False
+
+    try:
+        run_index.remove_key(key)
+        result_cache.invalidate_key(key)
+        disk_cache.discard([key])
+    except Exception as e:
+        logger.error("index/cache cleanup after delete failed: %s", e)
+    return True
+
+def _delete_batch(keys: list[str]) -> tuple[list[str], list[dict]]:
+    """Deletes up to 1,000 keys with one delete_objects call. Returns (deleted, errors)."""
+    try:
+        resp = get_s3_client().delete_objects(
+            Bucket=BUCKET,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        )
+    except (BotoCoreError, ClientError) as e:
+        logger.error("delete_objects failed: %s", e)
+        return [], [{"key": key, "code": "RequestFailed", "message": str(e)} for key in keys]
+
+    errors = [
+        {"key": err["Key"], "code": err.get("Code", ""), "message": err.get("Message", "")}
+        for err in resp.get("Errors", [])
+    ]
+    failed = {err["key"] for err in errors}
+    return [key for key in keys if key not in failed], errors
+
+def delete_keys(keys: list[str]) -> tuple[list[str], list[dict]]:
+    """
+    Deletes many keys in 1,000-key delete_objects batches running concurrently,
+    then drops them from the run index and the result cache.
+    Returns (deleted keys, errors) where each error has key, code and message.
+    """
+    batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    deleted, errors = [], []
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(Config.DELETE_WORKERS, len(batches))) as pool:
+            for batch_deleted, batch_errors in pool.map(_delete_batch, batches):
+                deleted.extend(batch_deleted)
+                errors.extend(batch_errors)
+
+    if deleted:
+        try:
+            run_index.remove_keys(deleted)
+            result_cache.invalidate_keys(deleted)
+            disk_cache.discard(deleted)
+        except Exception as e:
+            logger.error("index/cache cleanup after delete failed: %s", e)
+    if errors:
+        logger.error(f"[S3] {len(errors)} of {len(keys)} deletes failed")
+    return deleted, errors
+
+def run_keys(user_folder: str, run_id: str) -> list[str]:
+    """
+    Collects every object of a run (original, normalised input, enhanced image, plots
+    and derivatives) from its record. Runs without a record fall back to paginated
+    prefix listings of anything named after the run.
+    """
+    record = run_index.get_run(user_folder, run_id)
+    if record is None:
+        keys = []
+        for prefix in (f"{user_folder}/original_{run_id}", f"{user_folder}/enhanced_{run_id}"):
+            for obj in iter_bucket_objects(prefix):
+                # Guard against another run ID that merely starts with this one
+                rest = obj["Key"][len(prefix):]
+                if rest.startswith((".", "_")):
+                    keys.append(obj["Key"])
+        return keys
+
+    images = [key for key in (record["original_key"], record["enhanced_key"]) if key]
+    keys = images + record["plots"]
+    for key in run_index.derived_keys(images):
+        keys += [derivative_key(key, name) for name in DERIVATIVE_SIZES]
+    prepared = run_index.input_for(record["original_key"]) if record["original_key"] else None
+    if prepared:
+        keys.append(prepared["input_key"])
+    return keys
+
+def delete_run(email: str, run_id: str) -> tuple[list[str], list[dict]]:
+    """Deletes every object of one run. Returns (deleted keys, errors)."""
+    return delete_keys(run_keys(user_folder_for(email), run_id))
+
+def delete_user_data(email: str) -> tuple[list[str], list[dict]]:
+    """
+    Deletes every object under a user's prefix (account erasure).
+    Keys are collected with a paginated listing and removed in concurrent batches.
+    Returns (deleted keys, errors).
+    """
+    user_folder = user_folder_for(email)
+    keys = [obj["Key"] for obj in iter_bucket_objects(user_folder + "/")]
+    logger.info(f"[S3] erasing {len(keys)} objects of {user_folder}")
+    return delete_keys(keys)
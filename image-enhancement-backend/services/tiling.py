@@ -0,0 +1,170 @@
+import logging
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import Config
+from services.offload import run_cpu_bound
+from services.transfer import open_result
+from utils.helpers import pil_image
+
+# This module is imported on the first tiled enhancement, which keeps numpy out of worker startup
+Image = pil_image()
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+def plan_tiles(width: int, height: int, tile: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """
+    Splits an image into overlapping tiles in raster order.
+    Returns (left, top, right, bottom) boxes; neighbouring boxes share `overlap` pixels.
+    """
+    step = max(1, tile - overlap)
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        positions = list(range(0, length - tile, step))
+        return positions + [length - tile]
+
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def _feather_mask(h: int, w: int, left: int, top: int) -> np.ndarray:
+    """
+    Builds a (h, w, 1) blend weight for a new tile: a linear ramp from 0 to 1
+    across the `left` columns and `top` rows it shares with tiles already written.
+    """
+    mask = np.ones((h, w), dtype=np.float32)
+    if left:
+        mask[:, :left] *= np.linspace(0, 1, left + 2, dtype=np.float32)[1:-1][None, :]
+    if top:
+        mask[:top, :] *= np.linspace(0, 1, top + 2, dtype=np.float32)[1:-1][:, None]
+    return mask[:, :, None]
+
+
+def load_rgb(image, path: str, strip: int = 256) -> np.memmap:
+    """
+    Copies an image into a disk-backed RGB memmap at `path`, converting its colour mode one
+    strip of rows at a time. Pillow decodes the whole image on the first strip (its PNG and
+    JPEG decoders cannot stop part way), so the peak is one decoded copy in the image's own
+    mode; strips only add a strip-sized RGB copy, never a second full-size image.
+    """
+    out = np.memmap(path, dtype=np.uint8, mode="w+", shape=(image.height, image.width, 3))
+    for y in range(0, image.height, strip):
+        rows = image.crop((0, y, image.width, min(y + strip, image.height)))
+        if rows.mode != "RGB":
+            rows = rows.convert("RGB")
+        out[y:y + rows.height] = np.asarray(rows)
+    return out
+
+
+def _load_source(path: str, workdir: str) -> np.memmap:
+    """
+    Decodes the source image once into a disk-backed memmap, so tiles are read from the
+    page cache instead of from a resident copy of the whole image. The decoded image is
+    released as soon as it has been copied.
+    """
+    with Image.open(path) as image:
+        return load_rgb(image, os.path.join(workdir, "source.rgb"))
+
+
+def _enhance_tile(source: np.memmap, box, workdir: str, index: int, predict) -> np.ndarray:
+    """Writes one tile to disk, runs it through the backend and returns the enhanced pixels."""
+    left, top, right, bottom = box
+    path = os.path.join(workdir, f"tile_{index}.png")
+    Image.fromarray(np.asarray(source[top:bottom, left:right])).save(path, "PNG")
+    try:
+        result = predict(path)
+        with open_result(result) as (stream, _):
+            with Image.open(stream) as enhanced:
+                return np.asarray(enhanced.convert("RGB"))
+    finally:
+        os.remove(path)
+
+
+def _place_tile(out: np.memmap, enhanced: np.ndarray, box, scale: float, overlap: int) -> None:
+    """Writes an enhanced tile into the output buffer, feathering the parts shared with tiles already written."""
+    left, top, right, bottom = box
+
+    # Map the tile into output coordinates, resizing if the backend rounded its size
+    ox, oy = round(left * scale), round(top * scale)
+    ow, oh = round(right * scale) - ox, round(bottom * scale) - oy
+    if enhanced.shape[:2] != (oh, ow):
+        enhanced = np.asarray(Image.fromarray(enhanced).resize((ow, oh), Image.LANCZOS))
+
+    # Feather the parts shared with tiles already written (left and above)
+    shared_left = round(overlap * scale) if left > 0 else 0
+    shared_top = round(overlap * scale) if top > 0 else 0
+    shared_left, shared_top = min(shared_left, ow), min(shared_top, oh)
+    region = out[oy:oy + oh, ox:ox + ow]
+    if shared_left or shared_top:
+        mask = _feather_mask(oh, ow, shared_left, shared_top)
+        blended = region * (1 - mask) + enhanced * mask
+        region[:] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+    else:
+        region[:] = enhanced
+
+
+def _encode_png(out: np.memmap, output) -> None:
+    """Encodes the output buffer as PNG into `output`."""
+    result = Image.frombuffer("RGB", (out.shape[1], out.shape[0]), out, "raw", "RGB", 0, 1)
+    result.save(output, "PNG")
+
+
+def enhance_tiled(source_path: str, predict, output, tile: int | None = None,
+                  overlap: int | None = None, workers: int | None = None) -> str:
+    """
+    Enhances a large image tile by tile and writes the blended result as PNG to `output`.
+    `predict(tile_path)` returns a Gradio result for one tile. Tiles run in parallel
+    on up to `workers` threads and are blended in raster order with feathered seams
+    into a disk-backed output. Memory peaks once, while the source is decoded and copied
+    to disk (one decoded copy of the source, see load_rgb); after that it depends on the
+    tile size and `workers`, not the image, and the result is encoded from disk.
+    Decoding, blending and encoding run off the gevent hub when serving cooperatively.
+    Returns the output content type.
+    """
+    tile = tile or Config.TILE_SIZE
+    overlap = overlap if overlap is not None else Config.TILE_OVERLAP
+    workers = workers or Config.TILE_WORKERS
+
+    with tempfile.TemporaryDirectory(dir=Config.TILE_TMP_DIR) as workdir:
+        source = run_cpu_bound(_load_source, source_path, workdir)
+        height, width = source.shape[:2]
+        boxes = plan_tiles(width, height, tile, overlap)
+        logger.info(f"[Tiling] {width}x{height} px -> {len(boxes)} tiles of {tile}px")
+
+        out = None
+        scale = None
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as pool:
+            # Keep a bounded window of tiles in flight; blend strictly in raster order
+            pending = deque()
+            next_box = 0
+            for index, box in enumerate(boxes):
+                while next_box < len(boxes) and len(pending) < workers * 2:
+                    pending.append(pool.submit(_enhance_tile, source, boxes[next_box], workdir, next_box, predict))
+                    next_box += 1
+                enhanced = pending.popleft().result()
+
+                left, top, right, bottom = box
+                if out is None:
+                    scale = enhanced.shape[1] / (right - left)
+                    out = np.memmap(
+                        os.path.join(workdir, "output.rgb"), dtype=np.uint8, mode="w+",
+                        shape=(round(height * scale), round(width * scale), 3)
+                    )
+                run_cpu_bound(_place_tile, out, enhanced, box, scale, overlap)
+
+        # Encode straight from the mapped output buffer without copying it into memory
+        out.flush()
+        run_cpu_bound(_encode_png, out, output)
+        del out, source
+    return "image/png"
@@ -0,0 +1,112 @@
+import base64
+import io
+import logging
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from services import metrics
+from services.offload import run_cpu_bound
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Pooled HTTP session for downloading results served by URL
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=Config.TRANSFER_POOL_SIZE, pool_maxsize=Config.TRANSFER_POOL_SIZE)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+
+class UnsupportedResult(Exception):
+    """Raised when a Gradio result is not a file path, data URI, URL or PIL image."""
+
+
+class Base64Reader(io.RawIOBase):
+    """
+    File-like reader that decodes a base64 string incrementally, so the decoded
+    image never exists as one buffer next to the encoded one.
+    """
+
+    def __init__(self, encoded: str, chunk_size: int):
+        self._encoded = encoded
+        self._pos = 0
+        self._chunk = max(4, chunk_size - chunk_size % 4)  # decode whole 4-char groups
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending and self._pos < len(self._encoded):
+            piece = self._encoded[self._pos:self._pos + self._chunk]
+            self._pos += self._chunk
+            self._pending = base64.b64decode(piece)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _is_pil_image(result) -> bool:
+    """True for PIL images; Pillow is only loaded if something else (e.g. gradio_client) already imported it."""
+    module = sys.modules.get("PIL.Image")
+    return module is not None and isinstance(result, module.Image)
+
+
+@contextmanager
+def open_result(result):
+    """
+    Opens a Gradio prediction result as a readable stream.
+    Yields (fileobj, content_type); any file or connection is closed on exit.
+    With metrics enabled the stream is a metrics.TimedReader, and the time spent
+    reading it (download or decoding) is recorded as stage "enhance.read_<kind>".
+    Raises UnsupportedResult for unknown result types.
+    """
+    with _open_result(result) as (kind, stream, content_type):
+        if not metrics.ENABLED:
+            yield stream, content_type
+            return
+        reader = metrics.TimedReader(stream)
+        try:
+            yield reader, content_type
+        finally:
+            metrics.STAGE_SECONDS.observe(reader.seconds, stage=f"enhance.read_{kind}", outcome="ok")
+            metrics.TRANSFER_BYTES.observe(reader.bytes, service="gradio", direction="download")
+
+
+@contextmanager
+def _open_result(result):
+    """Yields (kind, fileobj, content_type) for each supported result type."""
+    chunk_size = Config.TRANSFER_CHUNK_SIZE
+
+    if isinstance(result, str) and os.path.isfile(result):
+        # Gradio returned a local file path
+        ext = os.path.splitext(result)[1].lower().lstrip(".")
+        with open(result, "rb") as f:
+            yield "file", f, f"image/{ext}"
+    elif isinstance(result, str) and result.startswith("data:image"):
+        # Gradio returned a base64-encoded image string
+        header, b64 = result.split(",", 1)
+        content_type = header.split(";")[0].split(":", 1)[1]
+        yield "base64", io.BufferedReader(Base64Reader(b64, chunk_size), chunk_size), content_type
+    elif isinstance(result, str) and result.startswith("http"):
+        # Gradio returned a direct image URL; stream the body instead of buffering it
+        with _session.get(result, timeout=60, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            yield "url", r.raw, r.headers.get("Content-Type", "image/png")
+    elif _is_pil_image(result):
+        # Gradio returned a PIL image; spill the encoded PNG to disk past the memory budget
+        with tempfile.SpooledTemporaryFile(max_size=Config.TRANSFER_SPOOL_BYTES) as spool:
+            with metrics.span("enhance.encode_pil"):
+                run_cpu_bound(result.save, spool, "PNG")
+            spool.seek(0)
+            yield "pil", spool, "image/png"
+    else:
+        raise UnsupportedResult(f"Cannot decode enhanced image of type {type(result).__name__}")
@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend runs from its own directory (see run.py), so tests import its modules the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings are read when config is imported: point the run store, disk cache and scratch space at a
+# throwaway directory, use a bucket that moto serves, and keep the Gradio prober, gradio_client
+# telemetry and background work (derivatives, quality measurements) off unless a test turns them on
+_scratch = tempfile.mkdtemp(prefix="sharpify-tests-")
+for _name, _value in {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_BUCKET_NAME": "sharpify-tests",
+    "AWS_REGION": "us-east-1",
+    "FIREBASE_API_KEY": "testing",
+    "FIREBASE_PROJECT_ID": "",
+    "GRADIO_PROBE_INTERVAL": "0",
+    "HF_HUB_DISABLE_TELEMETRY": "1",
+    "DERIVATIVES_ENABLED": "false",
+    "QUALITY_METRICS_ENABLED": "false",
+    "INDEX_DB_PATH": os.path.join(_scratch, "run_index.db"),
+    "DISK_CACHE_DIR": os.path.join(_scratch, "cache"),
+    "TILE_TMP_DIR": _scratch,
+}.items():
+    os.environ.setdefault(_name, _value)
+
+
+def png_bytes(width: int = 32, height: int = 24, mode: str = "RGB", fmt: str = "PNG", color=0) -> bytes:
+    """Encodes a solid test image."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height), color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def s3():
+    """An in-process S3 (moto) with the configured bucket; the shared client is recreated inside it."""
+    moto = pytest.importorskip("moto")
+    from config import Config
+    from services import s3_service
+
+    with moto.mock_aws():
+        s3_service._s3_client = None
+        client = s3_service.get_s3_client()
+        client.create_bucket(Bucket=Config.AWS_BUCKET_NAME)
+        yield client
+    s3_service._s3_client = None
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import create_app
+
+    return create_app()
+
+
+@pytest.fixture
+def client(app, s3, monkeypatch):
+    """
+    A test client whose bearer token is the user's name: `Authorization: Bearer alice`
+    authenticates alice@example.com without Firebase.
+    """
+    import routes.auth as auth
+
+    monkeypatch.setattr(auth, "verify_firebase_token",
+                        lambda token: {"uid": token, "email": f"{token}@example.com"})
+    return app.test_client()
+
+
+def bearer(user: str) -> dict:
+    return {"Authorization": f"Bearer {user}"}
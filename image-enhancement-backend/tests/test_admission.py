@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from services.admission import AdmissionController, Rejected, TokenBucket
+
+
+def _controller(user_burst=5, global_burst=20, max_wait=0):
+    return AdmissionController("test", 1, user_burst, 10, global_burst, max_wait=max_wait, max_waiting=10)
+
+
+def test_bucket_charges_full_cost():
+    bucket = TokenBucket(rate=1, burst=5)
+    now = time.monotonic()
+    assert bucket.reserve(4, now) == 0
+    # Only 1 token is left: a second request of 4 waits for the other 3
+    assert bucket.reserve(4, now) == pytest.approx(3)
+    bucket.refund(4)
+    assert bucket.reserve(1, now) == 0
+
+
+def test_batch_within_burst_uses_its_whole_cost():
+    controller = _controller()
+    assert controller.acquire("user", cost=5) == 0
+    with pytest.raises(Rejected) as e:
+        controller.acquire("user", cost=1)
+    assert e.value.reason == "user" and e.value.retry_after == pytest.approx(1, abs=0.1)
+
+
+def test_cost_above_burst_is_refused_as_too_large():
+    controller = _controller()
+    with pytest.raises(Rejected) as e:
+        controller.acquire("user", cost=6)
+    assert e.value.reason == "size"
+    # Nothing was charged for the refused request
+    assert controller.acquire("user", cost=5) == 0
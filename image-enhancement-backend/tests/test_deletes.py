@@ -0,0 +1,81 @@
+from conftest import bearer
+
+from config import Config
+from services import run_index, s3_service
+from services.s3_service import delete_keys, head_object
+from utils.helpers import user_folder_for
+
+
+def _put(s3, *keys):
+    for key in keys:
+        s3.put_object(Bucket=Config.AWS_BUCKET_NAME, Key=key, Body=b"x")
+
+
+def _record_run(user: str, run_id: str) -> list[str]:
+    """Stores a run with an original, an enhanced image and two plots; returns its keys."""
+    folder = user_folder_for(f"{user}@example.com")
+    original, enhanced = f"{folder}/original_{run_id}.png", f"{folder}/enhanced_{run_id}.png"
+    run_index.record_upload(folder, run_id, original)
+    run_index.record_run(folder, run_id, enhanced)
+    plots = [f"{folder}/plots/{run_id}_{i}.png" for i in range(2)]
+    for idx, key in enumerate(plots):
+        run_index.record_plot(folder, run_id, key, idx)
+    return [original, enhanced, *plots]
+
+
+def test_keys_are_deleted_in_batches_of_one_thousand(s3):
+    batches = []
+    s3.meta.events.register("before-parameter-build.s3.DeleteObjects",
+                            lambda params, **kwargs: batches.append(len(params["Delete"]["Objects"])))
+    keys = [f"bulk/key_{i}.png" for i in range(2500)]
+    deleted, errors = delete_keys(keys)
+    assert sorted(batches) == [500, 1000, 1000]
+    assert sorted(deleted) == sorted(keys) and errors == []
+
+
+def test_partial_failures_are_reported_per_key(s3, monkeypatch):
+    folder = user_folder_for("olga@example.com")
+    keys = [f"{folder}/original_{i}.png" for i in range(3)]
+    _put(s3, *keys)
+    real = s3.delete_objects
+
+    def deny_first(**params):
+        params["Delete"]["Objects"] = params["Delete"]["Objects"][1:]
+        return {**real(**params), "Errors": [{"Key": keys[0], "Code": "AccessDenied", "Message": "denied"}]}
+
+    monkeypatch.setattr(s3_service.get_s3_client(), "delete_objects", deny_first)
+    deleted, errors = delete_keys(keys)
+    assert deleted == keys[1:]
+    assert errors == [{"key": keys[0], "code": "AccessDenied", "message": "denied"}]
+    assert head_object(keys[0]) is not None
+
+
+def test_deleting_a_run_removes_its_original_and_plots(client, s3):
+    keys = _record_run("pete", "abc1")
+    other = _record_run("pete", "abc12")  # shares a prefix with the first run
+    _put(s3, *keys, *other)
+
+    response = client.delete("/gallery/runs/abc1", headers=bearer("pete"))
+    assert response.status_code == 200 and sorted(response.get_json()["deleted"]) == sorted(keys)
+    assert all(head_object(key) is None for key in keys)
+    assert all(head_object(key) is not None for key in other)
+    assert run_index.get_run(user_folder_for("pete@example.com"), "abc1") is None
+    assert client.delete("/gallery/runs/abc1", headers=bearer("pete")).status_code == 404
+
+
+def test_deleting_an_enhanced_image_removes_the_whole_run(client, s3):
+    keys = _record_run("quin", "def2")
+    _put(s3, *keys)
+    response = client.delete("/gallery", json={"key": keys[1]}, headers=bearer("quin"))
+    assert response.status_code == 200 and sorted(response.get_json()["deleted"]) == sorted(keys)
+    assert client.delete("/gallery", json={"key": "someone_else/enhanced_def2.png"},
+                         headers=bearer("quin")).status_code == 400
+
+
+def test_account_erasure_only_touches_the_users_prefix(client, s3):
+    mine = _record_run("rosa", "ghi3")
+    theirs = _record_run("rosalind", "ghi3")
+    _put(s3, *mine, *theirs)
+    response = client.delete("/gallery/account", headers=bearer("rosa"))
+    assert sorted(response.get_json()["deleted"]) == sorted(mine)
+    assert all(head_object(key) is not None for key in theirs)
@@ -0,0 +1,85 @@
+import pytest
+from conftest import bearer, png_bytes
+
+from config import Config
+from routes.upload import _parse_parts
+from services import result_cache, run_index
+from services.s3_service import head_object
+from utils.helpers import user_folder_for
+
+
+@pytest.mark.parametrize("parts", [
+    None, [], "1:etag", [["1", "etag"]], [{"PartNumber": "x", "ETag": "e"}], [{"PartNumber": 0, "ETag": "e"}],
+    [{"PartNumber": 10001, "ETag": "e"}], [{"PartNumber": 1}], [{"PartNumber": 1, "ETag": ""}],
+    [{"PartNumber": 1, "ETag": 7}],
+])
+def test_malformed_parts_are_rejected(parts):
+    assert _parse_parts(parts) is None
+
+
+def test_parts_are_normalised():
+    assert _parse_parts([{"PartNumber": "2", "ETag": '"b"', "Size": 5}]) == [{"PartNumber": 2, "ETag": '"b"'}]
+
+
+def _presign(client, user, **fields):
+    body = {"filename": "photo.png", "content_type": "image/png", "size": 1000, "face": True, **fields}
+    return client.post("/upload/presign", json=body, headers=bearer(user))
+
+
+def _complete(client, user, **fields):
+    return client.post("/upload/complete", json=fields, headers=bearer(user))
+
+
+@pytest.mark.parametrize("fields", [
+    {"content_type": "image/webp"}, {"filename": "photo.exe"}, {"size": 0}, {"size": "big"},
+    {"size": Config.MAX_CONTENT_LENGTH + 1},
+])
+def test_presign_validates_before_issuing_credentials(client, fields):
+    assert _presign(client, "ivan", **fields).status_code == 400
+
+
+def test_presigned_post_upload_is_registered(client, s3):
+    upload = _presign(client, "judy").get_json()
+    assert upload["mode"] == "post" and upload["key"].endswith(f"original_{upload['run_id']}.png")
+    data = png_bytes(40, 30)
+    s3.put_object(Bucket=Config.AWS_BUCKET_NAME, Key=upload["key"], Body=data, Metadata={"face": "true"})
+
+    response = _complete(client, "judy", run_id=upload["run_id"], key=upload["key"])
+    assert response.status_code == 200
+    run = run_index.get_run(user_folder_for("judy@example.com"), upload["run_id"])
+    assert run["original_key"] == upload["key"] and run["original_width"] == 40
+    assert result_cache.original_digest(upload["key"]) == result_cache.digest_bytes(data)
+
+
+def test_multipart_upload_is_completed(client, s3):
+    upload = _presign(client, "kate", size=Config.MULTIPART_THRESHOLD + 1).get_json()
+    assert upload["mode"] == "multipart" and upload["part_urls"]
+    etag = s3.upload_part(Bucket=Config.AWS_BUCKET_NAME, Key=upload["key"], UploadId=upload["upload_id"],
+                          PartNumber=1, Body=png_bytes())["ETag"]
+
+    bad = _complete(client, "kate", run_id=upload["run_id"], key=upload["key"], upload_id=upload["upload_id"],
+                    parts=[{"PartNumber": 1}])
+    assert bad.status_code == 400
+    response = _complete(client, "kate", run_id=upload["run_id"], key=upload["key"],
+                         upload_id=upload["upload_id"], parts=[{"PartNumber": 1, "ETag": etag}])
+    assert response.status_code == 200
+
+
+def test_complete_only_accepts_the_callers_key_for_the_run(client, s3):
+    upload = _presign(client, "liam").get_json()
+    s3.put_object(Bucket=Config.AWS_BUCKET_NAME, Key=upload["key"], Body=png_bytes())
+    run_id, key = upload["run_id"], upload["key"]
+
+    assert _complete(client, "liam", run_id=run_id).status_code == 400
+    assert _complete(client, "mona", run_id=run_id, key=key).status_code == 400
+    assert _complete(client, "liam", run_id="0" * 32, key=key).status_code == 400
+    assert _complete(client, "liam", run_id=run_id, key=key.replace(".png", ".jpg")).status_code == 404
+    assert _complete(client, "liam", run_id=run_id, key=key).status_code == 200
+
+
+def test_invalid_uploads_are_deleted(client, s3):
+    upload = _presign(client, "nick").get_json()
+    s3.put_object(Bucket=Config.AWS_BUCKET_NAME, Key=upload["key"], Body=b"not an image" * 10)
+    response = _complete(client, "nick", run_id=upload["run_id"], key=upload["key"])
+    assert response.status_code == 400
+    assert head_object(upload["key"]) is None
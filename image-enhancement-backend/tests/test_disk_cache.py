@@ -0,0 +1,87 @@
+import io
+import os
+
+import pytest
+
+from config import Config
+from services.disk_cache import CachingReader, DiskCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "DISK_CACHE_ENABLED", True)
+    return DiskCache(str(tmp_path), max_bytes=300, max_object_bytes=150)
+
+
+def _read(cache: DiskCache, key: str) -> bytes | None:
+    with cache.open(key) as view:
+        return None if view is None else bytes(view)
+
+
+def _temp_files(cache: DiskCache) -> list[str]:
+    tmp = os.path.join(cache.root, "tmp")
+    return os.listdir(tmp) if os.path.isdir(tmp) else []
+
+
+def test_round_trip_and_hit_rate(cache):
+    assert _read(cache, "u/a.png") is None
+    assert cache.put("u/a.png", b"abc")
+    assert _read(cache, "u/a.png") == b"abc"
+    assert cache.stats()["hit_rate"] == 0.5 and cache.stats()["bytes"] == 3
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for age, key in enumerate(("u/a", "u/b", "u/c")):
+        cache.put(key, bytes(100))
+        os.utime(cache._path(key), (age + 1, age + 1))
+    _read(cache, "u/a")  # a hit makes "a" the most recently used
+
+    cache.put("u/d", bytes(100))  # 400 bytes: trimmed back under 90% of 300
+    assert [_read(cache, key) is not None for key in ("u/a", "u/b", "u/c", "u/d")] == [True, False, False, True]
+    assert cache.stats()["bytes"] == 200
+
+
+def test_objects_over_the_size_limit_are_not_cached(cache):
+    assert not cache.put("u/big", bytes(151))
+    assert not cache.put_file("u/big", io.BytesIO(bytes(151)))
+    assert _read(cache, "u/big") is None and _temp_files(cache) == []
+
+
+def test_failed_writes_keep_the_previous_copy(cache):
+    cache.put("u/a", b"old")
+    with pytest.raises(RuntimeError):
+        with cache.writer("u/a") as sink:
+            sink.write(b"new, partially")
+            assert _read(cache, "u/a") == b"old"  # readers never see an entry being written
+            raise RuntimeError("upload failed")
+    assert _read(cache, "u/a") == b"old" and _temp_files(cache) == []
+
+
+def test_replacement_is_atomic_for_open_readers(cache):
+    cache.put("u/a", b"first")
+    with cache.open("u/a") as view:
+        cache.put("u/a", b"second")
+        assert bytes(view) == b"first"
+    assert _read(cache, "u/a") == b"second"
+
+
+def test_caching_reader_caches_what_was_uploaded_once(cache):
+    reader = CachingReader(io.BytesIO(b"0123456789"), cache, "u/upload")
+    reader.read(6)
+    reader.seek(0)  # the upload rewinds to retry
+    while reader.read(4):
+        pass
+    reader.finish(True)
+    assert _read(cache, "u/upload") == b"0123456789"
+
+    failed = CachingReader(io.BytesIO(b"abc"), cache, "u/failed")
+    failed.read()
+    failed.finish(False)
+    assert _read(cache, "u/failed") is None and _temp_files(cache) == []
+
+
+def test_copies_and_discards_follow_s3(cache):
+    cache.put("u/a", b"abc")
+    assert cache.copy("u/a", "u/b") and _read(cache, "u/b") == b"abc"
+    cache.discard(["u/a", "u/missing"])
+    assert _read(cache, "u/a") is None and _read(cache, "u/b") == b"abc"
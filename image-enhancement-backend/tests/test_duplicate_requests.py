@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+from conftest import bearer
+
+from routes import enhance_proxy
+from services.job_queue import DONE, FAILED, QUEUED, IdempotencyConflict, InMemoryJobQueue, JobManager
+
+
+def _job(job_id: str, status: str = QUEUED, **fields) -> dict:
+    return {"job_id": job_id, "user": "alice", "payload": {}, "status": status, "version": 0, **fields}
+
+
+def test_duplicates_join_the_job_in_flight():
+    queue = InMemoryJobQueue()
+    assert queue.put_unique(_job("first"), "run:1:face", "")["job_id"] == "first"
+    assert queue.put_unique(_job("second"), "run:1:face", "")["job_id"] == "first"
+    assert queue.depth() == 1
+
+
+def test_reused_key_with_another_body_conflicts():
+    queue = InMemoryJobQueue()
+    queue.put_unique(_job("first"), "key:abc", '{"run_id": "1"}')
+    with pytest.raises(IdempotencyConflict):
+        queue.put_unique(_job("second"), "key:abc", '{"run_id": "2"}')
+
+
+def test_finished_jobs_are_replayed_within_the_dedup_window():
+    queue = InMemoryJobQueue(dedup_ttl=60)
+    queue.put_unique(_job("first"), "run:1:face", "")
+    queue.save(_job("first", DONE, result={"run_id": "1"}, finished_at=time.time()))
+    assert queue.put_unique(_job("second"), "run:1:face", "")["job_id"] == "first"
+
+    queue.save(_job("first", DONE, finished_at=time.time() - 61))
+    assert queue.put_unique(_job("third"), "run:1:face", "")["job_id"] == "third"
+
+
+def test_failed_jobs_release_their_key():
+    queue = InMemoryJobQueue()
+    queue.put_unique(_job("first"), "run:1:face", "")
+    queue.save(_job("first", FAILED, finished_at=time.time()))
+    assert queue.put_unique(_job("retry"), "run:1:face", "")["job_id"] == "retry"
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Routes /enhance to a queue whose jobs wait until the test releases them."""
+    release = threading.Event()
+    ran = []
+
+    def handler(payload):
+        release.wait(5)
+        ran.append(payload)
+        return {"run_id": payload["run_id"]}
+
+    manager = JobManager(handler, queue=InMemoryJobQueue(), workers=1)
+    monkeypatch.setattr(enhance_proxy, "jobs", manager)
+    yield manager, release, ran
+    release.set()
+
+
+def _enhance(client, user, run_id, headers=None, **flags):
+    body = {"file_url": "https://bucket/original.png", "run_id": run_id, **flags}
+    return client.post("/enhance", json=body, headers={**bearer(user), **(headers or {})})
+
+
+def test_concurrent_identical_requests_share_one_job(client, jobs):
+    manager, release, ran = jobs
+    # Each user has a small admission burst, so tests use their own users
+    first = _enhance(client, "gina", "run1", face=True)
+    second = _enhance(client, "gina", "run1", face=True)
+    other_flags = _enhance(client, "gina", "run1", face=True, text=True)
+    assert first.status_code == second.status_code == 202
+    assert second.get_json()["job_id"] == first.get_json()["job_id"] and second.get_json()["deduplicated"]
+    assert other_flags.get_json()["job_id"] != first.get_json()["job_id"]
+
+    release.set()
+    job_id = first.get_json()["job_id"]
+    job = manager.get(job_id)
+    while job["status"] != DONE:
+        job = manager.wait(job_id, job["version"], timeout=5)
+    replay = _enhance(client, "gina", "run1", face=True)
+    assert replay.status_code == 200 and replay.get_json()["data"] == {"run_id": "run1"}
+    assert [payload["flags"]["text"] for payload in ran].count(False) == 1
+
+
+def test_idempotency_key_reused_for_another_body_is_refused(client, jobs):
+    assert _enhance(client, "hank", "run2", {"Idempotency-Key": "k1"}).status_code == 202
+    assert _enhance(client, "hank", "run2", {"Idempotency-Key": "k1"}).get_json()["deduplicated"]
+    assert _enhance(client, "hank", "run3", {"Idempotency-Key": "k1"}).status_code == 422
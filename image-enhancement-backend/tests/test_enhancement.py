@@ -0,0 +1,100 @@
+import pytest
+from conftest import png_bytes
+
+from config import Config
+from services import enhancement, result_cache, run_index
+from services.originals import store_original
+from services.s3_service import public_url
+from utils.helpers import user_folder_for
+
+FLAGS = {"face": True, "background": False, "text": False, "colorization": False}
+
+
+class FakePool:
+    """Stands in for the Gradio pool: records the input URLs and answers with a solid image."""
+
+    def __init__(self):
+        self.urls = []
+
+    def predict(self, url, *flags, api_name):
+        from PIL import Image
+
+        self.urls.append(url)
+        return Image.new("RGB", (64, 48), "red")
+
+
+@pytest.fixture
+def pool(s3, monkeypatch):
+    fake = FakePool()
+    monkeypatch.setattr(enhancement, "gradio_pool", fake)
+    return fake
+
+
+def test_run_input_comes_from_the_bucket_not_the_client(pool):
+    run_id, _ = store_original(png_bytes(color=(1, 2, 3)), "alice@example.com")
+    result = enhancement.run_enhancement("https://attacker.example/other.png", "alice@example.com", run_id, FLAGS)
+    assert pool.urls == [result["original_url"]]
+    assert "attacker" not in pool.urls[0]
+
+
+def test_result_cache_is_shared_by_identical_uploads(pool):
+    data = png_bytes(color=(4, 5, 6))
+    first, _ = store_original(data, "alice@example.com")
+    enhancement.run_enhancement("ignored", "alice@example.com", first, FLAGS)
+    second, _ = store_original(data, "bob@example.com")
+    result = enhancement.run_enhancement("ignored", "bob@example.com", second, FLAGS)
+    assert len(pool.urls) == 1
+    assert result["run_id"] == second and "bob_example_com" in result["enhanced_url"]
+
+
+def test_flags_are_part_of_the_cache_key(pool):
+    data = png_bytes(color=(7, 8, 9))
+    for flags in (FLAGS, {**FLAGS, "text": True}):
+        run_id, _ = store_original(data, "alice@example.com")
+        enhancement.run_enhancement("ignored", "alice@example.com", run_id, flags)
+    assert len(pool.urls) == 2
+
+
+def test_client_urls_are_never_cached(pool, monkeypatch):
+    stored = []
+    monkeypatch.setattr(result_cache, "store", lambda *args: stored.append(args))
+    monkeypatch.setattr(result_cache, "lookup", lambda key: pytest.fail("looked up a client URL"))
+    url = public_url("somewhere/else.png")
+    result = enhancement.run_enhancement(url, "alice@example.com", None, FLAGS)
+    assert pool.urls == [url] and result["original_url"] == url
+    assert stored == []
+
+
+def test_large_uploads_are_tiled_with_the_shipped_config(pool):
+    # Preprocessing caps inputs at PREPROCESS_MAX_SIDE, which must still be above TILE_THRESHOLD
+    run_id, _ = store_original(png_bytes(2600, 2000, color=(10, 20, 30)), "alice@example.com")
+    result = enhancement.run_enhancement("ignored", "alice@example.com", run_id, FLAGS)
+    assert result["preprocess"]["input"]["width"] == 2048
+    assert len(pool.urls) > 1 and all("/tmp/" in url for url in pool.urls)
+
+
+def test_cache_key_covers_digest_flags_and_variant():
+    key = result_cache.cache_key("d1", FLAGS)
+    assert key == "d1:1000"
+    assert result_cache.cache_key("d1", {**FLAGS, "colorization": True}) != key
+    assert result_cache.cache_key("d1", FLAGS, "2048:png") not in (key, result_cache.cache_key("d2", FLAGS))
+
+
+def test_results_outlive_the_local_tier_until_invalidated():
+    result_cache.store("d3:1000", "alice/enhanced_1.png", "image/png")
+    result_cache._lru.clear()  # a fresh worker only has the persistent tier
+    assert result_cache.lookup("d3:1000") == ("alice/enhanced_1.png", "image/png")
+    result_cache.invalidate_keys(["alice/enhanced_1.png"])
+    assert result_cache.lookup("d3:1000") is None
+
+
+def test_missing_cached_object_falls_back_to_inference(pool, s3):
+    data = png_bytes(color=(11, 12, 13))
+    first, _ = store_original(data, "alice@example.com")
+    enhancement.run_enhancement("ignored", "alice@example.com", first, FLAGS)
+    enhanced_key = run_index.get_run(user_folder_for("alice@example.com"), first)["enhanced_key"]
+    s3.delete_object(Bucket=Config.AWS_BUCKET_NAME, Key=enhanced_key)
+
+    second, _ = store_original(data, "alice@example.com")
+    enhancement.run_enhancement("ignored", "alice@example.com", second, FLAGS)
+    assert len(pool.urls) == 2
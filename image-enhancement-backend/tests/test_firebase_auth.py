@@ -0,0 +1,98 @@
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import routes.auth as auth
+from services.firebase_auth import (
+    FirebaseTokenVerifier, InvalidTokenError, KeysUnavailableError, PublicKeyCache, TokenCache
+)
+
+PROJECT = "demo-project"
+
+
+def _signing_key(kid):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk["kid"] = kid
+    return key, jwk
+
+
+KEY, JWK = _signing_key("k1")
+
+
+def _token(key=KEY, kid="k1", **claims):
+    now = int(time.time())
+    payload = {
+        "sub": "uid1", "email": "user@example.com", "aud": PROJECT,
+        "iss": f"https://securetoken.google.com/{PROJECT}", "iat": now, "exp": now + 3600, "auth_time": now,
+        **claims,
+    }
+    return jwt.encode(payload, key, algorithm="RS256", headers={"kid": kid})
+
+
+def _failing_fetch():
+    raise ConnectionError("jwks endpoint unreachable")
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """Replaces the Firebase lookup with a stub that records the tokens it was asked about."""
+    calls = []
+
+    def lookup(token):
+        calls.append(token)
+        return {"uid": "uid1", "email": "user@example.com"}
+
+    monkeypatch.setattr(auth, "lookup_firebase_token", lookup)
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    return calls
+
+
+def test_verifies_token_signed_with_published_key():
+    verifier = FirebaseTokenVerifier(PROJECT, PublicKeyCache(lambda: ({"k1": JWK}, 3600)))
+    assert verifier.verify(_token())["sub"] == "uid1"
+
+
+def test_key_fetch_failure_is_not_an_invalid_token():
+    verifier = FirebaseTokenVerifier(PROJECT, PublicKeyCache(_failing_fetch))
+    with pytest.raises(KeysUnavailableError):
+        verifier.verify(_token())
+
+
+def test_unknown_key_is_invalid_when_keys_were_fetched():
+    verifier = FirebaseTokenVerifier(PROJECT, PublicKeyCache(lambda: ({"k1": JWK}, 3600)))
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(_token(kid="k2"))
+
+
+def test_failed_refresh_keeps_previous_keys():
+    responses = [({"k1": JWK}, 0)]
+
+    def fetch():
+        if responses:
+            return responses.pop()
+        raise ConnectionError("jwks endpoint unreachable")
+
+    verifier = FirebaseTokenVerifier(PROJECT, PublicKeyCache(fetch, min_refresh=0))
+    assert verifier.verify(_token())["sub"] == "uid1"
+    # The keys have expired and the refresh fails: the cached key still verifies
+    assert verifier.verify(_token())["sub"] == "uid1"
+
+
+def test_falls_back_to_lookup_when_keys_are_unavailable(monkeypatch, remote):
+    monkeypatch.setattr(auth, "local_verifier", FirebaseTokenVerifier(PROJECT, PublicKeyCache(_failing_fetch)))
+    token = _token()
+    assert auth.verify_firebase_token(token)["uid"] == "uid1"
+    assert remote == [token]
+
+
+def test_rejects_invalid_token_without_lookup(monkeypatch, remote):
+    monkeypatch.setattr(auth, "local_verifier",
+                        FirebaseTokenVerifier(PROJECT, PublicKeyCache(lambda: ({"k1": JWK}, 3600))))
+    forged, _ = _signing_key("k1")
+    assert auth.verify_firebase_token(_token(key=forged)) is None
+    assert auth.verify_firebase_token(_token(exp=int(time.time()) - 3600)) is None
+    assert remote == []
@@ -0,0 +1,63 @@
+from conftest import bearer
+
+from routes.gallery import decode_cursor, encode_cursor
+from services import run_index
+from utils.helpers import user_folder_for
+
+
+def _record_runs(user: str, created: dict[str, float]) -> None:
+    folder = user_folder_for(f"{user}@example.com")
+    for run_id, created_at in created.items():
+        run_index.record_run(folder, run_id, f"{folder}/enhanced_{run_id}.png", {"face": True},
+                             created_at=created_at, original_key=f"{folder}/original_{run_id}.png")
+
+
+def _pages(client, user: str, limit: int, between=None) -> list[list[str]]:
+    pages, cursor = [], None
+    while True:
+        query = f"/gallery?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(query, headers=bearer(user)).get_json()
+        pages.append([image["run_id"] for image in body["images"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+        if between:
+            between()
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor({"created_at": 1700000000.5, "run_id": "abc123"})) == (1700000000.5, "abc123")
+
+
+def test_pages_walk_every_run_once_newest_first(client):
+    client.get("/gallery", headers=bearer("carol"))  # index the (empty) bucket first
+    # Runs created in the same second are ordered by run_id
+    _record_runs("carol", {"r1": 100, "r2": 200, "r3": 200, "r4": 300, "r5": 400, "r6": 400, "r7": 500})
+    pages = _pages(client, "carol", limit=3)
+    assert pages == [["r7", "r6", "r5"], ["r4", "r3", "r2"], ["r1"]]
+
+
+def test_new_runs_do_not_shift_later_pages(client):
+    client.get("/gallery", headers=bearer("dave"))
+    _record_runs("dave", {f"r{i}": i for i in range(1, 6)})
+    added = []
+
+    def add_newer_run():
+        added.append(f"n{len(added)}")
+        _record_runs("dave", {added[-1]: 100 + len(added)})
+
+    pages = _pages(client, "dave", limit=2, between=add_newer_run)
+    assert [run_id for page in pages for run_id in page] == ["r5", "r4", "r3", "r2", "r1"]
+
+
+def test_last_full_page_has_no_cursor(client):
+    client.get("/gallery", headers=bearer("erin"))
+    _record_runs("erin", {"a": 1, "b": 2})
+    body = client.get("/gallery?limit=2", headers=bearer("erin")).get_json()
+    assert [image["run_id"] for image in body["images"]] == ["b", "a"]
+    assert body["next_cursor"] is None
+
+
+def test_rejects_malformed_cursor_and_limit(client):
+    assert client.get("/gallery?cursor=not-a-cursor", headers=bearer("frank")).status_code == 400
+    assert client.get("/gallery?limit=many", headers=bearer("frank")).status_code == 400
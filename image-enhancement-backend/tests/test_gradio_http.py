@@ -0,0 +1,217 @@
+import concurrent.futures
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from services.gradio_pool import GradioPool, NoBackendAvailable
+
+pytest.importorskip("gradio_client")
+
+INPUTS = ("file_url", "face", "background", "text", "colorization")
+
+# Enough of a Gradio 4 app's config for gradio_client: one queued /predict endpoint over SSE v3
+CONFIG = {
+    "version": "4.44.0",
+    "protocol": "sse_v3",
+    "connect_heartbeat": False,
+    "components": [{"id": i, "type": "textbox"} for i in range(len(INPUTS) + 1)],
+    "dependencies": [{
+        "id": 0,
+        "api_name": "predict",
+        "inputs": list(range(len(INPUTS))),
+        "outputs": [len(INPUTS)],
+        "backend_fn": True,
+    }],
+}
+INFO = {
+    "named_endpoints": {"/predict": {
+        "parameters": [{"parameter_name": name} for name in INPUTS],
+        "returns": [{"label": "enhanced"}],
+    }},
+    "unnamed_endpoints": {},
+}
+
+
+class GradioStub:
+    """
+    A local Gradio app on a real socket. /predict answers "enhanced:<file_url>" after `delay`
+    seconds; with `down` set, /config and /queue/join answer 503. Cancelled event IDs are recorded.
+    """
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.down = False
+        self.predictions = []
+        self.cancelled = []
+        self._streams: dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """Closes the listening socket: new connections are refused."""
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _stream(self, session_hash: str) -> queue.Queue:
+        with self._lock:
+            return self._streams.setdefault(session_hash, queue.Queue())
+
+    def _run(self, body: dict, event_id: str) -> None:
+        time.sleep(self.delay)
+        if event_id in self.cancelled:
+            return
+        self.predictions.append(body["data"])
+        self._stream(body["session_hash"]).put({
+            "msg": "process_completed", "event_id": event_id, "success": True,
+            "output": {"data": [f"enhanced:{body['data'][0]}"]},
+        })
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, body, status=200):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/config":
+                    return self._json({"error": "down"}, 503) if stub.down else self._json(CONFIG)
+                if url.path == "/info":
+                    return self._json(INFO)
+                if url.path == "/queue/data":
+                    return self._events(parse_qs(url.query)["session_hash"][0])
+                self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"{}")
+                if self.path == "/queue/join":
+                    if stub.down:
+                        return self._json({"error": "down"}, 503)
+                    event_id = uuid.uuid4().hex
+                    threading.Thread(target=stub._run, args=(body, event_id), daemon=True).start()
+                    return self._json({"event_id": event_id})
+                if self.path in ("/cancel", "/reset"):
+                    stub.cancelled.append(body.get("event_id"))
+                    return self._json({"success": True})
+                self._json({"error": "not found"}, 404)
+
+            def _events(self, session_hash):
+                # One server-sent event stream per session, kept open until the stub stops
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                messages = stub._stream(session_hash)
+                while not stub._stopping.is_set():
+                    try:
+                        message = messages.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    self.wfile.write(f"data: {json.dumps(message)}\n\n".encode())
+                    self.wfile.flush()
+
+        return Handler
+
+
+@pytest.fixture
+def stubs():
+    started = []
+
+    def start(**options):
+        stub = GradioStub(**options)
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        if not stub._stopping.is_set():
+            stub.stop()
+
+
+def _pool(*stubs, **options):
+    # The default client factory: a real gradio_client.Client per connection
+    options = {"backoff": 0, "probe_interval": 0, "timeout": 10, **options}
+    return GradioPool([stub.url for stub in stubs], **options)
+
+
+def _wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_predicts_over_http(stubs):
+    stub = stubs()
+    pool = _pool(stub)
+    assert pool.predict("https://bucket/in.png", True, False, False, False) == "enhanced:https://bucket/in.png"
+    assert stub.predictions == [["https://bucket/in.png", True, False, False, False]]
+
+
+def test_retries_on_another_backend_when_one_refuses_connections(stubs):
+    down, up = stubs(), stubs()
+    down.stop()
+    pool = _pool(down, up)
+    assert pool.predict("in.png", False, False, False, False) == "enhanced:in.png"
+    assert [s["failures"] for s in pool.status()] == [1, 0]
+    assert up.predictions
+
+
+def test_refused_connections_open_the_circuit(stubs):
+    stub = stubs()
+    stub.stop()
+    pool = _pool(stub, max_retries=1, failure_threshold=2, reset_timeout=60)
+    with pytest.raises(Exception) as error:
+        pool.predict("in.png", False, False, False, False)
+    assert isinstance(error.value, pool.transient_errors)
+    assert pool.status()[0]["circuit_open"]
+    with pytest.raises(NoBackendAvailable):
+        pool.predict("in.png", False, False, False, False)
+
+
+def test_timeout_cancels_the_job_on_the_backend(stubs):
+    stub = stubs(delay=1)
+    pool = _pool(stub, timeout=0.3, max_retries=0)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        pool.predict("in.png", False, False, False, False)
+    assert _wait_for(lambda: stub.cancelled)
+    time.sleep(1.2)
+    assert stub.predictions == []
+    assert pool.status()[0]["failures"] == 1
+
+
+def test_prober_marks_backends_down_and_recovered(stubs):
+    stub = stubs()
+    pool = _pool(stub, probe_interval=0.05)
+    assert pool.probe(stub.url)
+
+    stub.down = True
+    pool._ensure_prober()
+    assert _wait_for(lambda: not pool.status()[0]["healthy"])
+    with pytest.raises(NoBackendAvailable):
+        pool.predict("in.png", False, False, False, False)
+
+    stub.down = False
+    assert _wait_for(lambda: pool.status()[0]["healthy"])
+    assert pool.predict("in.png", False, False, False, False) == "enhanced:in.png"
@@ -0,0 +1,88 @@
+import concurrent.futures
+
+import pytest
+
+from services.gradio_pool import GradioPool, NoBackendAvailable
+
+
+class FakeJob:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.cancelled = False
+
+    def result(self, timeout=None):
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return self.outcome
+
+    def cancel(self):
+        self.cancelled = True
+        return True
+
+
+class FakeBackends:
+    """Client factory whose clients answer with the outcomes queued for their URL."""
+
+    def __init__(self, **outcomes):
+        self.outcomes = {f"http://{name}": list(queue) for name, queue in outcomes.items()}
+        self.jobs = []
+        self.calls = []
+
+    def __call__(self, url):
+        backends = self
+
+        class Client:
+            def submit(self, *args, api_name):
+                backends.calls.append(url)
+                job = FakeJob(backends.outcomes[url].pop(0))
+                backends.jobs.append(job)
+                return job
+
+        return Client()
+
+
+def _pool(factory, urls=("http://a",), **options):
+    options = {"backoff": 0, "probe_interval": 0, **options}
+    return GradioPool(list(urls), client_factory=factory, **options)
+
+
+def test_returns_prediction():
+    pool = _pool(FakeBackends(a=["result.png"]))
+    assert pool.predict("input.png") == "result.png"
+
+
+def test_retries_connection_errors_on_another_backend():
+    factory = FakeBackends(a=[ConnectionError("refused")], b=["result.png"])
+    pool = _pool(factory, urls=("http://a", "http://b"))
+    assert pool.predict("input.png") == "result.png"
+    assert factory.calls == ["http://a", "http://b"]
+    assert [s["failures"] for s in pool.status()] == [1, 0]
+
+
+def test_app_errors_are_not_retried_or_counted():
+    factory = FakeBackends(a=[ValueError("bad input")] * 3)
+    pool = _pool(factory, failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(ValueError, match="bad input"):
+            pool.predict("input.png")
+    assert len(factory.calls) == 3
+    status = pool.status()[0]
+    assert status["failures"] == 0 and not status["circuit_open"] and status["outstanding"] == 0
+
+
+def test_timeout_cancels_job_and_opens_circuit():
+    factory = FakeBackends(a=[concurrent.futures.TimeoutError()] * 2)
+    pool = _pool(factory, max_retries=1, failure_threshold=2, reset_timeout=60)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        pool.predict("input.png")
+    assert [job.cancelled for job in factory.jobs] == [True, True]
+    assert pool.status()[0]["circuit_open"]
+    with pytest.raises(NoBackendAvailable):
+        pool.predict("input.png")
+
+
+def test_success_after_failure_resets_breaker():
+    factory = FakeBackends(a=[ConnectionError("reset"), "result.png"])
+    pool = _pool(factory, max_retries=1)
+    assert pool.predict("input.png") == "result.png"
+    assert pool.status()[0]["failures"] == 0
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from config import Config
+from services.job_queue import DONE, FAILED, QUEUED, InMemoryJobQueue, JobManager, QueueFullError
+
+
+def _job(job_id: str, user: str) -> dict:
+    return {"job_id": job_id, "user": user, "payload": {}, "status": QUEUED, "created_at": 0, "version": 0}
+
+
+def _drain(queue) -> list[str]:
+    order = []
+    while (job := queue.get(timeout=0)) is not None:
+        order.append(job["job_id"])
+    return order
+
+
+def _finished(manager: JobManager, job_id: str) -> dict:
+    job = manager.get(job_id)
+    while job["status"] not in (DONE, FAILED):
+        job = manager.wait(job_id, job["version"], timeout=5)
+    return job
+
+
+def test_workers_take_jobs_round_robin_across_users():
+    queue = InMemoryJobQueue()
+    for job_id in ("a1", "a2", "a3", "a4"):
+        queue.put(_job(job_id, "alice"))
+    queue.put(_job("b1", "bob"))
+    queue.put(_job("c1", "carol"))
+    queue.put(_job("b2", "bob"))
+    assert _drain(queue) == ["a1", "b1", "c1", "a2", "b2", "a3", "a4"]
+    assert queue.depth() == 0
+
+
+def test_queue_refuses_jobs_at_capacity():
+    queue = InMemoryJobQueue(max_size=2)
+    queue.put(_job("a1", "alice"))
+    queue.put(_job("b1", "bob"))
+    with pytest.raises(QueueFullError):
+        queue.put(_job("c1", "carol"))
+    queue.get(timeout=0)
+    queue.put(_job("c1", "carol"))
+
+
+def test_get_times_out_on_an_empty_queue():
+    assert InMemoryJobQueue().get(timeout=0.05) is None
+
+
+def test_wait_returns_when_the_job_changes():
+    queue = InMemoryJobQueue()
+    job = _job("a1", "alice")
+    queue.put(job)
+    threading.Timer(0.05, lambda: queue.save({**job, "status": DONE})).start()
+    assert queue.wait("a1", 0, timeout=5)["status"] == DONE
+    assert queue.wait("a1", 1, timeout=0.05)["version"] == 1
+
+
+def test_workers_record_results_and_failures():
+    def handler(payload):
+        if payload["fail"]:
+            raise ValueError("bad image")
+        return {"enhanced_url": "https://bucket/enhanced.png"}
+
+    manager = JobManager(handler, queue=InMemoryJobQueue(), workers=2)
+    ok = manager.submit("alice", {"fail": False})
+    bad = manager.submit("alice", {"fail": True})
+    ok, bad = _finished(manager, ok["job_id"]), _finished(manager, bad["job_id"])
+    assert ok["status"] == DONE and ok["result"] == {"enhanced_url": "https://bucket/enhanced.png"}
+    assert bad["status"] == FAILED and bad["error"] == "bad image" and bad["error_status"] == 500
+
+
+def test_jobs_past_the_queue_deadline_are_shed(monkeypatch):
+    monkeypatch.setattr(Config, "ENHANCE_QUEUE_DEADLINE", 1)
+    shed, ran = [], []
+    manager = JobManager(ran.append, queue=InMemoryJobQueue(), workers=1, on_shed=shed.append)
+    manager.queue.put(_job("stale", "alice"))  # created at the epoch, long past the deadline
+    manager._ensure_workers()
+    job = _finished(manager, "stale")
+    assert job["status"] == FAILED and job["error_status"] == 503
+    assert shed == [{}] and ran == []
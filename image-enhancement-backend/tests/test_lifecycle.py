@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+from services import lifecycle, run_index
+
+NOW = 1_800_000_000.0
+DAY = 86400
+
+
+def _obj(key: str, age_days: float) -> dict:
+    modified = datetime.fromtimestamp(NOW - age_days * DAY, tz=timezone.utc)
+    return {"Key": key, "LastModified": modified, "Size": 10}
+
+
+def _classify(objects, folder="u", transcode_days=None):
+    removals, transcode = lifecycle.classify(folder, sorted(objects, key=lambda o: o["Key"]), NOW,
+                                             stale_days=30, orphan_hours=24, transcode_days=transcode_days)
+    return {obj["Key"]: category for category, obj in removals}, [obj["Key"] for obj in transcode]
+
+
+def test_stale_runs_go_with_their_input_and_derivatives():
+    removals, _ = _classify([
+        _obj("u/original_aa.png", 31), _obj("u/original_aa_input.jpg", 31), _obj("u/original_aa_thumb.webp", 31),
+        _obj("u/original_bb.png", 29),  # not stale yet
+        _obj("u/original_cc.jpg", 90), _obj("u/enhanced_cc.png", 90),  # enhanced
+    ])
+    assert removals == {key: lifecycle.STALE_RUN
+                        for key in ("u/original_aa.png", "u/original_aa_input.jpg", "u/original_aa_thumb.webp")}
+
+
+def test_runs_being_enhanced_are_not_stale():
+    run_index.record_upload("u", "dd", "u/original_dd.png")
+    run_index.update_run("u", "dd", status=run_index.ENHANCING)
+    assert _classify([_obj("u/original_dd.png", 60)])[0] == {}
+
+
+def test_orphans_are_removed_after_the_grace_window():
+    old, fresh = 2, 0.5  # days; the grace window is 24 hours
+    removals, _ = _classify([
+        _obj("u/enhanced_ee_plot_0.png", old), _obj("u/enhanced_ff_plot_0.png", fresh),
+        _obj("u/original_ee_input.png", old), _obj("u/original_ff_input.png", fresh),
+        _obj("u/enhanced_ee_preview.webp", old), _obj("u/enhanced_ff_preview.webp", fresh),
+        _obj("u/tmp/ee_tile_0.png", old), _obj("u/tmp/ff_tile_0.png", fresh),
+    ])
+    assert removals == {
+        "u/enhanced_ee_plot_0.png": lifecycle.ORPHAN_PLOT,
+        "u/original_ee_input.png": lifecycle.ORPHAN_INPUT,
+        "u/enhanced_ee_preview.webp": lifecycle.ORPHAN_DERIVATIVE,
+        "u/tmp/ee_tile_0.png": lifecycle.SCRATCH,
+    }
+
+
+def test_objects_of_live_runs_are_kept():
+    removals, _ = _classify([
+        _obj("u/original_ab.png", 400), _obj("u/original_ab_input.png", 400), _obj("u/original_ab_thumb.webp", 400),
+        _obj("u/enhanced_ab.png", 400), _obj("u/enhanced_ab_plot_0.png", 400), _obj("u/enhanced_ab_preview.webp", 400),
+    ])
+    assert removals == {}
+
+
+def test_only_old_enhanced_png_originals_are_recompressed():
+    _, transcode = _classify([
+        _obj("u/original_a1.png", 100), _obj("u/enhanced_a1.png", 100),
+        _obj("u/original_a2.png", 10), _obj("u/enhanced_a2.png", 10),   # too recent
+        _obj("u/original_a3.jpg", 100), _obj("u/enhanced_a3.png", 100),  # not a PNG
+    ], transcode_days=90)
+    assert transcode == ["u/original_a1.png"]
+    assert _classify([_obj("u/original_a1.png", 100), _obj("u/enhanced_a1.png", 100)])[1] == []
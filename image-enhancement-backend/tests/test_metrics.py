@@ -0,0 +1,39 @@
+import boto3
+import pytest
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import EndpointConnectionError
+
+from services import metrics
+
+
+def _errors(operation: str) -> int:
+    state = metrics.EXTERNAL_SECONDS._values.get(("s3", operation, "error"))
+    return state[-1] if state else 0
+
+
+@pytest.fixture
+def failing_s3():
+    """An S3 client whose requests never reach the network: every send fails to connect."""
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="testing",
+                          aws_secret_access_key="testing", config=BotoConfig(retries={"max_attempts": 1}))
+
+    def refuse(request, **kwargs):
+        raise EndpointConnectionError(endpoint_url=request.url)
+
+    client.meta.events.register("before-send.s3", refuse)
+    metrics.instrument_boto_client(client)
+    return client
+
+
+def test_failed_s3_calls_are_recorded_as_errors(failing_s3):
+    before = _errors("HeadObject")
+    with pytest.raises(EndpointConnectionError):
+        failing_s3.head_object(Bucket="sharpify-tests", Key="missing.png")
+    assert _errors("HeadObject") == before + 1
+
+
+def test_errors_without_a_recorded_operation_are_still_counted(failing_s3):
+    before = _errors("unknown")
+    failing_s3.meta.events.emit("after-call-error.s3.HeadObject", context={"metrics_start": 0.0},
+                                exception=EndpointConnectionError(endpoint_url="http://s3"))
+    assert _errors("unknown") == before + 1
@@ -0,0 +1,41 @@
+import pytest
+from conftest import bearer, png_bytes
+
+import routes.enhance_proxy as enhance_proxy
+from services import run_index
+from services.originals import UploadError, store_original
+from services.s3_service import head_object
+
+
+@pytest.mark.parametrize("fmt, mode, ext, content_type", [
+    ("PNG", "RGB", "png", "image/png"),
+    ("JPEG", "RGB", "jpg", "image/jpeg"),
+    ("PNG", "RGBA", "png", "image/png"),  # converted to UPLOAD_CONVERT_FORMAT
+])
+def test_originals_are_named_after_their_stored_format(s3, fmt, mode, ext, content_type):
+    run_id, url = store_original(png_bytes(mode=mode, fmt=fmt), "alice@example.com")
+    key = run_index.get_run("alice_example_com", run_id)["original_key"]
+    assert key == f"alice_example_com/original_{run_id}.{ext}" and url.endswith(key)
+    assert head_object(key)["ContentType"] == content_type
+
+
+def test_oversized_originals_are_refused(s3):
+    with pytest.raises(UploadError):
+        store_original(png_bytes(6000, 10), "alice@example.com")
+
+
+def test_batch_items_use_the_recorded_original(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(enhance_proxy, "_submit_job",
+                        lambda file_url, run_id, flags: submitted.append((file_url, run_id)) or {"job_id": run_id})
+    jpeg, _ = store_original(png_bytes(fmt="JPEG"), "alice@example.com")
+    other, _ = store_original(png_bytes(), "bob@example.com")
+    response = client.post("/enhance/batch", headers=bearer("alice"), json={"items": [
+        {"run_id": jpeg},
+        {"key": f"alice_example_com/original_{jpeg}.jpg"},
+        {"run_id": other},
+        {"run_id": "ffff"},
+    ]})
+    assert response.status_code == 202
+    assert [url.rsplit("/", 1)[1] for url, _ in submitted] == [f"original_{jpeg}.jpg"] * 2
+    assert [item["status"] for item in response.json["items"][2:]] == ["failed", "failed"]
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from conftest import png_bytes
+from PIL import Image
+
+from config import Config
+from services import preprocess, run_index
+
+
+def _jpeg_with_orientation(width: int, height: int, orientation: int) -> bytes:
+    exif = Image.Exif()
+    exif[preprocess.ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 10, 10)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("data, steps", [
+    (png_bytes(), []),
+    (png_bytes(mode="L"), []),
+    (png_bytes(Config.PREPROCESS_MAX_SIDE + 1, 10), ["resize"]),
+    (_jpeg_with_orientation(40, 20, 6), ["orient"]),
+    (png_bytes(mode="RGBA"), ["convert"]),
+    (png_bytes(fmt="GIF", mode="P"), ["convert"]),
+])
+def test_plan_reads_the_needed_steps_from_the_header(data, steps):
+    assert preprocess.plan(data[:Config.UPLOAD_HEADER_BYTES])[0] == steps
+
+
+def test_normalise_orients_shrinks_and_flattens():
+    data, content_type, width, height = preprocess.normalise(io.BytesIO(_jpeg_with_orientation(400, 200, 6)),
+                                                             "JPEG", max_side=100)
+    assert content_type == "image/jpeg" and (width, height) == (50, 100)
+
+    data, content_type, _, _ = preprocess.normalise(io.BytesIO(png_bytes(mode="RGBA", color=(0, 0, 0, 0))), "PNG")
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.mode == "RGB" and image.getpixel((0, 0)) == (255, 255, 255)
+
+
+def _store(s3, key: str, data: bytes) -> str:
+    s3.put_object(Bucket=Config.AWS_BUCKET_NAME, Key=key, Body=data)
+    return key
+
+
+def test_inputs_are_stored_next_to_the_original_and_reused(s3):
+    key = _store(s3, "sara_example_com/original_run1.png", png_bytes(3000, 1500))
+    report = preprocess.prepare_input("sara@example.com", key, "run1")
+    assert report["key"] == "sara_example_com/original_run1_input.png" and not report["reused"]
+    assert report["input"]["width"] == Config.PREPROCESS_MAX_SIDE and report["pixels_saved"] > 0
+    assert run_index.input_for(key)["input_key"] == report["key"]
+
+    again = preprocess.prepare_input("sara@example.com", key, "run1")
+    assert again["reused"] and again["key"] == report["key"]
+
+
+def test_changed_settings_prepare_the_input_again(s3, monkeypatch):
+    key = _store(s3, "sara_example_com/original_run2.jpg", _jpeg_with_orientation(3000, 1000, 1))
+    assert preprocess.prepare_input("sara@example.com", key, "run2")["input"]["width"] == Config.PREPROCESS_MAX_SIDE
+    monkeypatch.setattr(Config, "PREPROCESS_MAX_SIDE", 1000)
+    report = preprocess.prepare_input("sara@example.com", key, "run2")
+    assert not report["reused"] and report["input"]["width"] == 1000
+    assert report["key"].endswith("_input.jpg")
+
+
+def test_originals_needing_nothing_are_sent_as_is(s3):
+    key = _store(s3, "sara_example_com/original_run3.png", png_bytes())
+    assert preprocess.prepare_input("sara@example.com", key, "run3") is None
+    assert preprocess.prepare_input("sara@example.com", "sara_example_com/missing.png", "run4") is None
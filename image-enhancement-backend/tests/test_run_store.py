@@ -0,0 +1,70 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from config import Config
+from services import db, run_index
+
+# The gallery-only layout the run store started from
+V1_RUNS = """
+CREATE TABLE runs (
+    user_folder  TEXT NOT NULL,
+    run_id       TEXT NOT NULL,
+    key          TEXT NOT NULL UNIQUE,
+    enhancements TEXT NOT NULL DEFAULT '[]',
+    created_at   REAL NOT NULL,
+    PRIMARY KEY (user_folder, run_id)
+);
+CREATE INDEX runs_by_user_time ON runs (user_folder, created_at);
+"""
+
+
+def _in_new_thread(fn, *args):
+    """Connections are per thread, so a fresh thread opens the database at the patched path."""
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(fn, *args).result()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = str(tmp_path / "run_index.db")
+    monkeypatch.setattr(Config, "INDEX_DB_PATH", path)
+    return path
+
+
+def _columns(path: str) -> set[str]:
+    with sqlite3.connect(path) as conn:
+        return {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+
+
+def test_gallery_rows_become_run_records(database):
+    with sqlite3.connect(database) as conn:
+        conn.executescript(V1_RUNS)
+        conn.execute("INSERT INTO runs VALUES ('ann', 'r1', 'ann/enhanced_r1.png', '[\"face\"]', 100)")
+
+    run = _in_new_thread(run_index.get_run, "ann", "r1")
+    assert run["original_key"] == "ann/original_r1.png" and run["enhanced_key"] == "ann/enhanced_r1.png"
+    assert run["status"] == run_index.ENHANCED and run["enhancements"] == ["face"]
+    assert run["created_at"] == 100
+    assert {"original_bytes", "timings", "quality"} <= _columns(database)
+    with sqlite3.connect(database) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'runs_v1'").fetchone() is None
+
+
+def test_records_without_quality_scores_gain_the_column(database):
+    with sqlite3.connect(database) as conn:
+        conn.execute(run_index._RUNS_TABLE.replace("    quality         TEXT,\n", ""))
+        conn.execute("INSERT INTO runs (user_folder, run_id, original_key, created_at, updated_at) "
+                     "VALUES ('bob', 'r2', 'bob/original_r2.jpg', 1, 1)")
+    assert "quality" not in _columns(database)
+
+    _in_new_thread(db.connect)
+    assert "quality" in _columns(database)
+    assert _in_new_thread(run_index.get_run, "bob", "r2")["original_key"] == "bob/original_r2.jpg"
+
+
+def test_migrations_leave_a_current_database_alone(database):
+    _in_new_thread(lambda: run_index.record_upload("cat", "r3", "cat/original_r3.png", created_at=5))
+    _in_new_thread(db.connect)
+    assert _in_new_thread(run_index.get_run, "cat", "r3")["created_at"] == 5
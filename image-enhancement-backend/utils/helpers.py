@@ -1,5 +1,7 @@
+import io
 import os
 import logging
+from functools import lru_cache
 from werkzeug.utils import secure_filename
 from config import Config
 
@@ -8,6 +10,29 @@ logger = logging.getLogger(__name__)
 # Allowed file extensions for uploads
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
 
+# Formats and colour modes that can be sent to the enhancement backend as-is
+PASSTHROUGH_FORMATS = {"PNG", "JPEG"}
+PASSTHROUGH_MODES = {"RGB", "L"}
+
+
+def pil_image():
+    """
+    Imports Pillow on first use and returns its Image module, configured to refuse
+    images above RESULT_MAX_PIXELS so enhanced results (several times larger than
+    any upload) still decode. User uploads are held to MAX_IMAGE_PIXELS by
+    probe_image before anything decodes them.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = Config.RESULT_MAX_PIXELS
+    return Image
+
+
+@lru_cache(maxsize=4096)
+def user_folder_for(email):
+    """Returns the S3 folder (key prefix without trailing slash) that holds a user's objects."""
+    return email.replace("@", "_").replace(".", "_")
+
 
 def allowed_file(filename):
     """Check if a file has a valid extension."""
@@ -25,6 +50,53 @@ def allowed_file(filename):
         return False
 
 
+def parse_enhancement_flags(source, defaults=None):
+    """
+    Parses enhancement flags sent as "true"/"false" strings or booleans from a
+    form or JSON mapping. Flags missing from `source` fall back to `defaults`.
+    """
+    defaults = defaults or {}
+    return {
+        name: source.get(name, defaults.get(name)) in (True, "true")
+        for name in ("face", "background", "colorization", "text")
+    }
+
+
+def probe_image(data):
+    """
+    Reads an image's format, dimensions and colour mode from its header only, without decoding pixels.
+    Accepts raw header bytes or a seekable stream. Returns (format, width, height, mode).
+    Raises an exception if the data is not a recognised image or exceeds MAX_IMAGE_PIXELS.
+    """
+    Image = pil_image()
+    stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    with Image.open(stream) as image:
+        if image.width * image.height > Config.MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image has {image.width * image.height} pixels, limit is {Config.MAX_IMAGE_PIXELS}"
+            )
+        return image.format, image.width, image.height, image.mode
+
+
+def needs_conversion(image_format, mode):
+    """Returns True unless the image can be uploaded byte-for-byte."""
+    return image_format not in PASSTHROUGH_FORMATS or mode not in PASSTHROUGH_MODES
+
+
+def convert_image(data, target_format="PNG", quality=90):
+    """
+    Decodes an image and re-encodes it as RGB in the target format.
+    Quality applies to lossy formats only. Returns (bytes, content_type).
+    """
+    Image = pil_image()
+    with Image.open(io.BytesIO(data)) as image:
+        rgb = image.convert("RGB")
+    buf = io.BytesIO()
+    options = {} if target_format == "PNG" else {"quality": quality}
+    rgb.save(buf, format=target_format, **options)
+    return buf.getvalue(), Image.MIME[target_format]
+
+
 def save_file_locally(file):
     """Saves a file locally and returns its path with logging."""
     try:
@@ -60,6 +60,15 @@ export default function Gallery({ images, onRemove }) {
 
             pairs[runId][type] = img;
             pairs[runId].runId = runId;
+
+            // Runs listed by the backend carry their original's URLs alongside the result
+            if (type === 'enhanced' && img.original_url && !pairs[runId].original) {
+                pairs[runId].original = {
+                    url: img.original_url,
+                    thumbnail_url: img.original_thumbnail_url,
+                    preview_url: img.original_preview_url,
+                };
+            }
         });
 
         setPairedImages(Object.values(pairs).filter(pair => pair.original && pair.enhanced));
@@ -125,7 +134,8 @@ export default function Gallery({ images, onRemove }) {
                                 >
                                     <CardMedia
                                         component="img"
-                                        image={pair.enhanced.url}
+                                        image={pair.enhanced.thumbnail_url || pair.enhanced.url}
+                                        loading="lazy"
                                         onClick={() => open(i)}
                                         sx={{
                                             width: "100%",
@@ -363,14 +373,14 @@ export default function Gallery({ images, onRemove }) {
                     {selectedIndex !== null && pairedImages[selectedIndex] && (
                         compareMode ? (
                             <GallerySlider
-                                before={pairedImages[selectedIndex].original.url}
-                                after={pairedImages[selectedIndex].enhanced.url}
+                                before={pairedImages[selectedIndex].original.preview_url || pairedImages[selectedIndex].original.url}
+                                after={pairedImages[selectedIndex].enhanced.preview_url || pairedImages[selectedIndex].enhanced.url}
                                 isMobile={isSmallScreen}
                             />
                         ) : (
                             <Box
                                 component="img"
-                                src={pairedImages[selectedIndex].enhanced.url}
+                                src={pairedImages[selectedIndex].enhanced.preview_url || pairedImages[selectedIndex].enhanced.url}
                                 alt="Enhanced"
                                 sx={{
                                     maxWidth: "100%",
@@ -1,24 +1,36 @@
 import React, { useState, useEffect } from "react";
 import Gallery from "../components/Gallery";
-import { fetchGallery, deleteGalleryImage } from "../services/galleryService";
+import { fetchGalleryPage, deleteGalleryImage } from "../services/galleryService";
 
 export default function GalleryContainer({ user }) {
     const [images, setImages] = useState([]);
     const [error, setError]     = useState(null);
 
     useEffect(() => {
-        if (user?.email) {
-            fetchGallery(user.email)
-                .then(setImages)
-                .catch(e => setError(e.message));
-        }
+        if (!user?.email) return;
+        let cancelled = false;
+
+        // Load pages one after another, showing each as soon as it arrives
+        const loadPages = async () => {
+            let cursor = null;
+            setImages([]);
+            do {
+                const page = await fetchGalleryPage(user.email, cursor);
+                if (cancelled) return;
+                setImages(prev => [...prev, ...page.images]);
+                cursor = page.nextCursor;
+            } while (cursor);
+        };
+        loadPages().catch(e => setError(e.message));
+
+        return () => { cancelled = true; };
     }, [user]);
 
     const handleRemove = (url) => {
         const img = images.find(i => i.url === url);
         if (!img) return;
         deleteGalleryImage(user.email, img.key)
-            .then(setImages)
+            .then(deleted => setImages(prev => prev.filter(i => !deleted.includes(i.key))))
             .catch(e => setError(e.message));
     };
 
@@ -27,4 +39,4 @@ export default function GalleryContainer({ user }) {
     }
 
     return <Gallery images={images} onRemove={handleRemove} />;
-}
\ No newline at end of file
+}
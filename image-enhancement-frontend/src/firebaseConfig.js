@@ -90,4 +90,16 @@ const logout = async (setUser) => {
     }
 };
 
-export { auth, signInWithGoogle, logout };
\ No newline at end of file
+/**
+ * Build the Authorization header for backend requests from the signed-in user's ID token.
+ * Firebase refreshes the token transparently when it is close to expiry.
+ */
+const getAuthHeaders = async () => {
+    const user = auth.currentUser;
+    if (!user) {
+        throw new Error("Not signed in");
+    }
+    return { Authorization: `Bearer ${await user.getIdToken()}` };
+};
+
+export { auth, signInWithGoogle, logout, getAuthHeaders };
\ No newline at end of file
@@ -1,3 +1,5 @@
+import { getAuthHeaders } from "../firebaseConfig";
+
 // Get the backend URL from environment variables
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -6,22 +8,44 @@ if (!BACKEND_URL) {
     console.warn("REACT_APP_BACKEND_URL not set");
 }
 
+// Delay between enhancement job status checks (ms)
+const JOB_POLL_INTERVAL = 1500;
+
 /**
- * Uploads an image file and enhancement options to the backend.
- * Triggers the enhancement pipeline after upload.
+ * Polls an enhancement job until it completes.
  *
- * @param {File}   file - Image file to upload.
- * @param {string} email - User email (used for S3 path and auth).
- * @param {Object} opts - Enhancement flags (face, background, text, colorization).
- * @returns {Promise<{ originalUrl: string, enhancedUrl: string, runId: string, plots: string[] }>}
+ * @param {string} jobId - Job ID returned by POST /enhance.
+ * @returns {Promise<Object>} Final job status, including `data` on success.
  */
-export async function uploadAndEnhance(file, email, opts = {}) {
-    console.log("uploadAndEnhance()", { file, email, opts });
+async function waitForJob(jobId) {
+    if (!jobId) {
+        throw new Error("No job_id returned from /enhance");
+    }
+    const statusUrl = `${BACKEND_URL}/enhance/${jobId}`;
 
-    // Step 1: Upload the original image file to the backend
+    while (true) {
+        const res = await fetch(statusUrl, { headers: await getAuthHeaders() });
+        const job = await res.json();
+        if (!res.ok) {
+            throw new Error(job.error || "Failed to fetch enhancement status");
+        }
+        if (job.status === "done") return job;
+        if (job.status === "failed") {
+            console.error("Enhance error:", job);
+            throw new Error(job.error || "Enhancement failed");
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+}
+
+/**
+ * Uploads the file through the backend /upload endpoint.
+ *
+ * @returns {Promise<{ file_url: string, run_id: string }>}
+ */
+async function uploadViaBackend(file, opts) {
     const form = new FormData();
     form.append("file", file);
-    form.append("email", email);
     form.append("face", opts.face ? "true" : "false");
     form.append("background", opts.background ? "true" : "false");
     form.append("text", opts.text ? "true" : "false");
@@ -29,6 +53,7 @@ export async function uploadAndEnhance(file, email, opts = {}) {
 
     const uploadRes = await fetch(`${BACKEND_URL}/upload`, {
         method: "POST",
+        headers: await getAuthHeaders(),
         body: form,
     });
 
@@ -38,6 +63,81 @@ export async function uploadAndEnhance(file, email, opts = {}) {
         console.error("Upload error:", uploadJson);
         throw new Error(uploadJson.error || uploadJson.message || "Upload failed");
     }
+    return uploadJson;
+}
+
+/**
+ * Uploads the file directly to S3 using presigned credentials from the backend,
+ * then asks the backend to validate and register it.
+ *
+ * @returns {Promise<{ file_url: string, run_id: string }>}
+ */
+async function uploadDirect(file, opts) {
+    const postJson = async (path, body) => {
+        const res = await fetch(`${BACKEND_URL}${path}`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json", ...(await getAuthHeaders()) },
+            body: JSON.stringify(body),
+        });
+        const json = await res.json();
+        if (!res.ok) throw new Error(json.error || json.message || `${path} failed`);
+        return json;
+    };
+
+    // Ask the backend for upload credentials
+    const presign = await postJson("/upload/presign", {
+        filename: file.name,
+        content_type: file.type,
+        size: file.size,
+        face: !!opts.face,
+        background: !!opts.background,
+        text: !!opts.text,
+        colorization: !!opts.colorization
+    });
+
+    const complete = { run_id: presign.run_id, key: presign.key };
+
+    if (presign.mode === "multipart") {
+        // Upload each part to its presigned URL and collect the ETags
+        complete.upload_id = presign.upload_id;
+        complete.parts = await Promise.all(presign.part_urls.map(async (url, i) => {
+            const chunk = file.slice(i * presign.part_size, (i + 1) * presign.part_size);
+            const res = await fetch(url, { method: "PUT", body: chunk });
+            if (!res.ok) throw new Error(`Part ${i + 1} upload failed`);
+            return { PartNumber: i + 1, ETag: res.headers.get("ETag") };
+        }));
+    } else {
+        // Single presigned POST; the file must be the last form field
+        const form = new FormData();
+        Object.entries(presign.post.fields).forEach(([k, v]) => form.append(k, v));
+        form.append("file", file);
+        const res = await fetch(presign.post.url, { method: "POST", body: form });
+        if (!res.ok) throw new Error("S3 upload failed");
+    }
+
+    return postJson("/upload/complete", complete);
+}
+
+/**
+ * Uploads an image file and enhancement options to the backend.
+ * Triggers the enhancement pipeline after upload.
+ *
+ * @param {File}   file - Image file to upload.
+ * @param {string} email - User email (the backend identifies the user by ID token).
+ * @param {Object} opts - Enhancement flags (face, background, text, colorization).
+ * @returns {Promise<{ originalUrl: string, enhancedUrl: string, runId: string, plots: string[] }>}
+ */
+export async function uploadAndEnhance(file, email, opts = {}) {
+    console.log("uploadAndEnhance()", { file, email, opts });
+
+    // Step 1: Upload the original straight to S3, falling back to the backend upload
+    let uploadJson;
+    try {
+        uploadJson = await uploadDirect(file, opts);
+    } catch (err) {
+        console.warn("Direct upload failed, falling back to /upload:", err);
+        uploadJson = await uploadViaBackend(file, opts);
+    }
 
     const fileUrl = uploadJson.file_url;
     if (!fileUrl) {
@@ -47,10 +147,9 @@ export async function uploadAndEnhance(file, email, opts = {}) {
     // Step 2: Call the enhancement endpoint with the uploaded image URL and options
     const enhanceRes = await fetch(`${BACKEND_URL}/enhance`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...(await getAuthHeaders()) },
         body: JSON.stringify({
             file_url: fileUrl,
-            email,
             run_id: uploadJson.run_id, // Use the same run_id to keep enhancement linked to upload
             face: opts.face,
             background: opts.background,
@@ -73,6 +172,9 @@ export async function uploadAndEnhance(file, email, opts = {}) {
         throw new Error(enhanceJson.error || "Enhancement failed");
     }
 
+    // Step 3: The backend queues the job; wait until it finishes
+    enhanceJson = await waitForJob(enhanceJson.job_id);
+
     // Extract expected values from the enhancement response
     const enhancedUrl = enhanceJson?.data?.enhanced_url;
     const originalUrl = enhanceJson?.data?.original_url;
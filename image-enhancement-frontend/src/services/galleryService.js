@@ -1,41 +1,51 @@
+import { getAuthHeaders } from "../firebaseConfig";
+
 // Base URL for Flask backend, loaded from environment variable
 const BACKEND = process.env.REACT_APP_BACKEND_URL;
 
 /**
- * Fetch the user's enhanced image gallery from the backend.
- * @param {string} email - User's email address.
- * @returns {Promise<Array>} List of image objects: [{ url, key, enhancements }, ...]
+ * Fetch one page of the signed-in user's enhanced image gallery from the backend (newest first).
+ * @param {string} email - User's email address (the backend identifies the user by ID token).
+ * @param {string|null} cursor - `nextCursor` of the previous page, or null for the first page.
+ * @param {number} [limit] - Requested page size (capped by the server).
+ * @returns {Promise<{ images: Array, nextCursor: string|null }>} Page of image objects: [{ url, key, enhancements }, ...]
  */
-export async function fetchGallery(email) {
-    // Make GET request to the gallery endpoint with the user's email
-    const res = await fetch(`${BACKEND}/gallery?email=${encodeURIComponent(email)}`);
+export async function fetchGalleryPage(email, cursor = null, limit) {
+    // Build the query string for the requested page
+    const params = new URLSearchParams();
+    if (cursor) params.set("cursor", cursor);
+    if (limit) params.set("limit", String(limit));
+
+    const res = await fetch(`${BACKEND}/gallery?${params.toString()}`, {
+        headers: await getAuthHeaders()
+    });
     const j   = await res.json();
 
     // Throw error if request failed
     if (!res.ok) throw new Error(j.error || "Failed to fetch gallery");
 
-    // Return image metadata array
-    return j.images;
+    // Return image metadata array and the cursor of the next page
+    return { images: j.images, nextCursor: j.next_cursor };
 }
 
 /**
- * Delete a specific image from the user's gallery.
- * @param {string} email - User's email address.
+ * Delete a specific image from the signed-in user's gallery.
+ * @param {string} email - User's email address (the backend identifies the user by ID token).
  * @param {string} key - S3 object key of the image to delete.
- * @returns {Promise<Array>} Updated list of images after deletion.
+ * @returns {Promise<string[]>} Keys removed by the backend.
  */
 export async function deleteGalleryImage(email, key) {
-    // Make DELETE request with email and image key in the body
+    // Make authenticated DELETE request with the image key in the body
     const res = await fetch(`${BACKEND}/gallery`, {
         method: "DELETE",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ email, key })
+        headers: { "Content-Type": "application/json", ...(await getAuthHeaders()) },
+        body: JSON.stringify({ key })
     });
     const j = await res.json();
 
     // Throw error if deletion failed
     if (!res.ok) throw new Error(j.error || "Failed to delete image");
 
-    // Return updated image list
-    return j.images;
-}
\ No newline at end of file
+    // Return the deleted keys so the caller can update its list in place
+    return j.deleted;
+}